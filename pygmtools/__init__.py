@@ -11,13 +11,15 @@
 from .benchmark import Benchmark
 from .linear_solvers import sinkhorn, hungarian
 from .classic_solvers import rrwm, sm, ipfp, astar
-from .multi_graph_solvers import cao, mgm_floyd, gamgm
+from .multi_graph_solvers import cao, mgm_floyd, mgm_floyd_online, gamgm
 from .neural_solvers import pca_gm, ipca_gm, cie, ngm, genn_astar
 import pygmtools.utils as utils
 import importlib.util
 set_backend = utils.set_backend
 
 BACKEND = 'numpy'
+NPROC = 1
+COMPUTE_DTYPE = None
 __version__ = '0.5.5'
 __author__ = 'ThinkLab at SJTU'
 
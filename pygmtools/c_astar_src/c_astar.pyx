@@ -3,19 +3,20 @@ import torch
 import numpy as np
 cimport cython
 cimport numpy as np
+from time import perf_counter
 #from libcpp.queue cimport priority_queue
 from libcpp.vector cimport vector
-from libcpp.pair cimport pair
 from libcpp cimport bool
 
 cdef extern from "priority_queue.hpp":
     cdef cppclass TreeNode:
         TreeNode()
-        TreeNode(long)
-        #TreeNode(vector[pair[long, long]], double, long)
-        pair[vector[long], vector[long]] x_indices
+        TreeNode(long, long, long)
         double gplsh
+        double lower_bound
         long idx
+        long parent
+        long col
 
     cdef cppclass tree_node_priority_queue:
         tree_node_priority_queue(...) # get Cython to accept any arguments and let C++ deal with getting them right
@@ -25,6 +26,18 @@ cdef extern from "priority_queue.hpp":
         bool empty()
         long size()
 
+    cdef cppclass NodePool:
+        NodePool()
+        long add(TreeNode &)
+        void x_indices(TreeNode &, long, long, vector[long] &, vector[long] &, vector[char] &)
+
+cdef extern from "lsap.hpp":
+    vector[double] node_cost_matrix(const double *, long, long) nogil
+
+    cdef cppclass IncrementalGEDBound:
+        IncrementalGEDBound(const double *, long, long, vector[long] &, vector[long] &) nogil
+        double child_bound(long) nogil
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -39,15 +52,42 @@ def c_astar(
         long beam_width=0,
         double trust_fact=1.,
         long no_pred_size=0,
+        double epsilon=0.,
+        double time_budget=0.,
+        long max_expansions=0,
 ):
+    # epsilon > 0 turns on weighted A* (the heuristic is weighted by 1 + epsilon), whose solution costs at most
+    # (1 + epsilon) times the optimal one if the heuristic is admissible.
+    # If the number of expanded nodes reaches max_expansions or the search has run for time_budget seconds (0 = no
+    # limit), the open set is dropped and the search dives greedily (as beam_width=1) from the best open node. The
+    # returned matching is the best complete one found so far, and the returned lower bound is the minimal
+    # g + h * trust_fact of the open set when the budget ran out (it is a valid bound on the optimal cost only if
+    # beam_width=0, and h is admissible with trust_fact <= 1).
     # declare static dtypes
-    cdef long n1, n2, _n2, ns_1b, ns_2b, max_ns_1, max_ns_2, extra_n2_cnt, tree_size
-    cdef double h_p, g_p
+    cdef long n1, n2, _n2, tree_size, selected_id
+    cdef double h_p, g_p, lower_bound, start_time
+    cdef long n_expanded = 0
     cdef tree_node_priority_queue open_set
     cdef tree_node_priority_queue cur_set
-    cdef TreeNode selected, new_node
-    cdef bool stop_flag, flag
-
+    cdef TreeNode selected, new_node, incumbent
+    cdef NodePool pool
+    cdef vector[long] rows, cols
+    cdef vector[char] used
+    cdef bool stop_flag, native_heuristic, children_h, has_incumbent = False, exhausted = False
+    cdef IncrementalGEDBound *parent_bound = NULL
+    cdef double[:, ::1] k_buf
+    cdef vector[double] node_cost
+
+    # if heuristic_func is None, the Hungarian heuristic and the cost of partial matchings are computed by C++ code
+    # on the raw buffer of k, without calling back to Python
+    native_heuristic = heuristic_func is None and not net_pred
+    if native_heuristic:
+        k_buf = k.detach().to(device='cpu', dtype=torch.float64).contiguous().numpy()
+        with nogil:
+            node_cost = node_cost_matrix(&k_buf[0, 0], ns_1, ns_2)
+
+    tree_size = 0
+    start_time = perf_counter()
     open_set = tree_node_priority_queue()
     open_set.push(TreeNode())
     ret_x = torch.zeros(ns_1+1, ns_2+1, device=k.device)
@@ -56,78 +96,88 @@ def c_astar(
     while not stop_flag:
         selected = open_set.top()
         open_set.pop()
-        #selected_x_indices = torch.tensor(selected.x_indices, dtype=torch.long).reshape(-1, 2)
         if selected.idx == ns_1:
             stop_flag = True
-            #indices = selected_x_indices
-            #v = torch.ones(indices.shape[0], device=k.device)
-            #x = torch.sparse.FloatTensor(indices.t(), v, x_size).to_dense()
-            ret_x[selected.x_indices] = 1
+            if not exhausted:
+                lower_bound = drain_lower_bound(open_set, selected) if epsilon > 0 else selected.lower_bound
+            # weighted/beam search may have generated a better complete matching than the selected one
+            if has_incumbent and incumbent.gplsh < selected.gplsh:
+                selected = incumbent
+            pool.x_indices(selected, ns_1, ns_2, rows, cols, used)
+            ret_x[rows, cols] = 1
             continue
 
+        # the root node has no heuristic, thus it is always expanded
+        if not exhausted and n_expanded > 0 and (max_expansions > 0 and n_expanded >= max_expansions or
+                                                 time_budget > 0 and perf_counter() - start_time >= time_budget):
+            # out of budget: record the lower bound and dive greedily from the selected node
+            exhausted = True
+            lower_bound = drain_lower_bound(open_set, selected)
+            beam_width = 1
+        n_expanded += 1
+
         if beam_width > 0:
             cur_set = tree_node_priority_queue()
-        flag = False
+
+        # the partial matching of the selected node, shared by its children through the node pool
+        selected_id = pool.add(selected)
+        pool.x_indices(selected, ns_1, ns_2, rows, cols, used)
+
+        # the heuristic of all children is computed from the LSAP solution of the selected node
+        children_h = not (selected.idx + 1 == ns_1 or trust_fact <= 0. or ns_1 - (selected.idx + 1) < no_pred_size)
+        if native_heuristic and children_h:
+            with nogil:
+                parent_bound = new_parent_bound(node_cost, selected, used, ns_1, ns_2)
         for n2 in range(ns_2 + 1):
-            if n2 != ns_2 and is_in(n2, selected.x_indices.second):
+            if n2 != ns_2 and used[n2]:
                 continue
-            if selected.idx + 1 == ns_1:
-                flag = True
-                extra_n2_cnt = 0
-                for _n2 in range(ns_2):
-                    if _n2 != n2 and not is_in(_n2, selected.x_indices.second):
-                        extra_n2_cnt += 1
-                new_node = TreeNode(ns_1 + extra_n2_cnt)
-                n1 = 0
-                for _ in range(selected.idx):
-                    new_node.x_indices.first[n1] = selected.x_indices.first[n1]
-                    new_node.x_indices.second[n1] = selected.x_indices.second[n1]
-                    n1 += 1
-                new_node.x_indices.first[n1] = selected.idx
-                new_node.x_indices.second[n1] = n2
-                n1 += 1
+            new_node = TreeNode(selected.idx + 1, selected_id, n2)
+
+            # rows/cols: the matching of the child, the graph2 nodes left by a complete child are inserted
+            rows.push_back(selected.idx)
+            cols.push_back(n2)
+            if new_node.idx == ns_1:
                 for _n2 in range(ns_2):
-                    if _n2 != n2 and not is_in(_n2, selected.x_indices.second):
-                        new_node.x_indices.first[n1] = ns_1
-                        new_node.x_indices.second[n1] = _n2
-                        n1 += 1
+                    if _n2 != n2 and not used[_n2]:
+                        rows.push_back(ns_1)
+                        cols.push_back(_n2)
+
+            if native_heuristic:
+                with nogil:
+                    g_p = comp_ged_native(k_buf, rows, cols, ns_2)
+                    if children_h:
+                        h_p = parent_bound.child_bound(n2)
+                    else:
+                        h_p = 0
             else:
-                new_node = TreeNode(selected.idx + 1)
-                n1 = 0
-                for _ in range(selected.idx):
-                    new_node.x_indices.first[n1] = selected.x_indices.first[n1]
-                    new_node.x_indices.second[n1] = selected.x_indices.second[n1]
-                    n1 += 1
-                new_node.x_indices.first[n1] = selected.idx
-                new_node.x_indices.second[n1] = n2
-                n1 += 1
-
-            x_dense[:] = 0
-            x_dense[new_node.x_indices] = 1
-
-            g_p = comp_ged(x_dense, k)
-
-            if net_pred:
-                if selected.idx + 1 == ns_1 or trust_fact <= 0. or ns_1 - (selected.idx + 1) < no_pred_size:
+                x_dense[:] = 0
+                x_dense[rows, cols] = 1
+
+                g_p = comp_ged(x_dense, k)
+
+                if not children_h:
                     h_p = 0
-                else:
+                elif net_pred:
                     h_p = net_pred_func(data, x_dense)
-            else:
-                if selected.idx + 1 == ns_1 or trust_fact <= 0. or ns_1 - (selected.idx + 1) < no_pred_size:
-                    h_p = 0
                 else:
                     h_p = heuristic_func(k, ns_1, ns_2, x_dense)
+            rows.resize(selected.idx)
+            cols.resize(selected.idx)
 
-            new_node.gplsh = g_p + h_p * trust_fact
-            new_node.idx = selected.idx + 1
+            new_node.lower_bound = g_p + h_p * trust_fact
+            new_node.gplsh = g_p + h_p * trust_fact * (1 + epsilon)
+            if new_node.idx == ns_1 and (not has_incumbent or new_node.gplsh < incumbent.gplsh):
+                incumbent = new_node
+                has_incumbent = True
 
             if beam_width > 0:
                 cur_set.push(new_node)
             else:
                 open_set.push(new_node)
                 tree_size += 1
-            if flag:
-                continue
+
+        if native_heuristic and children_h:
+            del parent_bound
 
         if beam_width > 0:
             for i in range(min(beam_width, cur_set.size())):
@@ -135,18 +185,46 @@ def c_astar(
                 cur_set.pop()
                 tree_size += 1
 
-    return ret_x, tree_size
+    return ret_x, tree_size, lower_bound
+
+
+cdef double drain_lower_bound(tree_node_priority_queue &open_set, TreeNode &selected):
+    # empty the open set, and return the minimal lower bound among its nodes and the selected node
+    cdef double ret = selected.lower_bound
+    while not open_set.empty():
+        ret = min(ret, open_set.top().lower_bound)
+        open_set.pop()
+    return ret
 
 
 cdef double comp_ged(_x, _k):
     return torch.mm(torch.mm(_x.reshape( 1, -1), _k), _x.reshape( -1, 1))
 
 
-cdef bool is_in (long inp, vector[long] vec):
-    cdef unsigned long i
-    cdef bool ret = False
-    for i in range(vec.size()):
-        if inp == vec[i]:
-            ret = True
-            break
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double comp_ged_native(double[:, ::1] k, vector[long] &rows, vector[long] &cols, long ns_2) nogil:
+    # x^T k x for the partial matching x given by its indices (rows, cols)
+    cdef double ret = 0
+    cdef unsigned long i, j
+    cdef long p, q
+    for i in range(rows.size()):
+        p = rows[i] * (ns_2 + 1) + cols[i]
+        for j in range(rows.size()):
+            q = rows[j] * (ns_2 + 1) + cols[j]
+            ret += k[p, q]
     return ret
+
+
+cdef IncrementalGEDBound *new_parent_bound(vector[double] &node_cost, TreeNode &node, vector[char] &used,
+                                           long ns_1, long ns_2) nogil:
+    # the bipartite lower bound of the unmatched nodes of the tree node, the same as heuristic_prediction_hun in
+    # pytorch_astar_modules. The bounds of its children are repaired from it by IncrementalGEDBound.child_bound
+    cdef vector[long] rows, cols
+    cdef long n1, n2
+    for n1 in range(node.idx, ns_1):
+        rows.push_back(n1)
+    for n2 in range(ns_2):
+        if not used[n2]:
+            cols.push_back(n2)
+    return new IncrementalGEDBound(node_cost.data(), ns_1, ns_2, rows, cols)
@@ -0,0 +1,228 @@
+#include <vector>
+#include <limits>
+#include <algorithm>
+
+const double LSAP_INF = std::numeric_limits<double>::infinity();
+
+// Linear sum assignment problem (LSAP) on a dense n x n row-major cost matrix, solved by the shortest augmenting
+// path algorithm (the same algorithm as scipy.optimize.linear_sum_assignment). Entries of +inf are forbidden.
+struct LSAP
+{
+    const double *cost;
+    long n;
+    std::vector<double> u, v;
+    std::vector<long> col4row, row4col;
+    LSAP();
+    LSAP(const double *, const long &);
+    double solve();
+    bool augment(const long &);
+};
+
+LSAP::LSAP()
+{
+    this->cost = nullptr;
+    this->n = 0;
+}
+
+LSAP::LSAP(const double *cost, const long &n)
+{
+    this->cost = cost;
+    this->n = n;
+    this->u = std::vector<double>(n, 0);
+    this->v = std::vector<double>(n, 0);
+    this->col4row = std::vector<long>(n, -1);
+    this->row4col = std::vector<long>(n, -1);
+}
+
+// find the shortest augmenting path from the free row cur_row, then update the dual variables and the matching
+bool LSAP::augment(const long &cur_row)
+{
+    std::vector<double> shortest_path_costs(n, LSAP_INF);
+    std::vector<long> path(n, -1), remaining(n);
+    std::vector<char> SR(n, 0), SC(n, 0);
+    long num_remaining = n, i = cur_row, j, sink = -1;
+    double min_val = 0;
+    for (long it = 0; it < n; it++)
+        remaining[it] = n - it - 1;
+
+    while (sink == -1)
+    {
+        long index = -1;
+        double lowest = LSAP_INF;
+        SR[i] = 1;
+        for (long it = 0; it < num_remaining; it++)
+        {
+            j = remaining[it];
+            double r = min_val + cost[i * n + j] - u[i] - v[j];
+            if (r < shortest_path_costs[j])
+            {
+                path[j] = i;
+                shortest_path_costs[j] = r;
+            }
+            // prefer a free column on ties, so that the path is terminated as early as possible
+            if (shortest_path_costs[j] < lowest || (shortest_path_costs[j] == lowest && row4col[j] == -1))
+            {
+                lowest = shortest_path_costs[j];
+                index = it;
+            }
+        }
+        min_val = lowest;
+        if (min_val == LSAP_INF) // infeasible
+            return false;
+        j = remaining[index];
+        if (row4col[j] == -1)
+            sink = j;
+        else
+            i = row4col[j];
+        SC[j] = 1;
+        remaining[index] = remaining[--num_remaining];
+    }
+
+    u[cur_row] += min_val;
+    for (i = 0; i < n; i++)
+        if (SR[i] && i != cur_row)
+            u[i] += min_val - shortest_path_costs[col4row[i]];
+    for (j = 0; j < n; j++)
+        if (SC[j])
+            v[j] -= min_val - shortest_path_costs[j];
+
+    j = sink;
+    while (true)
+    {
+        i = path[j];
+        row4col[j] = i;
+        std::swap(col4row[i], j);
+        if (i == cur_row)
+            break;
+    }
+    return true;
+}
+
+// solve the LSAP and return the minimal cost (+inf if there is no feasible assignment)
+double LSAP::solve()
+{
+    double ret = 0;
+    for (long i = 0; i < n; i++)
+        if (col4row[i] == -1 && !augment(i))
+            return LSAP_INF;
+    for (long i = 0; i < n; i++)
+        ret += cost[i * n + col4row[i]];
+    return ret;
+}
+
+// The LSAP cost matrix of the bipartite lower bound of GED (Riesen et al. 2007) for the node cost matrix C of shape
+// (n1+1) x (n2+1), where the last row/column is the dummy node. Only the rows (graph1 nodes) and columns (graph2 nodes)
+// in the given lists are considered. The matrix is (r+c) x (r+c): [[C_sub, diag(C_del)], [diag(C_ins), 0]].
+std::vector<double> bipartite_ged_cost(const double *node_cost, const long &n1, const long &n2,
+                                       const std::vector<long> &rows, const std::vector<long> &cols)
+{
+    long r = rows.size(), c = cols.size(), n = r + c;
+    std::vector<double> large_cost(n * n, LSAP_INF);
+    for (long i = 0; i < r; i++)
+    {
+        for (long j = 0; j < c; j++)
+            large_cost[i * n + j] = node_cost[rows[i] * (n2 + 1) + cols[j]];
+        large_cost[i * n + c + i] = node_cost[rows[i] * (n2 + 1) + n2];
+    }
+    for (long j = 0; j < c; j++)
+    {
+        large_cost[(r + j) * n + j] = node_cost[n1 * (n2 + 1) + cols[j]];
+        std::fill(large_cost.begin() + (r + j) * n + c, large_cost.begin() + (r + j + 1) * n, 0);
+    }
+    return large_cost;
+}
+
+// The bipartite lower bound of GED, see bipartite_ged_cost
+double bipartite_ged_bound(const double *node_cost, const long &n1, const long &n2,
+                           const std::vector<long> &rows, const std::vector<long> &cols)
+{
+    std::vector<double> large_cost = bipartite_ged_cost(node_cost, n1, n2, rows, cols);
+    LSAP lsap(large_cost.data(), rows.size() + cols.size());
+    return lsap.solve();
+}
+
+// The bipartite lower bound of GED of a tree node, kept together with its LSAP solution. The children of the node
+// match the first row rows[0] to one of cols (or delete it). Their LSAP is the parent one without the large rows/columns
+// of the matched nodes, so the dual potentials of the parent stay feasible and at most two rows lose their assignment.
+// Each child bound is repaired by at most two augmentations in O(n^2), instead of being solved from scratch in O(n^3).
+struct IncrementalGEDBound
+{
+    long n2, r, c;
+    std::vector<long> cols;
+    std::vector<double> large_cost;
+    LSAP lsap;
+    IncrementalGEDBound(const double *, const long &, const long &, const std::vector<long> &, const std::vector<long> &);
+    double child_bound(const long &);
+};
+
+IncrementalGEDBound::IncrementalGEDBound(const double *node_cost, const long &n1, const long &n2,
+                                         const std::vector<long> &rows, const std::vector<long> &cols)
+{
+    this->n2 = n2;
+    this->r = rows.size();
+    this->c = cols.size();
+    this->cols = cols;
+    this->large_cost = bipartite_ged_cost(node_cost, n1, n2, rows, cols);
+    this->lsap = LSAP(this->large_cost.data(), this->r + this->c);
+    this->lsap.solve();
+}
+
+// the bound of the child that matches rows[0] to the graph2 node col (col == n2 means rows[0] is deleted)
+double IncrementalGEDBound::child_bound(const long &col)
+{
+    long pos = std::find(cols.begin(), cols.end(), col) - cols.begin(), n = r + c, m;
+    if (col == n2)
+        pos = -1;
+
+    // the child LSAP keeps the same block layout, row_map/col_map map its rows/columns to the parent ones
+    std::vector<long> row_map, col_map, col_inv(n, -1);
+    for (long i = 1; i < r; i++)
+        row_map.push_back(i);
+    for (long j = 0; j < c; j++)
+        if (j != pos)
+            row_map.push_back(r + j);
+    for (long j = 0; j < c; j++)
+        if (j != pos)
+            col_map.push_back(j);
+    for (long i = 1; i < r; i++)
+        col_map.push_back(c + i);
+    m = row_map.size();
+    for (long j = 0; j < m; j++)
+        col_inv[col_map[j]] = j;
+
+    std::vector<double> child_cost(m * m);
+    for (long i = 0; i < m; i++)
+        for (long j = 0; j < m; j++)
+            child_cost[i * m + j] = large_cost[row_map[i] * n + col_map[j]];
+
+    LSAP child(child_cost.data(), m);
+    for (long j = 0; j < m; j++)
+        child.v[j] = lsap.v[col_map[j]];
+    for (long i = 0; i < m; i++)
+    {
+        long j = col_inv[lsap.col4row[row_map[i]]];
+        child.u[i] = lsap.u[row_map[i]];
+        if (j != -1)
+        {
+            child.col4row[i] = j;
+            child.row4col[j] = i;
+        }
+    }
+    return child.solve();
+}
+
+// The node cost matrix of shape (n1+1) x (n2+1) from the padded cost matrix k of shape (n1+1)(n2+1) x (n1+1)(n2+1):
+// the cost of matching node i to node a is lower bounded by the bipartite bound on the edge costs of row (i, a) of k
+std::vector<double> node_cost_matrix(const double *k, const long &n1, const long &n2)
+{
+    long n1n2 = (n1 + 1) * (n2 + 1);
+    std::vector<double> node_cost(n1n2, 0);
+    std::vector<long> rows(n1), cols(n2);
+    for (long i = 0; i < n1; i++)
+        rows[i] = i;
+    for (long j = 0; j < n2; j++)
+        cols[j] = j;
+    for (long p = 0; p < n1n2 - 1; p++) // the last one (dummy, dummy) is never used
+        node_cost[p] = bipartite_ged_bound(k + p * n1n2, n1, n2, rows, cols);
+    return node_cost;
+}
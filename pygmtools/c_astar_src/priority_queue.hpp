@@ -1,36 +1,37 @@
 #include <functional>
 #include <queue>
+#include <vector>
 
+// A node of the search tree is a fixed-size record: its partial matching is not copied into the node, but shared with
+// its ancestors through the parent pointers of the NodePool
 struct TreeNode
 {
-    std::pair<std::vector<long>, std::vector<long> > x_indices;
     double gplsh;
-    long idx;
+    double lower_bound;
+    long idx;    // the first idx nodes of graph1 are matched
+    long parent; // id of the parent node in the NodePool (-1 for the root)
+    long col;    // the graph2 node matched to the graph1 node idx-1 (n2 means the graph1 node is deleted)
     TreeNode();
-    TreeNode(const int &);
-    TreeNode(const std::pair<std::vector<long>, std::vector<long> > &, const double &, const long &);
+    TreeNode(const long &, const long &, const long &);
     bool operator>(const TreeNode &) const;
 };
 
 TreeNode::TreeNode()
 {
-    this->x_indices = std::pair<std::vector<long>, std::vector<long> >();
     this->gplsh = 0;
+    this->lower_bound = 0;
     this->idx = 0;
+    this->parent = -1;
+    this->col = -1;
 }
 
-TreeNode::TreeNode(const int & len)
+TreeNode::TreeNode(const long &idx, const long &parent, const long &col)
 {
-    this->x_indices = std::pair<std::vector<long>, std::vector<long> >(std::vector<long>(len), std::vector<long>(len));
     this->gplsh = 0;
-    this->idx = 0;
-}
-
-TreeNode::TreeNode(const std::pair<std::vector<long>, std::vector<long> > &x_indices, const double &gplsh, const long &idx)
-{
-    this->x_indices = x_indices;
-    this->gplsh = gplsh;
+    this->lower_bound = 0;
     this->idx = idx;
+    this->parent = parent;
+    this->col = col;
 }
 
 bool TreeNode::operator>(const TreeNode &c) const
@@ -39,3 +40,47 @@ bool TreeNode::operator>(const TreeNode &c) const
 }
 
 using tree_node_priority_queue = std::priority_queue<TreeNode, std::vector<TreeNode>, std::greater<TreeNode> >;
+
+// The expanded tree nodes, each one is stored as its parent id and its last matched graph2 node
+struct NodePool
+{
+    std::vector<long> parent, col;
+    long add(const TreeNode &);
+    void x_indices(const TreeNode &, const long &, const long &,
+                   std::vector<long> &, std::vector<long> &, std::vector<char> &) const;
+};
+
+// add an expanded node to the pool, and return its id (the parent id of its children)
+long NodePool::add(const TreeNode &node)
+{
+    this->parent.push_back(node.parent);
+    this->col.push_back(node.col);
+    return this->parent.size() - 1;
+}
+
+// the indices (rows, cols) of the partial matching of the node, following the parent pointers in O(idx). If the node
+// is complete (idx == n1), the unmatched graph2 nodes are inserted (matched to the dummy row n1). used[j] (of size
+// n2+1) is set if the graph2 node j is matched, for O(1) membership tests
+void NodePool::x_indices(const TreeNode &node, const long &n1, const long &n2,
+                         std::vector<long> &rows, std::vector<long> &cols, std::vector<char> &used) const
+{
+    rows.resize(node.idx);
+    cols.resize(node.idx);
+    used.assign(n2 + 1, 0);
+    long p = node.parent;
+    for (long i = node.idx - 1; i >= 0; i--)
+    {
+        rows[i] = i;
+        cols[i] = (i == node.idx - 1) ? node.col : this->col[p];
+        if (i != node.idx - 1)
+            p = this->parent[p];
+        used[cols[i]] = 1;
+    }
+    if (node.idx == n1)
+        for (long j = 0; j < n2; j++)
+            if (!used[j])
+            {
+                rows.push_back(n1);
+                cols.push_back(j);
+            }
+}
@@ -42,7 +42,7 @@ from pygmtools.utils import NOT_IMPLEMENTED_MSG, _check_shape, _get_shape,\
 import numpy as np
 
 def sm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
-       max_iter: int=50,
+       max_iter: int=50, return_iter: bool=False, eigen_solver: str='power',
        backend=None):
     r"""
     Spectral Graph Matching solver for graph matching (Lawler's QAP).
@@ -64,8 +64,13 @@ def sm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
                If not given, x0 will be randomly generated.
     :param max_iter: (default: 50) max number of iterations. More iterations will help the solver to converge better,
                      at the cost of increased inference time.
+    :param return_iter: (default: False) whether to return the number of iterations performed for each instance
+    :param eigen_solver: (default: ``'power'``) the method to compute the leading eigenvector. ``'power'``: power
+                         iteration; ``'lanczos'``: the Lanczos method (``scipy.sparse.linalg.eigsh``);
+                         ``'lobpcg'``: the LOBPCG method (``scipy.sparse.linalg.lobpcg`` or ``torch.lobpcg``)
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
-    :return: :math:`(b\times n_1 \times n_2)` the solved doubly-stochastic matrix
+    :return: :math:`(b\times n_1 \times n_2)` the solved doubly-stochastic matrix. If ``return_iter=True``, also return
+             :math:`(b)` the number of iterations of each instance
 
     .. note::
         Either ``n1`` or ``n1max`` should be specified because it cannot be inferred from the input tensor size.
@@ -79,6 +84,26 @@ def sm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
     .. note::
         This function also supports non-batched input, by ignoring all batch dimensions in the input tensors.
 
+    .. note::
+        The convergence is checked for each instance in the batch. The converged instances are removed from the batch,
+        so that the following iterations are only performed on the unconverged ones, and the result of each instance
+        does not depend on the other instances. ``return_iter`` is supported by ``numpy``, ``pytorch``, ``paddle`` and
+        ``jittor`` backends.
+
+    .. note::
+        For ``numpy`` and ``pytorch`` backends, ``K`` can also be a sparse matrix built by
+        :func:`~pygmtools.utils.build_aff_mat` with ``layout='sparse'``, or a
+        :class:`~pygmtools.utils.FactorizedAffinity` object built with ``layout='factorized'``. Their memory cost grows
+        with the number of edges instead of :math:`(n_1n_2)^2`, which is preferred for large graphs.
+
+    .. note::
+        Power iteration converges slowly if the largest two eigenvalues of ``K`` are close. The Krylov methods
+        ``eigen_solver='lanczos'`` and ``eigen_solver='lobpcg'`` usually need far fewer matrix-vector products in such
+        cases. They assume ``K`` is symmetric, solve each instance separately on its non-padded entries, and run at
+        most ``max_iter`` iterations of the Krylov method. If ``return_iter=True``, the number of matrix-vector
+        products is returned. ``'lanczos'`` and ``'lobpcg'`` are supported by ``numpy`` backend with all layouts of
+        ``K``. ``'lobpcg'`` is also supported by ``pytorch`` backend with dense or sparse ``K``.
+
     .. note::
         This solver is differentiable and supports gradient back-propagation.
 
@@ -398,7 +423,13 @@ def sm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
         raise ValueError(f'the input argument K is expected to be 2-dimensional or 3-dimensional, got '
                          f'K:{len(_get_shape(K, backend))}dims!')
     __check_gm_arguments(n1, n2, n1max, n2max)
+    if eigen_solver not in ('power', 'lanczos', 'lobpcg'):
+        raise ValueError(f'Unknown eigen_solver: {eigen_solver}. Supported: power, lanczos, lobpcg.')
+    if eigen_solver == 'lanczos' and backend != 'numpy' or \
+            eigen_solver == 'lobpcg' and backend not in ('numpy', 'pytorch'):
+        raise NotImplementedError(f'eigen_solver={eigen_solver} is not supported by {backend} backend.')
     args = (K, n1, n2, n1max, n2max, x0, max_iter)
+    kwargs = {} if eigen_solver == 'power' else {'eigen_solver': eigen_solver}
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
         fn = mod.sm
@@ -406,15 +437,24 @@ def sm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
         raise NotImplementedError(
             NOT_IMPLEMENTED_MSG.format(backend)
         )
-    result = fn(*args)
+    if not return_iter:
+        result = fn(*args, **kwargs)
+        if non_batched_input:
+            return _squeeze(result, 0, backend)
+        else:
+            return result
+
+    if backend in ('mindspore', 'tensorflow'):
+        raise NotImplementedError(f'return_iter is not supported by {backend} backend.')
+    result, num_iter = fn(*args, True, **kwargs)
     if non_batched_input:
-        return _squeeze(result, 0, backend)
+        return _squeeze(result, 0, backend), _squeeze(num_iter, 0, backend)
     else:
-        return result
+        return result, num_iter
 
 
 def rrwm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
-         max_iter: int=50, sk_iter: int=20, alpha: float=0.2, beta: float=30,
+         max_iter: int=50, sk_iter: int=20, alpha: float=0.2, beta: float=30, return_iter: bool=False,
          backend=None):
     r"""
     Reweighted Random Walk Matching (RRWM) solver for graph matching (Lawler's QAP). This algorithm is implemented by
@@ -439,8 +479,10 @@ def rrwm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
     :param beta: (default: 30) the temperature parameter of exponential function before the Sinkhorn operator.
                  ``beta`` should be larger than 0. A larger ``beta`` means more confidence in the jump. A larger
                  ``beta`` will usually require a larger ``sk_iter``.
+    :param return_iter: (default: False) whether to return the number of iterations performed for each instance
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
-    :return: :math:`(b\times n_1 \times n_2)` the solved matching matrix
+    :return: :math:`(b\times n_1 \times n_2)` the solved matching matrix. If ``return_iter=True``, also return
+             :math:`(b)` the number of iterations of each instance
 
     .. note::
         Either ``n1`` or ``n1max`` should be specified because it cannot be inferred from the input tensor size.
@@ -454,6 +496,18 @@ def rrwm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
     .. note::
         This function also supports non-batched input, by ignoring all batch dimensions in the input tensors.
 
+    .. note::
+        The convergence is checked for each instance in the batch. The converged instances are removed from the batch,
+        so that the following iterations are only performed on the unconverged ones, and the result of each instance
+        does not depend on the other instances. ``return_iter`` is supported by ``numpy``, ``pytorch``, ``paddle`` and
+        ``jittor`` backends.
+
+    .. note::
+        For ``numpy`` and ``pytorch`` backends, ``K`` can also be a sparse matrix built by
+        :func:`~pygmtools.utils.build_aff_mat` with ``layout='sparse'``, or a
+        :class:`~pygmtools.utils.FactorizedAffinity` object built with ``layout='factorized'``. Their memory cost grows
+        with the number of edges instead of :math:`(n_1n_2)^2`, which is preferred for large graphs.
+
     .. note::
         This solver is differentiable and supports gradient back-propagation.
 
@@ -765,15 +819,24 @@ def rrwm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
         raise NotImplementedError(
             NOT_IMPLEMENTED_MSG.format(backend)
         )
-    result = fn(*args)
+    if not return_iter:
+        result = fn(*args)
+        if non_batched_input:
+            return _squeeze(result, 0, backend)
+        else:
+            return result
+
+    if backend in ('mindspore', 'tensorflow'):
+        raise NotImplementedError(f'return_iter is not supported by {backend} backend.')
+    result, num_iter = fn(*args, True)
     if non_batched_input:
-        return _squeeze(result, 0, backend)
+        return _squeeze(result, 0, backend), _squeeze(num_iter, 0, backend)
     else:
-        return result
+        return result, num_iter
 
 
 def ipfp(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
-         max_iter: int=50,
+         max_iter: int=50, return_iter: bool=False,
          backend=None):
     r"""
     Integer Projected Fixed Point (IPFP) method for graph matching (Lawler's QAP).
@@ -787,8 +850,10 @@ def ipfp(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
                If not given, x0 will filled with :math:`\frac{1}{n_1 n_2})`.
     :param max_iter: (default: 50) max number of iterations in IPFP.
                      More iterations will be lead to more accurate result, at the cost of increased inference time.
+    :param return_iter: (default: False) whether to return the number of iterations performed for each instance
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
-    :return: :math:`(b\times n_1 \times n_2)` the solved matching matrix
+    :return: :math:`(b\times n_1 \times n_2)` the solved matching matrix. If ``return_iter=True``, also return
+             :math:`(b)` the number of iterations of each instance
 
     .. note::
         Either ``n1`` or ``n1max`` should be specified because it cannot be inferred from the input tensor size.
@@ -802,6 +867,23 @@ def ipfp(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
     .. note::
         This function also supports non-batched input, by ignoring all batch dimensions in the input tensors.
 
+    .. note::
+        The convergence is checked for each instance in the batch. The converged instances are removed from the batch,
+        so that the following iterations are only performed on the unconverged ones, and the result of each instance
+        does not depend on the other instances. ``return_iter`` is supported by ``numpy``, ``pytorch``, ``paddle`` and
+        ``jittor`` backends.
+
+    .. note::
+        For ``numpy`` and ``pytorch`` backends, ``K`` can also be a sparse matrix built by
+        :func:`~pygmtools.utils.build_aff_mat` with ``layout='sparse'``, or a
+        :class:`~pygmtools.utils.FactorizedAffinity` object built with ``layout='factorized'``. Their memory cost grows
+        with the number of edges instead of :math:`(n_1n_2)^2`, which is preferred for large graphs.
+
+    .. note::
+        The products :math:`\mathbf{Kv}` and :math:`\mathbf{v}^\top\mathbf{Kv}` are cached across iterations, thus
+        each iteration only computes one matrix-vector product with ``K``. The Hungarian discretization of the batch
+        is dispatched to the persistent worker pool whose size is set by ``pygmtools.NPROC``.
+
     .. note::
         This solver is non-differentiable. The output is a discrete matching matrix (i.e. permutation matrix).
 
@@ -1070,14 +1152,25 @@ def ipfp(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
         raise NotImplementedError(
             NOT_IMPLEMENTED_MSG.format(backend)
         )
-    result = fn(*args)
+    if not return_iter:
+        result = fn(*args)
+        if non_batched_input:
+            return _squeeze(result, 0, backend)
+        else:
+            return result
+
+    if backend in ('mindspore', 'tensorflow'):
+        raise NotImplementedError(f'return_iter is not supported by {backend} backend.')
+    result, num_iter = fn(*args, True)
     if non_batched_input:
-        return _squeeze(result, 0, backend)
+        return _squeeze(result, 0, backend), _squeeze(num_iter, 0, backend)
     else:
-        return result
+        return result, num_iter
 
 
-def astar(K, n1=None, n2=None, n1max=None, n2max=None, beam_width=0, backend=None):
+def astar(K, n1=None, n2=None, n1max=None, n2max=None, beam_width=0, nproc: int=None,
+          epsilon: float=0., time_budget: float=None, max_expansions: int=None, return_bound: bool=False,
+          backend=None):
     r"""
     A\* (A-star) solver for graph matching (Lawler's QAP).
     The **A\*** solver was originally proposed to solve the graph edit distance (GED) problem. It finds the optimal
@@ -1092,13 +1185,43 @@ def astar(K, n1=None, n2=None, n1max=None, n2max=None, beam_width=0, backend=Non
     :param n1max: :math:`(b)` max number of nodes in graph1 (optional if n1 is given, and n1max=max(n1)).
     :param n2max: :math:`(b)` max number of nodes in graph2 (optional if n2 is given, and n2max=max(n2)).
     :param beam_width: (default: 0) Size of beam-search witdh (0 = no beam).
+    :param nproc: (default: ``pygmtools.NPROC`` variable, which is 1, i.e. no parallel) number of parallel workers
+                  to solve the instances in the batch
+    :param epsilon: (default: 0) suboptimality of weighted A\*. If ``epsilon>0``, the heuristic is weighted by
+                    :math:`1+\epsilon`, and the cost :math:`-\mathrm{vec}(\mathbf{X})^\top \mathbf{K} \mathrm{vec}(\mathbf{X})`
+                    of the solution is no more than :math:`(1+\epsilon)\times` the optimal one. It is meant for
+                    non-negative costs, e.g. graph edit distance
+    :param time_budget: (default: None, i.e. no limit) wall-clock budget in seconds of the search for each instance
+    :param max_expansions: (default: None, i.e. no limit) budget of the number of expanded search tree nodes for each
+                           instance
+    :param return_bound: (default: False) also return the upper bound of the matching score
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
-    :return: :math:`(b\times n_1 \times n_2)` the doubly-stochastic matching matrix
+    :return: if ``return_bound==False``, :math:`(b\times n_1 \times n_2)` the doubly-stochastic matching matrix
+
+             if ``return_bound==True``, :math:`(b\times n_1 \times n_2)` the doubly-stochastic matching matrix,
+             :math:`(b)` the upper bound of the score :math:`\mathrm{vec}(\mathbf{X})^\top \mathbf{K} \mathrm{vec}(\mathbf{X})`
+             among all matchings
 
     .. warning::
         If ``beam_width==0``, the algorithm will find the optimal solution, and it may take a very long time.
         You may set a ``beam_width`` to lower the size of the search tree, at the cost of losing the optimal guarantee.
 
+    .. note::
+        If the search runs out of ``time_budget`` or ``max_expansions``, it drops the open set and greedily completes
+        the best partial matching (as ``beam_width=1``), which takes at most :math:`n_1` more expansions. The best
+        complete matching found so far is returned. With ``return_bound=True``, the bound is taken from the open set
+        when the budget ran out, thus it measures how far the returned matching may be from the optimum. The bound is
+        valid if the off-diagonal elements of :math:`\mathbf{K}` are non-positive (e.g. the negative of edit costs),
+        where the Hungarian heuristic is admissible. It is not valid if ``beam_width>0``, because the search tree is
+        pruned.
+
+    .. note::
+        The Hungarian heuristic and the cost of partial matchings are computed in native code that releases the GIL,
+        therefore a batch is parallelized by a persistent thread pool of ``nproc`` workers (one instance per task),
+        which is separated from the pool of :func:`~pygmtools.linear_solvers.hungarian`. The affinity matrices are
+        shared with the workers instead of being copied, and the parallel mode pays off for batches of non-trivial
+        instances.
+
     .. note::
         Graph matching problem (Lawler's QAP) and graph edit distance problem are two sides of the same coin. If you
         want to transform your graph edit distance problem into Lawler's QAP, first compute the edit cost of each
@@ -1151,6 +1274,10 @@ def astar(K, n1=None, n2=None, n1max=None, n2max=None, beam_width=0, backend=Non
             # Consider setting a non-zero beam width to make it more efficient, especially for larger-sized problems
             >>> X = pygm.astar(K, n1, n2, beam_width=1)
 
+            # For a bounded latency, set a budget of the search. The best matching found within the budget is returned,
+            # with the upper bound of the score
+            >>> X, bound = pygm.astar(K, n1, n2, time_budget=0.1, return_bound=True)
+
             # This function also supports non-batched input, by ignoring all batch dimensions in the input tensors.
             >>> X_0 = pygm.astar(K[0], n1[0], n2[0])
             
@@ -1193,7 +1320,7 @@ def astar(K, n1=None, n2=None, n1max=None, n2max=None, beam_width=0, backend=Non
                          f'K:{len(_get_shape(K, backend))}dims!')
     __check_gm_arguments(n1, n2, n1max, n2max)
 
-    args = (K, n1, n2, n1max, n2max, beam_width)
+    args = (K, n1, n2, n1max, n2max, beam_width, nproc, epsilon, time_budget, max_expansions)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
         fn = mod.astar
@@ -1202,9 +1329,13 @@ def astar(K, n1=None, n2=None, n1max=None, n2max=None, beam_width=0, backend=Non
             NOT_IMPLEMENTED_MSG.format(backend)
         )
 
-    result = fn(*args)
-    match_mat = _squeeze(result, 0, backend) if non_batched_input else result
-    return match_mat
+    match_mat, score_bound = fn(*args)
+    if non_batched_input:
+        match_mat, score_bound = _squeeze(match_mat, 0, backend), _squeeze(score_bound, 0, backend)
+    if return_bound:
+        return match_mat, score_bound
+    else:
+        return match_mat
 
 
 def __check_gm_arguments(n1, n2, n1max, n2max):
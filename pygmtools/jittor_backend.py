@@ -14,9 +14,8 @@ from jittor import Var
 import functools
 import itertools
 import pygmtools.utils
-from multiprocessing import Pool
 import os
-from pygmtools.numpy_backend import _hung_kernel
+from pygmtools.numpy_backend import _hung_batch
 
 #############################################
 #     Linear Assignment Problem Solvers     #
@@ -24,7 +23,7 @@ from pygmtools.numpy_backend import _hung_kernel
 
 def hungarian(s: Var, n1: Var=None, n2: Var=None,
               unmatch1: Var=None, unmatch2: Var=None,
-              nproc: int=1) -> Var:
+              nproc: int=None, topk: int=None) -> Var:
     """
     Jittor implementation of Hungarian algorithm
     """
@@ -48,12 +47,7 @@ def hungarian(s: Var, n1: Var=None, n2: Var=None,
     else:
         unmatch2 = [None] * batch_num
 
-    if nproc > 1:
-        with Pool(processes=nproc) as pool:
-            mapresult = pool.starmap_async(_hung_kernel, zip(perm_mat, n1, n2, unmatch1, unmatch2))
-            perm_mat = np.stack(mapresult.get())
-    else:
-        perm_mat = np.stack([_hung_kernel(perm_mat[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+    perm_mat = _hung_batch(perm_mat, n1, n2, unmatch1, unmatch2, nproc, topk)
 
     perm_mat = jt.Var(perm_mat)
 
@@ -61,18 +55,27 @@ def hungarian(s: Var, n1: Var=None, n2: Var=None,
 
 def sinkhorn(s: Var, nrows: Var=None, ncols: Var=None,
              unmatchrows: Var=None, unmatchcols: Var=None,
-             dummy_row: bool=False, max_iter: int=10, tau: float=1., batched_operation: bool=False) -> Var:
+             dummy_row: bool=False, max_iter: int=10, tau: float=1., batched_operation: bool=False,
+             tol: float=None, dual=None, return_dual: bool=False, return_iter: bool=False):
     """
     Jittor implementation of Sinkhorn algorithm
     """
     batch_size = s.shape[0]
 
+    # the dual potentials are in the log domain, with shape (b x n1max), (b x n2max)
+    if dual is not None:
+        log_u, log_v = dual
+    else:
+        log_u = jt.zeros((batch_size, s.shape[1]), dtype=s.dtype)
+        log_v = jt.zeros((batch_size, s.shape[2]), dtype=s.dtype)
+
     if s.shape[2] >= s.shape[1]:
         transposed = False
     else:
         s = s.transpose(1, 2)
         nrows, ncols = ncols, nrows
         unmatchrows, unmatchcols = unmatchcols, unmatchrows
+        log_u, log_v = log_v, log_u
         transposed = True
 
     if nrows is None:
@@ -106,6 +109,8 @@ def sinkhorn(s: Var, nrows: Var=None, ncols: Var=None,
             unmatchrows = new_unmatchrows
             unmatchcols = new_unmatchcols
 
+        log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+
     # operations are performed on log_s
     log_s = s / tau
     if unmatchrows is not None and unmatchcols is not None:
@@ -122,86 +127,83 @@ def sinkhorn(s: Var, nrows: Var=None, ncols: Var=None,
         log_s = jt.concat((log_s, jt.full(dummy_shape, -float('inf'))), dim=1)
         if unmatchrows is not None:
             unmatchrows = jt.concat((unmatchrows, jt.full((dummy_shape[0], dummy_shape[1]), -float('inf'))), dim=1)
-        for b in range(batch_size):
-            log_s[b, int(ori_nrows[b]):int(nrows[b]), :int(ncols[b])] = -100
+        log_u = jt.concat((log_u, jt.zeros((dummy_shape[0], dummy_shape[1]), dtype=log_u.dtype)), dim=1)
+    else:
+        ori_nrows = nrows
 
     # assign the unmatch weights
     if unmatchrows is not None and unmatchcols is not None:
-        new_log_s = jt.full((log_s.shape[0], log_s.shape[1]+1, log_s.shape[2]+1), -float('inf'))
-        new_log_s[:, :-1, :-1] = log_s
-        log_s = new_log_s
-        for b in range(batch_size):
-            r, c = int(nrows[b]), int(ncols[b])
-            log_s[b, 0:r, c] = unmatchrows[b, 0:r]
-            log_s[b, r, 0:c] = unmatchcols[b, 0:c]
-    row_mask = jt.zeros((batch_size, log_s.shape[1], 1), dtype=jt.bool)
-    col_mask = jt.zeros((batch_size, 1, log_s.shape[2]), dtype=jt.bool)
-    for b in range(batch_size):
-        r, c = int(nrows[b]), int(ncols[b])
-        row_mask[b, 0:r, 0] = 1
-        col_mask[b, 0, 0:c] = 1
+        log_s = jt.concat((log_s, jt.full((batch_size, log_s.shape[1], 1), -float('inf'))), dim=2)
+        log_s = jt.concat((log_s, jt.full((batch_size, 1, log_s.shape[2]), -float('inf'))), dim=1)
+        unmatchrows = jt.concat((unmatchrows, jt.full((batch_size, 1), -float('inf'))), dim=1)
+        unmatchcols = jt.concat((unmatchcols, jt.full((batch_size, 1), -float('inf'))), dim=1)
+        log_u = jt.concat((log_u, jt.zeros((batch_size, 1), dtype=log_u.dtype)), dim=1)
+        log_v = jt.concat((log_v, jt.zeros((batch_size, 1), dtype=log_v.dtype)), dim=1)
+
+    # all masks are built by broadcasting the node numbers, thus no loop over the batch is needed
+    shape = log_s.shape
+    nrows = nrows.view(batch_size, 1, 1).expand(shape)
+    ncols = ncols.view(batch_size, 1, 1).expand(shape)
+    ori_nrows = ori_nrows.view(batch_size, 1, 1).expand(shape)
+    row_idx = jt.arange(shape[1]).view(1, -1, 1).expand(shape)
+    col_idx = jt.arange(shape[2]).view(1, 1, -1).expand(shape)
+    row_mask = row_idx < nrows
+    col_mask = col_idx < ncols
+    neg_inf = jt.full(shape, -float('inf'), dtype=log_s.dtype)
+    if dummy_row:
+        log_s = jt.where(jt.logical_and(jt.logical_and(row_idx >= ori_nrows, row_mask), col_mask),
+                         jt.full(shape, -100, dtype=log_s.dtype), log_s)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols += 1
-        nrows += 1
-
-    if batched_operation:
-        for b in range(batch_size):
-            log_s[b, int(nrows[b]):, :] = -float('inf')
-            log_s[b, :, int(ncols[b]):] = -float('inf')
-
-        for i in range(max_iter):
-            if i % 2 == 0:
-                m = log_s.max(2, keepdims=True)  #optimized logsumexp
-                log_sum = jt.nn.logsumexp(log_s - m, 2, keepdim=True) + m
-                log_s = log_s - jt.where(row_mask, log_sum, jt.zeros_like(log_sum))
-                if jt.flags.use_cuda == 0:
-                    if jt.any(jt.isnan(log_s)):
-                        raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-            else:
-                m = log_s.max(1, keepdims=True)
-                log_sum = jt.nn.logsumexp(log_s - m, 1, keepdim=True) + m                
-                log_s = log_s - jt.where(col_mask, log_sum, jt.zeros_like(log_sum))
-                if jt.flags.use_cuda == 0:
-                    if jt.any(jt.isnan(log_s)):
-                        raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-
-        ret_log_s = log_s
+        log_s = jt.where(jt.logical_and(row_mask, col_idx == ncols), unmatchrows.unsqueeze(2).expand(shape), log_s)
+        log_s = jt.where(jt.logical_and(row_idx == nrows, col_mask), unmatchcols.unsqueeze(1).expand(shape), log_s)
+        valid_mask = jt.logical_and(row_idx <= nrows, col_idx <= ncols)
     else:
-        ret_log_s = jt.full((batch_size, log_s.shape[1], log_s.shape[2]), -float('inf'), dtype=log_s.dtype)
-        for b in range(batch_size):
-            r,c = nrows[b],ncols[b]
-            if not isinstance(nrows[b],int):
-                r = int(nrows[b].item())
-            if not isinstance(ncols[b],int):
-                c = int(ncols[b].item())
-            log_s_b = log_s[b, 0:r, 0:c]
-            row_mask_b = row_mask[b, 0:r, :]
-            col_mask_b = col_mask[b, :, 0:c]
-            for i in range(max_iter):
-                if i % 2 == 0:
-                    m = log_s_b.max(1, keepdims=True)
-                    log_sum = jt.nn.logsumexp(log_s_b - m, 1, keepdim=True) + m
-                    log_s_b = log_s_b - jt.where(row_mask_b, log_sum, jt.zeros_like(log_sum))
-                else:
-                    m = log_s_b.max(0, keepdims=True)
-                    log_sum = jt.nn.logsumexp(log_s_b - m, 0, keepdim=True) + m
-                    log_s_b = log_s_b - jt.where(col_mask_b, log_sum, jt.zeros_like(log_sum))
-            ret_log_s[b, 0:r, 0:c] = log_s_b
-
+        valid_mask = jt.logical_and(row_mask, col_mask)
+    log_u = log_u.view(batch_size, -1, 1)
+    log_v = log_v.view(batch_size, 1, -1)
+    log_s = jt.where(valid_mask, log_s + log_u + log_v, neg_inf)
+
+    # the iterations are performed on the whole batch. The rows (columns) excluded by the masks are replaced by zeros
+    # before logsumexp, otherwise the result (and its gradient) over all -inf elements is NaN
+    zeros = jt.zeros(shape, dtype=log_s.dtype)
+    row_mask_r = row_mask[:, :, :1]
+    col_mask_c = col_mask[:, :1, :]
+    active = jt.ones((batch_size, 1, 1), dtype=jt.bool)
+    n_iter = max_iter
+    for i in range(max_iter):
+        if i % 2 == 0:
+            masked_log_s = jt.where(row_mask, log_s, zeros)
+            m = masked_log_s.max(2, keepdims=True)  #optimized logsumexp
+            log_sum = jt.nn.logsumexp(masked_log_s - m, 2, keepdim=True) + m
+            if tol is not None and i > 0:
+                # the columns are normalized by the last iteration, and the rows are checked for convergence
+                err = jt.where(row_mask_r, jt.abs(jt.exp(log_sum) - 1), jt.zeros_like(log_sum))
+                active = jt.logical_and(active, err.max(1, keepdims=True) >= tol)
+                # evaluate all variables together, otherwise the lazy graph is re-executed from the start every time
+                jt.sync([log_s, log_u, log_v, active])
+                if not jt.any(active):
+                    n_iter = i
+                    break
+            log_sum = jt.where(jt.logical_and(row_mask_r, active.expand(log_sum.shape)), log_sum, jt.zeros_like(log_sum))
+            log_u = log_u - log_sum
+        else:
+            masked_log_s = jt.where(col_mask, log_s, zeros)
+            m = masked_log_s.max(1, keepdims=True)
+            log_sum = jt.nn.logsumexp(masked_log_s - m, 1, keepdim=True) + m
+            log_sum = jt.where(jt.logical_and(col_mask_c, active.expand(log_sum.shape)), log_sum, jt.zeros_like(log_sum))
+            log_v = log_v - log_sum
+        log_s = log_s - log_sum
+        # log_s is checked (instead of log_sum) so that it is evaluated in every iteration by the lazy execution
+        if batched_operation and jt.flags.use_cuda == 0:
+            if jt.any(jt.isnan(log_s)):
+                raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
+
+    # remove the unmatch weights and the dummy rows
+    ret_log_s = jt.where(jt.logical_and(row_idx < ori_nrows, col_mask), log_s, neg_inf)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols -= 1
-        nrows -= 1
-        for b in range(batch_size):
-            r, c = int(nrows[b]), int(ncols[b])
-            ret_log_s[b, 0:r+1, c] = -float('inf')
-            ret_log_s[b, r, 0:c] = -float('inf')
         ret_log_s = ret_log_s[:, :-1, :-1]
-
-    if dummy_row:
-        if dummy_shape[1] > 0:
-            ret_log_s = ret_log_s[:, :-dummy_shape[1]]
-        for b in range(batch_size):
-            ret_log_s[int(b), int(ori_nrows[b]):int(nrows[b]), :int(ncols[b])] = -float('inf')
+    if dummy_row and dummy_shape[1] > 0:
+        ret_log_s = ret_log_s[:, :-dummy_shape[1]]
 
     if jt.any(transposed_batch):
         s_t = ret_log_s.transpose(1, 2)
@@ -216,22 +218,53 @@ def sinkhorn(s: Var, nrows: Var=None, ncols: Var=None,
     if transposed:
         ret_log_s = ret_log_s.transpose(1, 2)
 
-    return jt.exp(ret_log_s)
+    ret = [jt.exp(ret_log_s)]
+    if return_dual:
+        log_u, log_v = log_u[:, :, 0], log_v[:, 0, :]
+        if unmatchrows is not None and unmatchcols is not None:
+            log_u, log_v = log_u[:, :-1], log_v[:, :-1]
+        if dummy_row and dummy_shape[1] > 0:
+            log_u = log_u[:, :-dummy_shape[1]]
+        if jt.any(transposed_batch):
+            log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+        if transposed:
+            log_u, log_v = log_v, log_u
+        ret.append((log_u, log_v))
+    if return_iter:
+        ret.append(n_iter)
+    return tuple(ret) if len(ret) > 1 else ret[0]
+
+
+def _swap_dual_batch(log_u: Var, log_v: Var, transposed_batch: Var):
+    """
+    Swap the row and column dual potentials of the transposed instances in Sinkhorn. It is assumed that
+    log_u.shape[1] <= log_v.shape[1], and log_u is padded by zeros.
+    """
+    log_u_pad = jt.concat(
+        (log_u, jt.zeros((log_u.shape[0], log_v.shape[1] - log_u.shape[1]), dtype=log_u.dtype)), dim=1)
+    cond = transposed_batch.view(-1, 1).expand(log_u.shape)
+    new_log_u = jt.where(cond, log_v[:, :log_u.shape[1]], log_u)
+    cond = transposed_batch.view(-1, 1).expand(log_v.shape)
+    new_log_v = jt.where(cond, log_u_pad, log_v)
+    return new_log_u, new_log_v
 
 #############################################
 #    Quadratic Assignment Problem Solvers   #
 #############################################
 
 def rrwm(K: Var, n1: Var, n2: Var, n1max, n2max, x0: Var,
-         max_iter: int, sk_iter: int, alpha: float, beta: float) -> Var:
+         max_iter: int, sk_iter: int, alpha: float, beta: float, return_iter: bool=False):
     """
     Jittor implementation of RRWM algorithm.
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
     # rescale the values in K
     d = K.sum(dim=2, keepdims=True)
-    dmax = d.max(dim=1, keepdims=True) 
-    K = K / (dmax + d.min() * 1e-5)
+    K = K / (d.max(dim=1, keepdims=True) + d.min(dim=1, keepdims=True) * 1e-5)
+    # the converged instances are removed from the batch, and their results are written to x
+    x = jt.zeros_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=np.int64)
+    active = np.arange(batch_num)
     v = v0
     for i in range(max_iter):
         # try fixing memory error caused by growing scale of
@@ -246,76 +279,137 @@ def rrwm(K: Var, n1: Var, n2: Var, n1max, n2max, x0: Var,
         v = v / n
 
         # reweighted jump
-        s = v.view((batch_num, int(n2max), int(n1max))).transpose(1, 2)
+        s = v.view((-1, int(n2max), int(n1max))).transpose(1, 2)
         s = beta * s / s.max(dim=1, keepdims=True).max(dim=2, keepdims=True)
-        v = alpha * sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose(1, 2).reshape(batch_num, n1n2, 1) + \
+        v = alpha * sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose(1, 2).reshape(-1, n1n2, 1) + \
             (1 - alpha) * v
         n = jt.norm(v, p=1, dim=1, keepdim=True)
         v = jt.matmul(v, 1 / n)
-        if (v - last_v).sum().sqrt() < 1e-5:
-            break
 
-    return v.view((batch_num, int(n2max), int(n1max))).transpose(1, 2)
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (((v - last_v) ** 2).sum(dims=[1, 2]).sqrt() < 1e-5).numpy()
+        if np.any(converged):
+            x, active, n_iter, keep = _update_converged(x, v, active, n_iter, converged, i)
+            if keep is None:
+                break
+            v, n1, n2, K = (_[keep] for _ in (v, n1, n2, K))
+    else:
+        x[jt.array(active)] = v
+
+    x = x.view((batch_num, int(n2max), int(n1max))).transpose(1, 2)
+    if return_iter:
+        return x, jt.array(n_iter)
+    else:
+        return x
 
 def sm(K: Var, n1: Var, n2: Var, n1max, n2max, x0: Var,
-        max_iter: int) -> Var:
+        max_iter: int, return_iter: bool=False):
     """
     Jittor implementation of SM algorithm.
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    x = jt.zeros_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=np.int64)
+    active = np.arange(batch_num)
     v = vlast = v0
     for i in range(max_iter):
         v = jt.bmm(K, v)
         n = jt.norm(v, p=2, dim=1)
-        v = jt.matmul(v, (1 / n).reshape(batch_num, 1, 1))
-        if (v - vlast).sum().sqrt() < 1e-5:
-            break        
+        v = jt.matmul(v, (1 / n).reshape(-1, 1, 1))
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (((v - vlast) ** 2).sum(dims=[1, 2]).sqrt() < 1e-5).numpy()
+        if np.any(converged):
+            x, active, n_iter, keep = _update_converged(x, v, active, n_iter, converged, i)
+            if keep is None:
+                break
+            v, K = v[keep], K[keep]
         vlast = v
+    else:
+        x[jt.array(active)] = v
 
-    x = v.reshape(batch_num, n2max, n1max).transpose(1,2)
-    return x
+    x = x.reshape(batch_num, n2max, n1max).transpose(1,2)
+    if return_iter:
+        return x, jt.array(n_iter)
+    else:
+        return x
 
 def ipfp(K: Var, n1: Var, n2: Var, n1max, n2max, x0: Var,
-         max_iter) -> Var:
+         max_iter, return_iter: bool=False):
     """
     Jittor implementation of IPFP algorithm
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    x = jt.zeros_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=np.int64)
+    active = np.arange(batch_num)
     v = v0
-    last_v = v
     best_v = v
     best_obj = jt.full((batch_num, 1, 1), -1)
-
-    def comp_obj_score(v1, K, v2):
-        return jt.bmm(jt.bmm(v1.view(batch_num, 1, -1), K), v2)
+    # K v and the objective score v^T K v are cached, thus only K binary_v is computed in each iteration
+    Kv = jt.bmm(K, v)
+    v_obj = _bdot(v, Kv)
 
     for i in range(max_iter):
-        cost = jt.bmm(K, v).reshape((batch_num, int(n2max), int(n1max))).transpose(1, 2)
+        cost = Kv.reshape((-1, int(n2max), int(n1max))).transpose(1, 2)
         binary_sol = hungarian(cost, n1, n2)
-        binary_v = binary_sol.transpose(1, 2).view(batch_num, -1, 1)
-        alpha = comp_obj_score(v, K, binary_v - v)
-        beta = comp_obj_score(binary_v - v, K, binary_v - v)
+        binary_v = binary_sol.transpose(1, 2).view(-1, n1n2, 1)
+        Kb = jt.bmm(K, binary_v)
+        current_obj = _bdot(binary_v, Kb)
+        v_Kb = _bdot(v, Kb)
+        alpha = v_Kb - v_obj # v^T K (binary_v - v)
+        beta = current_obj - _bdot(binary_v, Kv) - v_Kb + v_obj # (binary_v - v)^T K (binary_v - v)
         t0 = - alpha / beta
+        last_v_obj = v_obj
         cond = jt.logical_or(beta >= 0, t0 >= 1)
         if cond.shape != binary_v.shape:
             cond = cond.expand(binary_v.shape)
         v = jt.where(cond, binary_v, v + t0 * (binary_v - v))
-        last_v_obj = comp_obj_score(last_v, K, last_v)
+        Kv = jt.where(cond, Kb, Kv + t0 * (Kb - Kv))
+        v_obj = _bdot(v, Kv)
 
-        current_obj = comp_obj_score(binary_v, K, binary_v)
         cond = current_obj > best_obj
         if cond.shape != binary_v.shape:
             cond = cond.expand(binary_v.shape)
         best_v = jt.where(cond, binary_v, best_v)  # current_obj > best_obj
         best_obj = jt.where(current_obj > best_obj, current_obj, best_obj)
 
-        if jt.max(jt.abs(last_v_obj - current_obj) / last_v_obj) < 1e-3:
-            break
-        last_v = v
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (jt.abs(last_v_obj - current_obj) / last_v_obj < 1e-3).numpy().reshape(-1)
+        if np.any(converged):
+            x, active, n_iter, keep = _update_converged(x, best_v, active, n_iter, converged, i)
+            if keep is None:
+                break
+            v, Kv, v_obj, best_v, best_obj, n1, n2, K = \
+                (_[keep] for _ in (v, Kv, v_obj, best_v, best_obj, n1, n2, K))
+    else:
+        x[jt.array(active)] = best_v
+
+    pred_x = x.reshape((batch_num, int(n2max), int(n1max))).transpose(1, 2)
+    if return_iter:
+        return pred_x, jt.array(n_iter)
+    else:
+        return pred_x
 
-    pred_x = best_v.reshape((batch_num, int(n2max), int(n1max))).transpose(1, 2)
-    return pred_x
 
+def _bdot(v1: Var, v2: Var) -> Var:
+    """
+    Batched inner product of (b x n x 1) vectors, with output shape (b x 1 x 1)
+    """
+    return jt.bmm(v1.transpose(1, 2), v2)
+
+
+def _update_converged(x, v, active, n_iter, converged, i):
+    """
+    Write the results of the converged instances to x, and get the index of the remaining instances in the batch
+    (None if all instances are converged). active and n_iter are numpy arrays maintained on the host.
+    """
+    idx = np.nonzero(converged)[0]
+    x[jt.array(active[idx])] = v[jt.array(idx)]
+    n_iter[active[idx]] = i + 1
+    if np.all(converged):
+        return x, active, n_iter, None
+    keep = np.nonzero(~converged)[0]
+    return x, active[keep], n_iter, jt.array(keep)
 
 ############################################
 #      Multi-Graph Matching Solvers        #
@@ -30,6 +30,8 @@ from pygmtools.utils import NOT_IMPLEMENTED_MSG, from_numpy, \
 
 def sinkhorn(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
              dummy_row: bool = False, max_iter: int = 10, tau: float = 1., batched_operation: bool = False,
+             tol: float = None, dual=None, return_dual: bool = False,
+             tau_init: float = None, tau_decay: float = 0.5, return_iter: bool = False,
              backend=None):
     r"""
     Sinkhorn algorithm turns the input matrix into a doubly-stochastic matrix.
@@ -60,8 +62,21 @@ def sinkhorn(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
     :param tau: (default: 1) the hyper parameter :math:`\tau` controlling the temperature
     :param batched_operation: (default: False) apply batched_operation for better efficiency (but may cause issues
      for back-propagation)
+    :param tol: (optional) if given, the marginal error of each instance is checked after every column normalization,
+                and the instances whose marginal error is smaller than ``tol`` stop updating. The iteration stops
+                when all instances are converged. For non-square inputs, ``dummy_row=True`` is needed for convergence
+    :param dual: (optional) a tuple of the log-domain dual potentials :math:`(\log \mathbf{u}, \log \mathbf{v})` of
+                 size :math:`(b\times n_1)` and :math:`(b\times n_2)` to warm-start the iterations, e.g. the potentials
+                 returned by the last call with ``return_dual=True``
+    :param return_dual: (default: False) whether to return the dual potentials
+    :param tau_init: (optional) if given, enable the epsilon-scaling mode: :math:`\tau` is annealed from ``tau_init``
+                     to ``tau``, and the dual potentials are reused between the stages (see the note below)
+    :param tau_decay: (default: 0.5) the decay factor of :math:`\tau` between two stages of epsilon-scaling
+    :param return_iter: (default: False) whether to return the total number of iterations actually performed
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
-    :return: :math:`(b\times n_1 \times n_2)` the computed doubly-stochastic matrix
+    :return: :math:`(b\times n_1 \times n_2)` the computed doubly-stochastic matrix. If ``return_dual=True``, also
+             return the tuple of dual potentials :math:`(\log \mathbf{u}, \log \mathbf{v})`. If
+             ``return_iter=True``, also return the number of iterations (at the last position)
 
     You need not dive too deep into the math details if you are simply using Sinkhorn. However, you should
     be aware of one important hyper parameter. ``tau`` controls the distance between the predicted doubly-
@@ -84,6 +99,30 @@ def sinkhorn(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
         need the gradient. It is assumed that ``row number <= column number``. If not, the input matrix will be
         transposed.
 
+        For ``numpy``, ``pytorch``, ``paddle`` and ``jittor`` backends, the padded batch is always processed as a
+        whole (the padded elements are excluded by masks), and the result is differentiable regardless of
+        ``batched_operation``. With these backends, ``batched_operation=True`` only enables the NaN check after each
+        iteration.
+
+    .. note::
+        The output of Sinkhorn can be written as
+        :math:`\mathbf{S}_{i,j} = \exp \left(\frac{\mathbf{s}_{i,j}}{\tau} + \log \mathbf{u}_i + \log \mathbf{v}_j\right)`
+        where :math:`\log \mathbf{u}, \log \mathbf{v}` are the accumulated (log-domain) normalization factors, known
+        as the dual potentials. If Sinkhorn is called repeatedly on slowly-changing inputs (e.g. in the outer
+        iterations of :func:`~pygmtools.classic_solvers.rrwm`), passing the last potentials by ``dual`` warm-starts the
+        iterations, and combined with ``tol``, fewer iterations are needed.
+
+    .. note::
+        With a small ``tau``, Sinkhorn converges slowly. The epsilon-scaling mode (``tau_init`` is not ``None``) firstly
+        solves the problem with a large :math:`\tau=` ``tau_init``, and then decreases :math:`\tau` by ``tau_decay``
+        in each stage until it reaches ``tau``. Every stage is warm-started by the (rescaled) dual potentials of the
+        last stage. The intermediate stages stop once the marginal error is below ``max(tol, 1e-2)``, and the last
+        stage (with the target ``tau``) runs at most ``max_iter`` iterations and stops by ``tol``.
+        ``return_iter=True`` reports the iterations of all stages.
+
+        ``tol``, ``dual``, ``return_dual``, ``tau_init`` and ``return_iter`` are supported by ``numpy``, ``pytorch``,
+        ``paddle`` and ``jittor`` backends.
+
     .. warning::
         This function can work with or without the maximal inlier matching:
 
@@ -759,7 +798,29 @@ def sinkhorn(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
         pass
     else:
         raise ValueError('The arguments unmatch1 and unmatch2 must be specified together.')
+    if dual is not None:
+        if len(dual) != 2:
+            raise ValueError('The argument dual should be a tuple of two dual potentials (log_u, log_v).')
+        _check_data_type(dual[0], 'dual[0]', backend)
+        _check_data_type(dual[1], 'dual[1]', backend)
+        if non_batched_input:
+            dual = tuple(_unsqueeze(_, 0, backend) for _ in dual)
+        if not all((_get_shape(dual[0], backend) == _get_shape(s, backend)[:2],
+                    _get_shape(dual[1], backend) == _get_shape(s, backend)[::2])):
+            raise ValueError(f'the shapes of the following arguments mismatch. '
+                             f'Please read the doc for the correct shape.\n'
+                             f'Got s:{_get_shape(s, backend)}, dual[0]:{_get_shape(dual[0], backend)}, '
+                             f'dual[1]:{_get_shape(dual[1], backend)}!')
+    if tau_init is not None:
+        if not tau_init > 0:
+            raise ValueError(f'tau_init should be positive, got {tau_init}.')
+        if not 0 < tau_decay < 1:
+            raise ValueError(f'tau_decay should be in (0, 1), got {tau_decay}.')
     args = (s, n1, n2, unmatch1, unmatch2, dummy_row, max_iter, tau, batched_operation)
+    extended = tol is not None or dual is not None or return_dual or tau_init is not None or return_iter
+    if extended and backend in ('mindspore', 'tensorflow'):
+        raise NotImplementedError(f'tol, dual, return_dual, tau_init and return_iter are not supported by '
+                                  f'{backend} backend.')
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
         fn = mod.sinkhorn
@@ -768,15 +829,43 @@ def sinkhorn(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
             NOT_IMPLEMENTED_MSG.format(backend)
         )
 
-    result = fn(*args)
+    if not extended:
+        result = fn(*args)
+        if non_batched_input:
+            return _squeeze(result, 0, backend)
+        else:
+            return result
+
+    num_iter = 0
+    if tau_init is not None:
+        # the intermediate stages only need to be roughly converged
+        stage_tol = 1e-2 if tol is None else max(tol, 1e-2)
+        cur_tau = tau_init
+        while cur_tau > tau:
+            next_tau = max(cur_tau * tau_decay, tau)
+            _, dual, stage_iter = fn(s, n1, n2, unmatch1, unmatch2, dummy_row, max_iter, cur_tau, batched_operation,
+                                     stage_tol, dual, True, True)
+            # the dual potentials are in the log domain, i.e. scaled by 1 / tau
+            dual = tuple(_ * (cur_tau / next_tau) for _ in dual)
+            num_iter += stage_iter
+            cur_tau = next_tau
+    result, dual, stage_iter = fn(*args, tol, dual, True, True)
+    num_iter += stage_iter
     if non_batched_input:
-        return _squeeze(result, 0, backend)
+        result = _squeeze(result, 0, backend)
+        dual = tuple(_squeeze(_, 0, backend) for _ in dual)
+    if return_dual and return_iter:
+        return result, dual, num_iter
+    elif return_dual:
+        return result, dual
+    elif return_iter:
+        return result, num_iter
     else:
         return result
 
 
 def hungarian(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
-              nproc: int = 1,
+              nproc: int = None, topk: int = None,
               backend=None):
     r"""
     Solve optimal LAP permutation by hungarian algorithm. The time cost is :math:`O(n^3)`.
@@ -787,18 +876,30 @@ def hungarian(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
     :param n2: :math:`(b)` (optional) number of objects in dim2
     :param unmatch1: (optional, new in ``0.3.0``) :math:`(b\times n_1)` the scores indicating the objects in dim1 is unmatched
     :param unmatch2: (optional, new in ``0.3.0``) :math:`(b\times n_2)` the scores indicating the objects in dim2 is unmatched
-    :param nproc: (default: 1, i.e. no parallel) number of parallel processes
+    :param nproc: (default: ``pygmtools.NPROC`` variable, which is 1, i.e. no parallel) number of parallel workers
+    :param topk: (optional) if given, only the ``topk`` largest scores in each row of ``s`` are considered as matching
+                 candidates, and the sparse LAP is solved (see the note below)
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
     :return: :math:`(b\times n_1 \times n_2)` optimal permutation matrix
 
     .. note::
-        The parallelization is based on multi-processing workers that run on multiple CPU cores.
+        The parallelization is based on a persistent thread pool that runs on multiple CPU cores (the LAP solver
+        releases the GIL). The pool is created at the first parallel call and reused by all following calls, so there
+        is no worker startup or data pickling overhead per call. The default number of workers for all functions
+        (including the solvers calling Hungarian internally) can be set once by :func:`~pygmtools.utils.set_nproc`.
 
     .. note::
         For all backends, ``scipy.optimize.linear_sum_assignment`` is called to solve the LAP, therefore the
         computation is based on ``numpy`` and ``scipy``. The ``backend`` argument of this function only affects
         the input-output data type.
 
+    .. note::
+        For large problems (e.g. thousands of keypoints), setting ``topk`` sparsifies the LAP: the
+        :math:`n_1\times` ``topk`` candidates are solved by ``scipy.sparse.csgraph.min_weight_full_bipartite_matching``,
+        and the void nodes of ``unmatch1, unmatch2`` are also connected sparsely, avoiding the dense
+        :math:`(n_1+n_2)\times(n_1+n_2)` cost matrix. The result is optimal among the candidates. If no full matching
+        exists among the candidates, this function falls back to the dense solver for that instance.
+
     .. note::
         We support batched instances with different number of nodes, therefore ``n1`` and ``n2`` are
         required to specify the exact number of objects of each dimension in the batch. If not specified, we assume
@@ -1326,7 +1427,9 @@ def hungarian(s, n1=None, n2=None, unmatch1=None, unmatch2=None,
         pass
     else:
         raise ValueError('The arguments unmatch1 and unmatch2 must be specified together.')
-    args = (s, n1, n2, unmatch1, unmatch2, nproc)
+    if topk is not None and (not isinstance(topk, (int, np.integer)) or topk < 1):
+        raise ValueError(f'topk should be a positive integer, got {topk}.')
+    args = (s, n1, n2, unmatch1, unmatch2, nproc, topk)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
         fn = mod.hungarian
@@ -1,4 +1,3 @@
-from multiprocessing import Pool
 import numpy as np
 import mindspore
 import mindspore.nn as nn
@@ -47,12 +46,12 @@ else:
 #     Linear Assignment Problem Solvers     #
 #############################################
 
-from pygmtools.numpy_backend import _hung_kernel
+from pygmtools.numpy_backend import _hung_batch
 
 
 def hungarian(s: mindspore.Tensor, n1: mindspore.Tensor = None, n2: mindspore.Tensor = None,
               unmatch1: mindspore.Tensor = None, unmatch2: mindspore.Tensor = None,
-              nproc: int = 1) -> mindspore.Tensor:
+              nproc: int = None, topk: int = None) -> mindspore.Tensor:
     """
     mindspore implementation of Hungarian algorithm
     """
@@ -77,13 +76,7 @@ def hungarian(s: mindspore.Tensor, n1: mindspore.Tensor = None, n2: mindspore.Te
     else:
         unmatch2 = [None] * batch_num
 
-    if nproc > 1:
-        with Pool(processes=nproc) as pool:
-            mapresult = pool.starmap_async(_hung_kernel, zip(perm_mat, n1, n2, unmatch1, unmatch2))
-            perm_mat = np.stack(mapresult.get())
-    else:
-        perm_mat = np.stack(
-            [_hung_kernel(perm_mat[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+    perm_mat = _hung_batch(perm_mat, n1, n2, unmatch1, unmatch2, nproc, topk)
 
     perm_mat = mindspore.Tensor(perm_mat)
 
@@ -32,11 +32,13 @@ import importlib
 import pygmtools
 from pygmtools.utils import NOT_IMPLEMENTED_MSG, _check_shape, _get_shape, _unsqueeze, _squeeze, _check_data_type
 import math
+import copy
+import numpy as np
 
 
 def cao(K, x0=None, qap_solver=None,
         mode='time',
-        max_iter=6, lambda_init=0.3, lambda_step=1.1, lambda_max=1.0, iter_boost=2,
+        max_iter=6, lambda_init=0.3, lambda_step=1.1, lambda_max=1.0, iter_boost=2, memory_budget=1.,
         backend=None):
     r"""
     Composition based Affinity Optimization (CAO) solver for multi-graph matching. This solver builds a supergraph for
@@ -54,21 +56,25 @@ def cao(K, x0=None, qap_solver=None,
     terms are balanced by :math:`\lambda`, and :math:`\lambda` starts from a smaller number and gradually grows.
 
     :param K: :math:`(m\times m \times n^2 \times n^2)` the input affinity matrix, where ``K[i,j]`` is the affinity
-              matrix of graph ``i`` and graph ``j`` (:math:`m`: number of nodes)
+              matrix of graph ``i`` and graph ``j`` (:math:`m`: number of nodes). For ``numpy`` and ``pytorch``
+              backends, it can also be a :class:`~pygmtools.utils.PairwiseAffinity` object that only stores the pairs
+              :math:`i<j`, possibly in the sparse or factorized layout
     :param x0: (optional) :math:`(m\times m \times n \times n)` the initial two-graph matching result, where ``X[i,j]``
                is the matching matrix result of graph ``i`` and graph ``j``. If this argument is not given,
                ``qap_solver`` will be used to compute the two-graph matching result.
     :param qap_solver: (default: pygm.rrwm) a function object that accepts a batched affinity matrix and returns the
                        matching matrices. It is suggested to use ``functools.partial`` and the QAP solvers provided in
                        the :mod:`~pygmtools.classic_solvers` module (see examples below).
-    :param mode: (default: ``'time'``) the operation mode of this algorithm. Options: ``'time', 'memory'``,
-                 where ``'time'`` is a time-efficient version and ``'memory'`` is a memory-efficient version.
+    :param mode: (default: ``'time'``) the operation mode of this algorithm. Options: ``'time', 'memory', 'chunked'``,
+                 where ``'time'`` is a time-efficient version, ``'memory'`` is a memory-efficient version, and
+                 ``'chunked'`` is a time-efficient version whose memory cost is bounded by ``memory_budget``.
     :param max_iter: (default: 6) max number of iterations
     :param lambda_init: (default: 0.3) initial value of :math:`\lambda`, with :math:`\lambda\in[0,1]`
     :param lambda_step: (default: 1.1) the increase step size of :math:`\lambda`, updated by ``lambda = step * lambda``
     :param lambda_max: (default: 1.0) the max value of lambda
     :param iter_boost: (default: 2) to boost the convergence of the CAO algorithm, :math:`\lambda` will be forced to
                        update every ``iter_boost`` iterations.
+    :param memory_budget: (default: 1.0) the memory budget (in GB) of the intermediate tensors for ``mode='chunked'``
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
     :return: :math:`(m\times m \times n \times n)` the multi-graph matching result
 
@@ -80,6 +86,13 @@ def cao(K, x0=None, qap_solver=None,
 
        Multi-graph matching methods process all graphs at once and do not support the additional batch dimension. Please
        note that this behavior is different from two-graph matching solvers in :mod:`~pygmtools.classic_solvers`.
+
+    .. note::
+
+       ``mode='time'`` builds tensors of size :math:`(m^3\times n^4)`, which is infeasible for a large number of graphs.
+       ``mode='chunked'`` returns the same result as ``mode='time'``, but it processes the intermediate graphs in blocks
+       whose size is bounded by ``memory_budget``, and reuses ``K[i,j]`` for all intermediate graphs instead of
+       repeating it. ``mode='chunked'`` is supported by ``numpy`` and ``pytorch`` backends.
     
     .. dropdown:: Numpy Example
 
@@ -287,8 +300,11 @@ def cao(K, x0=None, qap_solver=None,
     if backend is None:
         backend = pygmtools.BACKEND
     # check the correctness of input
-    _check_data_type(K, 'K', backend)
-    K_shape = _get_shape(K, backend)
+    if isinstance(K, pygmtools.utils.PairwiseAffinity):
+        K_shape = K.shape
+    else:
+        _check_data_type(K, 'K', backend)
+        K_shape = _get_shape(K, backend)
     if not (len(K_shape) == 4 and K_shape[0] == K_shape[1] and K_shape[2] == K_shape[3]):
         raise ValueError(f"Unsupported input data shape: got K {K_shape}")
     num_graph, aff_size = K_shape[0], K_shape[2]
@@ -307,9 +323,14 @@ def cao(K, x0=None, qap_solver=None,
     else:
         if qap_solver is None:
             qap_solver = functools.partial(pygmtools.rrwm, n1max=num_node, n2max=num_node, backend=backend)
-        x0 = qap_solver(K.reshape((num_graph ** 2, aff_size, aff_size)))
-        x0 = pygmtools.hungarian(x0, backend=backend)
-        x0 = x0.reshape((num_graph, num_graph, num_node, num_node))
+        if isinstance(K, pygmtools.utils.PairwiseAffinity):
+            x0 = qap_solver(K.K)
+            x0 = pygmtools.hungarian(x0, backend=backend)
+            x0 = _pairwise_matching(x0, num_graph, backend)
+        else:
+            x0 = qap_solver(K.reshape((num_graph ** 2, aff_size, aff_size)))
+            x0 = pygmtools.hungarian(x0, backend=backend)
+            x0 = x0.reshape((num_graph, num_graph, num_node, num_node))
 
     args = (K, x0, num_graph, num_node, max_iter, lambda_init, lambda_step, lambda_max, iter_boost)
     try:
@@ -318,8 +339,11 @@ def cao(K, x0=None, qap_solver=None,
             fn = mod.cao_fast_solver
         elif mode in ['memory']:
             fn = mod.cao_solver
+        elif mode in ['chunked']:
+            if not memory_budget > 0: raise ValueError(f"memory_budget must be >0, got memory_budget={memory_budget}")
+            fn = functools.partial(mod.cao_chunked_solver, memory_budget=int(memory_budget * 1024 ** 3))
         else:
-            raise ValueError("Unknown value of mode: supported values ['time', 'memory']")
+            raise ValueError("Unknown value of mode: supported values ['time', 'memory', 'chunked']")
     except (ModuleNotFoundError, AttributeError):
         raise NotImplementedError(
             NOT_IMPLEMENTED_MSG.format(backend)
@@ -348,7 +372,9 @@ def mgm_floyd(K, x0=None, qap_solver=None,
     terms are balanced by :math:`\lambda`.
 
     :param K: :math:`(m\times m \times n^2 \times n^2)` the input affinity matrix, where ``K[i,j]`` is the affinity
-              matrix of graph ``i`` and graph ``j`` (:math:`m`: number of nodes)
+              matrix of graph ``i`` and graph ``j`` (:math:`m`: number of nodes). For ``numpy`` and ``pytorch``
+              backends, it can also be a :class:`~pygmtools.utils.PairwiseAffinity` object that only stores the pairs
+              :math:`i<j`, possibly in the sparse or factorized layout
     :param x0: (optional) :math:`(m\times m \times n \times n)` the initial two-graph matching result, where ``X[i,j]``
                is the matching matrix result of graph ``i`` and graph ``j``. If this argument is not given,
                ``qap_solver`` will be used to compute the two-graph matching result.
@@ -569,8 +595,11 @@ def mgm_floyd(K, x0=None, qap_solver=None,
     if backend is None:
         backend = pygmtools.BACKEND
     # check the correctness of input
-    _check_data_type(K, 'K', backend)
-    K_shape = _get_shape(K, backend)
+    if isinstance(K, pygmtools.utils.PairwiseAffinity):
+        K_shape = K.shape
+    else:
+        _check_data_type(K, 'K', backend)
+        K_shape = _get_shape(K, backend)
     if not (len(K_shape) == 4 and K_shape[0] == K_shape[1] and K_shape[2] == K_shape[3]):
         raise ValueError(f"Unsupported input data shape: got K {K_shape}")
     num_graph, aff_size = K_shape[0], K_shape[2]
@@ -587,9 +616,14 @@ def mgm_floyd(K, x0=None, qap_solver=None,
     else:
         if qap_solver is None:
             qap_solver = functools.partial(pygmtools.rrwm, n1max=num_node, n2max=num_node, backend=backend)
-        x0 = qap_solver(K.reshape((num_graph ** 2, aff_size, aff_size)))
-        x0 = pygmtools.hungarian(x0, backend=backend)
-        x0 = x0.reshape((num_graph, num_graph, num_node, num_node))
+        if isinstance(K, pygmtools.utils.PairwiseAffinity):
+            x0 = qap_solver(K.K)
+            x0 = pygmtools.hungarian(x0, backend=backend)
+            x0 = _pairwise_matching(x0, num_graph, backend)
+        else:
+            x0 = qap_solver(K.reshape((num_graph ** 2, aff_size, aff_size)))
+            x0 = pygmtools.hungarian(x0, backend=backend)
+            x0 = x0.reshape((num_graph, num_graph, num_node, num_node))
 
     args = (K, x0, num_graph, num_node, param_lambda)
     try:
@@ -608,6 +642,201 @@ def mgm_floyd(K, x0=None, qap_solver=None,
     return fn(*args)
 
 
+def mgm_floyd_online(X, K_new, x0_new=None, qap_solver=None,
+                     budget=None,
+                     param_lambda=0.2,
+                     backend=None):
+    r"""
+    Online (incremental) version of :func:`~pygmtools.multi_graph_solvers.mgm_floyd`. Given the solved multi-graph
+    matching result of :math:`m` graphs, a new graph is added without re-solving the whole problem. The new graph is
+    regarded as a new node on the supergraph, and only the edges to the new node are updated by the Floyd step
+    through the existing graphs:
+
+    .. math::
+
+        \mathbf{X}_{i,new} \leftarrow \arg \max_{\mathbf{X}_{i,a} \mathbf{X}_{a,new}, a \in \mathcal{A}}
+        (1-\lambda) J(\mathbf{X}_{i,a} \mathbf{X}_{a,new}) + \lambda C_p(\mathbf{X}_{i,a} \mathbf{X}_{a,new})
+
+    where the anchor set :math:`\mathcal{A}` contains the ``budget`` existing graphs that are best matched to the new
+    graph, and the consistency :math:`C_p` is measured w.r.t. the paths through :math:`\mathcal{A}`. The matchings
+    among the existing graphs are kept unchanged.
+
+    :param X: the multi-graph matching result of the existing graphs (a :mod:`~pygmtools.utils.MultiMatchingResult`
+              object that is not cycle-consistent), where ``X[i,j]`` is the :math:`(n \times n)` matching matrix of
+              graph ``i`` and graph ``j``
+    :param K_new: :math:`(m\times n^2 \times n^2)` the affinity matrices between the existing graphs and the new
+                  graph, where ``K_new[i]`` is the affinity matrix of graph ``i`` and the new graph
+    :param x0_new: (optional) :math:`(m\times n \times n)` the initial two-graph matching result between the existing
+                   graphs and the new graph. If this argument is not given, ``qap_solver`` will be used to compute it.
+    :param qap_solver: (default: pygm.rrwm) a function object that accepts a batched affinity matrix and returns the
+                       matching matrices. See :func:`~pygmtools.multi_graph_solvers.mgm_floyd`.
+    :param budget: (default: ``None``) the number of existing graphs used as anchors. All existing graphs are used if
+                   ``None``.
+    :param param_lambda: (default: 0.2) value of :math:`\lambda`, with :math:`\lambda\in[0,1]`
+    :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
+    :return: a new :mod:`~pygmtools.utils.MultiMatchingResult` object of :math:`m+1` graphs, where the new graph has
+             index :math:`m`. The matching matrices of the existing graphs are shared with ``X``.
+
+    .. note::
+
+        Only :math:`m` two-graph matching problems are solved, and :math:`m \times budget` compositions are evaluated
+        for the new graph. Thus, the cost of adding a graph is :math:`O(m)` for a fixed ``budget``, compared with
+        :math:`O(m^3)` for re-solving the problem by :func:`~pygmtools.multi_graph_solvers.mgm_floyd`.
+
+    .. note::
+
+        This function is only implemented for ``numpy`` and ``pytorch`` backends.
+
+    .. dropdown:: Numpy Example
+
+        ::
+
+            >>> import numpy as np
+            >>> import pygmtools as pygm
+            >>> pygm.set_backend('numpy')
+            >>> np.random.seed(1)
+
+            # Generate 10 isomorphic graphs, and solve the first 9 graphs by mgm_floyd
+            >>> graph_num = 10
+            >>> As, X_gt = pygm.utils.generate_isomorphic_graphs(node_num=4, graph_num=10)
+            >>> As_1, As_2 = [], []
+            >>> for i in range(graph_num):
+            ...     for j in range(graph_num):
+            ...         As_1.append(As[i])
+            ...         As_2.append(As[j])
+            >>> As_1 = np.stack(As_1, axis=0)
+            >>> As_2 = np.stack(As_2, axis=0)
+            >>> conn1, edge1, ne1 = pygm.utils.dense_to_sparse(As_1)
+            >>> conn2, edge2, ne2 = pygm.utils.dense_to_sparse(As_2)
+            >>> import functools
+            >>> gaussian_aff = functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.) # set affinity function
+            >>> K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, None, None, None, edge_aff_fn=gaussian_aff)
+            >>> K = K.reshape(graph_num, graph_num, 4*4, 4*4)
+            >>> X = pygm.mgm_floyd(K[:9, :9])
+            >>> mmX = pygm.utils.MultiMatchingResult()
+            >>> for i in range(9):
+            ...     for j in range(i + 1, 9):
+            ...         mmX[i, j] = X[i, j]
+
+            # Add the 10th graph
+            >>> mmX = pygm.mgm_floyd_online(mmX, K[:9, 9], budget=3)
+            >>> X_new = np.stack([mmX[i, 9] for i in range(9)])
+            >>> (X_new * X_gt[:9, 9]).sum() / X_gt[:9, 9].sum()
+            1.0
+
+    .. dropdown:: Pytorch Example
+
+        ::
+
+            >>> import torch
+            >>> import pygmtools as pygm
+            >>> pygm.set_backend('pytorch')
+            >>> _ = torch.manual_seed(1)
+
+            # Generate 10 isomorphic graphs, and solve the first 9 graphs by mgm_floyd
+            >>> graph_num = 10
+            >>> As, X_gt = pygm.utils.generate_isomorphic_graphs(node_num=4, graph_num=10)
+            >>> As_1, As_2 = [], []
+            >>> for i in range(graph_num):
+            ...     for j in range(graph_num):
+            ...         As_1.append(As[i])
+            ...         As_2.append(As[j])
+            >>> As_1 = torch.stack(As_1, dim=0)
+            >>> As_2 = torch.stack(As_2, dim=0)
+            >>> conn1, edge1, ne1 = pygm.utils.dense_to_sparse(As_1)
+            >>> conn2, edge2, ne2 = pygm.utils.dense_to_sparse(As_2)
+            >>> import functools
+            >>> gaussian_aff = functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.) # set affinity function
+            >>> K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, None, None, None, edge_aff_fn=gaussian_aff)
+            >>> K = K.reshape(graph_num, graph_num, 4*4, 4*4)
+            >>> X = pygm.mgm_floyd(K[:9, :9])
+            >>> mmX = pygm.utils.MultiMatchingResult()
+            >>> for i in range(9):
+            ...     for j in range(i + 1, 9):
+            ...         mmX[i, j] = X[i, j]
+
+            # Add the 10th graph
+            >>> mmX = pygm.mgm_floyd_online(mmX, K[:9, 9], budget=3)
+            >>> X_new = torch.stack([mmX[i, 9] for i in range(9)])
+            >>> (X_new * X_gt[:9, 9]).sum() / X_gt[:9, 9].sum()
+            tensor(1.)
+
+    .. note::
+
+        If you find this graph matching solver useful in your research, please cite:
+
+        ::
+
+            @article{mgm_floyd,
+              title={Unifying offline and online multi-graph matching via finding shortest paths on supergraph},
+              author={Jiang, Zetian and Wang, Tianzhe and Yan, Junchi},
+              journal={IEEE transactions on pattern analysis and machine intelligence},
+              volume={43},
+              number={10},
+              pages={3648--3663},
+              year={2020},
+              publisher={IEEE}
+            }
+    """
+    if backend is None:
+        backend = pygmtools.BACKEND
+    # check the correctness of input
+    if not isinstance(X, pygmtools.utils.MultiMatchingResult):
+        raise ValueError(f"X must be a MultiMatchingResult object, got {type(X)}")
+    if X._cycle_consistent:
+        raise ValueError("Cycle-consistent MultiMatchingResult is not supported. Please use a pairwise one.")
+    _check_data_type(K_new, 'K_new', backend)
+    K_shape = _get_shape(K_new, backend)
+    if not (len(K_shape) == 3 and K_shape[1] == K_shape[2]):
+        raise ValueError(f"Unsupported input data shape: got K_new {K_shape}")
+    num_graph, aff_size = K_shape[0], K_shape[1]
+    num_node = int(math.sqrt(aff_size))
+    if not num_node ** 2 == aff_size:
+        raise ValueError("The input affinity matrix is not supported. Please note that this function "
+                         "does not support matching with outliers or partial matching.")
+    graph_idx = set(int(_) for key in X.match_dict for _ in key.split(','))
+    if not graph_idx == set(range(num_graph)):
+        raise ValueError(f"The number of graphs mismatches: got {len(graph_idx)} graphs in X, "
+                         f"K_new {K_shape} for {num_graph} graphs")
+    if budget is None:
+        budget = num_graph
+    if not (isinstance(budget, int) and budget >= 1):
+        raise ValueError(f"budget must be a positive integer, got budget={budget}")
+    budget = min(budget, num_graph)
+    if not 0 <= param_lambda <= 1: raise ValueError(f"param_lambda must be in [0, 1], got param_lambda={param_lambda}")
+    if x0_new is not None:
+        _check_data_type(x0_new, 'x0_new', backend)
+        x0_shape = _get_shape(x0_new, backend)
+        if not (len(x0_shape) == 3 and x0_shape[0] == num_graph and num_node == x0_shape[1] == x0_shape[2]):
+            raise ValueError(f"Unsupported input data shape: got K_new {K_shape} x0_new {x0_shape}")
+    else:
+        if qap_solver is None:
+            qap_solver = functools.partial(pygmtools.rrwm, n1max=num_node, n2max=num_node, backend=backend)
+        x0_new = qap_solver(K_new)
+        x0_new = pygmtools.hungarian(x0_new, backend=backend)
+
+    try:
+        mod = importlib.import_module(f'pygmtools.{backend}_backend')
+        fn = mod.mgm_floyd_online_solver
+    except (ModuleNotFoundError, AttributeError):
+        raise NotImplementedError(
+            NOT_IMPLEMENTED_MSG.format(backend)
+        )
+
+    # the anchors are the existing graphs best matched to the new graph
+    aff_new = pygmtools.utils.to_numpy(pygmtools.utils.compute_affinity_score(x0_new, K_new, backend=backend), backend)
+    anchors = np.argsort(-aff_new, kind='stable')[:budget]
+    X_anchor = [[X[i, a] if i != a else None for a in anchors] for i in range(num_graph)]
+
+    x_new = fn(K_new, x0_new, X_anchor, anchors, num_node, param_lambda)
+
+    result = copy.copy(X)
+    result.match_dict = copy.copy(X.match_dict)
+    for i in range(num_graph):
+        result[i, num_graph] = x_new[i]
+    return result
+
+
 def gamgm(A, W,
           ns=None, n_univ=None, U0=None,
           sk_init_tau=0.5, sk_min_tau=0.1, sk_gamma=0.8, sk_iter=20, max_iter=100, param_lambda=1.,
@@ -961,3 +1190,17 @@ def gamgm(A, W,
         )
 
     return fn(*args)
+
+
+def _pairwise_matching(x, num_graph, backend):
+    r"""
+    Build the :math:`(m\times m \times n \times n)` matchings from the matchings of the pairs :math:`i<j`.
+    """
+    try:
+        mod = importlib.import_module(f'pygmtools.{backend}_backend')
+        fn = mod._pairwise_matching
+    except (ModuleNotFoundError, AttributeError):
+        raise NotImplementedError(
+            NOT_IMPLEMENTED_MSG.format(backend)
+        )
+    return fn(x, num_graph)
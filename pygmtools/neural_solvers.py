@@ -982,7 +982,9 @@ def ngm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
     Hypergraph and Multiple-Graph Matching. TPAMI 2022."
     <https://ieeexplore.ieee.org/abstract/document/9426408/>`_
 
-    :param K: :math:`(b\times n_1n_2 \times n_1n_2)` the input affinity matrix, :math:`b`: batch size.
+    :param K: :math:`(b\times n_1n_2 \times n_1n_2)` the input affinity matrix, :math:`b`: batch size. For ``numpy``
+        and ``pytorch`` backends, a :class:`~pygmtools.utils.FactorizedAffinity` object (built by
+        :func:`~pygmtools.utils.build_aff_mat` with ``layout='factorized'``) is also supported.
     :param n1: :math:`(b)` number of nodes in graph1 (optional if n1max is given, and all n1=n1max).
     :param n2: :math:`(b)` number of nodes in graph2 (optional if n2max is given, and all n2=n2max).
     :param n1max: :math:`(b)` max number of nodes in graph1 (optional if n1 is given, and n1max=max(n1)).
@@ -1270,7 +1272,8 @@ def ngm(K, n1=None, n2=None, n1max=None, n2max=None, x0=None,
 
 def genn_astar(feat1, feat2, A1, A2, n1=None, n2=None, channel=None, filters_1=64, filters_2=32, filters_3=16,
            tensor_neurons=16, beam_width=0, trust_fact=1, no_pred_size=0,
-           network=None, return_network=False, pretrain='AIDS700nef', backend=None):
+           network=None, return_network=False, pretrain='AIDS700nef',
+           epsilon=0., time_budget=None, max_expansions=None, backend=None):
     r"""
     The **GENN-A\*** (Graph Edit Neural Network A\*) solver for graph matching (and graph edit distance)
     based on the fusion of traditional A\* and Neural Network.
@@ -1311,6 +1314,13 @@ def genn_astar(feat1, feat2, A1, A2, n1=None, n2=None, channel=None, filters_1=6
     :param pretrain: (default: 'AIDS700nef') If ``network==None``, the pretrained model weights to be loaded. Available
         pretrained weights: ``AIDS700nef`` (channel=36), ``LINUX`` (channel=8),
         or ``False`` (no pretraining).
+    :param epsilon: (default: 0) The weight of weighted A\*, the prediction is weighted by :math:`1+\epsilon` in the
+        priority of the search. Ignored if the network object is given (ignored if network!=None)
+    :param time_budget: (default: None, i.e. no limit) Wall-clock budget in seconds of the search for each instance.
+        When it runs out, the best partial matching is greedily completed. Ignored if the network object is given
+        (ignored if network!=None)
+    :param max_expansions: (default: None, i.e. no limit) Budget of the number of expanded search tree nodes for
+        each instance. Ignored if the network object is given (ignored if network!=None)
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
     :return: if ``return_network==False``, :math:`(b\times n_1 \times n_2)` the doubly-stochastic matching matrix
 
@@ -1466,7 +1476,8 @@ def genn_astar(feat1, feat2, A1, A2, n1=None, n2=None, channel=None, filters_1=6
     if n2 is not None: _check_data_type(n2, 'n2', backend)
 
     args = (feat1, feat2, A1, A2, n1, n2, channel, filters_1, filters_2, filters_3, 
-            tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain)
+            tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain,
+            epsilon, time_budget, max_expansions)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
         fn = mod.genn_astar
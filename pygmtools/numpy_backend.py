@@ -12,9 +12,13 @@ import itertools
 import functools
 import scipy.special
 import scipy.optimize
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
 import numpy as np
 import os
-from multiprocessing import Pool
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pygmtools.utils
 
 #############################################
@@ -24,7 +28,7 @@ import pygmtools.utils
 
 def hungarian(s: np.ndarray, n1: np.ndarray=None, n2: np.ndarray=None,
               unmatch1: np.ndarray=None, unmatch2: np.ndarray=None,
-              nproc: int=1) -> np.ndarray:
+              nproc: int=None, topk: int=None) -> np.ndarray:
     """
     numpy implementation of Hungarian algorithm
     """
@@ -44,25 +48,63 @@ def hungarian(s: np.ndarray, n1: np.ndarray=None, n2: np.ndarray=None,
     else:
         unmatch2 = [None] * batch_num
 
-    if nproc > 1:
-        with Pool(processes=nproc) as pool:
-            perm_mat = [_ for _ in perm_mat]
-            mapresult = pool.starmap_async(_hung_kernel, zip(perm_mat, n1, n2, unmatch1, unmatch2))
-            perm_mat = np.stack(mapresult.get())
-    else:
-        perm_mat = np.stack([_hung_kernel(perm_mat[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+    perm_mat = _hung_batch(perm_mat, n1, n2, unmatch1, unmatch2, nproc, topk)
 
     return perm_mat
 
 
-def _hung_kernel(s: np.ndarray, n1=None, n2=None, unmatch1=None, unmatch2=None):
+def _hung_batch(s: np.ndarray, n1, n2, unmatch1, unmatch2, nproc: int=None, topk: int=None) -> np.ndarray:
+    """
+    Solve a batch of LAPs by _hung_kernel. If nproc > 1, the instances are dispatched to a persistent thread pool
+    (the LAP solver from Scipy releases the GIL), so that no worker is spawned and no data is pickled for each call.
+    If nproc is None, the global setting pygmtools.NPROC is used.
+    """
+    if nproc is None:
+        nproc = pygmtools.NPROC
+    batch_num = s.shape[0]
+    kernel = functools.partial(_hung_kernel, topk=topk)
+    if nproc > 1 and batch_num > 1:
+        return np.stack(list(_get_thread_pool('hungarian', nproc).map(kernel, s, n1, n2, unmatch1, unmatch2)))
+    else:
+        return np.stack([kernel(s[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+
+
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+
+def _get_thread_pool(name: str, nproc: int) -> ThreadPoolExecutor:
     """
-    Hungarian kernel function by calling the linear sum assignment solver from Scipy.
+    Get the persistent thread pool of a solver (e.g. ``'hungarian'``, ``'astar'``). Each solver has its own pool, so
+    that long-running tasks of one solver do not block the calls of another. The pool is created at the first call and
+    reused afterwards. It is re-created if a different number of workers is requested, or in a forked child process.
+    A replaced pool is not shut down: the calls still running on it are completed, and its idle workers exit once it
+    is released.
+    """
+    key = (nproc, os.getpid())
+    with _thread_pools_lock:
+        pool_key, pool = _thread_pools.get(name, (None, None))
+        if pool_key != key:
+            pool = ThreadPoolExecutor(max_workers=nproc, thread_name_prefix=f'pygmtools_{name}')
+            _thread_pools[name] = (key, pool)
+        return pool
+
+
+def _hung_kernel(s: np.ndarray, n1=None, n2=None, unmatch1=None, unmatch2=None, topk=None):
+    """
+    Hungarian kernel function by calling the linear sum assignment solver from Scipy. If topk is given, the sparse
+    solver is called instead (see _sparse_hung_kernel).
     """
     if n1 is None:
         n1 = s.shape[0]
     if n2 is None:
         n2 = s.shape[1]
+    if topk is not None and topk < n2:
+        matching = _sparse_hung_kernel(s[:n1, :n2], unmatch1, unmatch2, topk)
+        if matching is not None:
+            perm_mat = np.zeros_like(s)
+            perm_mat[matching] = 1
+            return perm_mat
     if unmatch1 is not None and unmatch2 is not None:
         upper_left = s[:n1, :n2]
         upper_right = np.full((n1, n1), float('inf'))
@@ -85,20 +127,64 @@ def _hung_kernel(s: np.ndarray, n1=None, n2=None, unmatch1=None, unmatch2=None):
     return perm_mat
 
 
+def _sparse_hung_kernel(s: np.ndarray, unmatch1=None, unmatch2=None, topk=1):
+    """
+    Sparse Hungarian kernel function. Only the topk candidates with the lowest costs in each row are kept, and the
+    sparse LAP is solved by scipy.sparse.csgraph.min_weight_full_bipartite_matching. For the unmatch case, the dummy
+    nodes are connected sparsely: row i to dummy column i, dummy row j to column j, and dummy row j to dummy column i
+    for each candidate (i, j), so that the memory cost is O(n1 * topk + n2) instead of O((n1 + n2)^2).
+
+    Return None if there is no full matching among the candidates.
+    """
+    n1, n2 = s.shape
+    row = np.repeat(np.arange(n1), topk)
+    col = np.argpartition(s, topk - 1, axis=1)[:, :topk].reshape(-1)
+    cost = s[row, col]
+    if unmatch1 is not None and unmatch2 is not None:
+        row, col, cost = (np.concatenate(_) for _ in (
+            (row, np.arange(n1), np.arange(n2) + n1, col + n1),
+            (col, np.arange(n1) + n2, np.arange(n2), row + n2),
+            (cost, unmatch1[:n1], unmatch2[:n2], np.zeros_like(cost))
+        ))
+        shape = (n1 + n2, n2 + n1)
+    else:
+        shape = (n1, n2)
+    valid = np.isfinite(cost)
+    row, col, cost = row[valid], col[valid], cost[valid]
+    # the weights should be non-zero, and adding a constant does not change the optimal full matching
+    cost = cost - cost.min() + 1
+    try:
+        row, col = scipy.sparse.csgraph.min_weight_full_bipartite_matching(
+            scipy.sparse.csr_matrix((cost, (row, col)), shape=shape))
+    except ValueError:
+        return None
+    valid = np.logical_and(row < n1, col < n2)
+    return row[valid], col[valid]
+
+
 def sinkhorn(s: np.ndarray, nrows: np.ndarray=None, ncols: np.ndarray=None,
              unmatchrows: np.ndarray=None, unmatchcols: np.ndarray=None,
-             dummy_row: bool=False, max_iter: int=10, tau: float=1., batched_operation: bool=False) -> np.ndarray:
+             dummy_row: bool=False, max_iter: int=10, tau: float=1., batched_operation: bool=False,
+             tol: float=None, dual=None, return_dual: bool=False, return_iter: bool=False):
     """
     numpy implementation of Sinkhorn algorithm
     """
     batch_size = s.shape[0]
 
+    # the dual potentials are in the log domain, with shape (b x n1max), (b x n2max)
+    if dual is not None:
+        log_u, log_v = dual
+    else:
+        log_u = np.zeros((batch_size, s.shape[1]), dtype=s.dtype)
+        log_v = np.zeros((batch_size, s.shape[2]), dtype=s.dtype)
+
     if s.shape[2] >= s.shape[1]:
         transposed = False
     else:
         s = s.transpose((0, 2, 1))
         nrows, ncols = ncols, nrows
         unmatchrows, unmatchcols = unmatchcols, unmatchrows
+        log_u, log_v = log_v, log_u
         transposed = True
 
     if nrows is None:
@@ -112,7 +198,7 @@ def sinkhorn(s: np.ndarray, nrows: np.ndarray=None, ncols: np.ndarray=None,
         s_t = s.transpose((0, 2, 1))
         s_t = np.concatenate((
             s_t[:, :s.shape[1], :],
-            np.full((batch_size, s.shape[1], s.shape[2]-s.shape[1]), -float('inf'))), axis=2)
+            np.full((batch_size, s.shape[1], s.shape[2]-s.shape[1]), -float('inf'), dtype=s.dtype)), axis=2)
         s = np.where(transposed_batch.reshape(batch_size, 1, 1), s_t, s)
 
         new_nrows = np.where(transposed_batch, ncols, nrows)
@@ -122,13 +208,16 @@ def sinkhorn(s: np.ndarray, nrows: np.ndarray=None, ncols: np.ndarray=None,
 
         if unmatchrows is not None and unmatchcols is not None:
             unmatchrows_pad = np.concatenate((
-                unmatchrows, np.full((batch_size, unmatchcols.shape[1] - unmatchrows.shape[1]), -float('inf'))),
+                unmatchrows, np.full((batch_size, unmatchcols.shape[1] - unmatchrows.shape[1]), -float('inf'),
+                                     dtype=unmatchrows.dtype)),
             axis=1)
             new_unmatchrows = np.where(transposed_batch.reshape(batch_size, 1), unmatchcols, unmatchrows_pad)[:, :unmatchrows.shape[1]]
             new_unmatchcols = np.where(transposed_batch.reshape(batch_size, 1), unmatchrows_pad, unmatchcols)
             unmatchrows = new_unmatchrows
             unmatchcols = new_unmatchcols
 
+        log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+
     # operations are performed on log_s
     log_s = s / tau
     if unmatchrows is not None and unmatchcols is not None:
@@ -142,91 +231,112 @@ def sinkhorn(s: np.ndarray, nrows: np.ndarray=None, ncols: np.ndarray=None,
         dummy_shape[1] = log_s.shape[2] - log_s.shape[1]
         ori_nrows = nrows
         nrows = ncols.copy()
-        log_s = np.concatenate((log_s, np.full(dummy_shape, -float('inf'))), axis=1)
+        log_s = np.concatenate((log_s, np.full(dummy_shape, -float('inf'), dtype=log_s.dtype)), axis=1)
         if unmatchrows is not None:
-            unmatchrows = np.concatenate((unmatchrows, np.full((dummy_shape[0], dummy_shape[1]), -float('inf'))), axis=1)
-        for b in range(batch_size):
-            log_s[b, ori_nrows[b]:nrows[b], :ncols[b]] = -100
+            unmatchrows = np.concatenate(
+                (unmatchrows, np.full((dummy_shape[0], dummy_shape[1]), -float('inf'), dtype=unmatchrows.dtype)), axis=1)
+        log_u = np.concatenate((log_u, np.zeros((dummy_shape[0], dummy_shape[1]), dtype=log_u.dtype)), axis=1)
+    else:
+        ori_nrows = nrows
+
+    # all masks are built by broadcasting the node numbers, thus no loop over the batch is needed
+    nrows = nrows.reshape(batch_size, 1, 1)
+    ncols = ncols.reshape(batch_size, 1, 1)
+    ori_nrows = ori_nrows.reshape(batch_size, 1, 1)
 
     # assign the unmatch weights
     if unmatchrows is not None and unmatchcols is not None:
-        new_log_s = np.full((log_s.shape[0], log_s.shape[1]+1, log_s.shape[2]+1), -float('inf'))
+        new_log_s = np.full((log_s.shape[0], log_s.shape[1]+1, log_s.shape[2]+1), -float('inf'), dtype=log_s.dtype)
         new_log_s[:, :-1, :-1] = log_s
         log_s = new_log_s
-        for b in range(batch_size):
-            log_s[b, :nrows[b], ncols[b]] = unmatchrows[b, :nrows[b]]
-            log_s[b, nrows[b], :ncols[b]] = unmatchcols[b, :ncols[b]]
-    row_mask = np.zeros((batch_size, log_s.shape[1], 1), dtype=bool)
-    col_mask = np.zeros((batch_size, 1, log_s.shape[2]), dtype=bool)
-    for b in range(batch_size):
-        row_mask[b, :nrows[b], 0] = 1
-        col_mask[b, 0, :ncols[b]] = 1
+        unmatchrows = np.concatenate((unmatchrows, np.full((batch_size, 1), -float('inf'), dtype=unmatchrows.dtype)), axis=1)
+        unmatchcols = np.concatenate((unmatchcols, np.full((batch_size, 1), -float('inf'), dtype=unmatchcols.dtype)), axis=1)
+        log_u = np.concatenate((log_u, np.zeros((batch_size, 1), dtype=log_u.dtype)), axis=1)
+        log_v = np.concatenate((log_v, np.zeros((batch_size, 1), dtype=log_v.dtype)), axis=1)
+    row_idx = np.arange(log_s.shape[1]).reshape(1, -1, 1)
+    col_idx = np.arange(log_s.shape[2]).reshape(1, 1, -1)
+    row_mask = row_idx < nrows
+    col_mask = col_idx < ncols
+    if dummy_row:
+        log_s = np.where(np.logical_and(np.logical_and(row_idx >= ori_nrows, row_mask), col_mask), -100, log_s)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols += 1
-        nrows += 1
-
-    if batched_operation:
-        for b in range(batch_size):
-            log_s[b, nrows[b]:, :] = -float('inf')
-            log_s[b, :, ncols[b]:] = -float('inf')
-
-        for i in range(max_iter):
-            if i % 2 == 0:
-                log_sum = scipy.special.logsumexp(log_s, 2, keepdims=True)
-                log_s = log_s - np.where(row_mask, log_sum, np.zeros_like(log_sum))
-                if np.any(np.isnan(log_s)):
-                    raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-            else:
-                log_sum = scipy.special.logsumexp(log_s, 1, keepdims=True)
-                log_s = log_s - np.where(col_mask, log_sum, np.zeros_like(log_sum))
-                if np.any(np.isnan(log_s)):
-                    raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-        ret_log_s = log_s
+        log_s = np.where(np.logical_and(row_mask, col_idx == ncols), unmatchrows[:, :, None], log_s)
+        log_s = np.where(np.logical_and(row_idx == nrows, col_mask), unmatchcols[:, None, :], log_s)
+        valid_mask = np.logical_and(row_idx <= nrows, col_idx <= ncols)
     else:
-        ret_log_s = np.full((batch_size, log_s.shape[1], log_s.shape[2]), -float('inf'), dtype=log_s.dtype)
-
-        for b in range(batch_size):
-            row_slice = slice(0, nrows[b])
-            col_slice = slice(0, ncols[b])
-            log_s_b = log_s[b, row_slice, col_slice]
-            row_mask_b = row_mask[b, row_slice, :]
-            col_mask_b = col_mask[b, :, col_slice]
-
-            for i in range(max_iter):
-                if i % 2 == 0:
-                    log_sum = scipy.special.logsumexp(log_s_b, 1, keepdims=True)
-                    log_s_b = log_s_b - np.where(row_mask_b, log_sum, np.zeros_like(log_sum))
-                else:
-                    log_sum = scipy.special.logsumexp(log_s_b, 0, keepdims=True)
-                    log_s_b = log_s_b - np.where(col_mask_b, log_sum, np.zeros_like(log_sum))
-
-            ret_log_s[b, row_slice, col_slice] = log_s_b
-
+        valid_mask = np.logical_and(row_mask, col_mask)
+    log_u = log_u.reshape(batch_size, -1, 1)
+    log_v = log_v.reshape(batch_size, 1, -1)
+    log_s = np.where(valid_mask, log_s + log_u + log_v, -float('inf'))
+
+    # the iterations are performed on the whole batch, and the padded elements are excluded by the masks
+    active = np.ones((batch_size, 1, 1), dtype=bool)
+    n_iter = max_iter
+    for i in range(max_iter):
+        if i % 2 == 0:
+            log_sum = scipy.special.logsumexp(log_s, 2, keepdims=True)
+            if tol is not None and i > 0:
+                # the columns are normalized by the last iteration, and the rows are checked for convergence
+                err = np.where(row_mask, np.abs(np.exp(log_sum) - 1), 0).max(axis=1, keepdims=True)
+                active = np.logical_and(active, err >= tol)
+                if not np.any(active):
+                    n_iter = i
+                    break
+            log_sum = np.where(np.logical_and(row_mask, active), log_sum, np.zeros_like(log_sum))
+            log_u = log_u - log_sum
+        else:
+            log_sum = scipy.special.logsumexp(log_s, 1, keepdims=True)
+            log_sum = np.where(np.logical_and(col_mask, active), log_sum, np.zeros_like(log_sum))
+            log_v = log_v - log_sum
+        # NaN may only be introduced by the normalization factors, which are much smaller than log_s to check
+        if batched_operation and not np.all(np.isfinite(log_sum)):
+            raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
+        log_s = log_s - log_sum
+
+    # remove the unmatch weights and the dummy rows
+    ret_log_s = np.where(np.logical_and(row_idx < ori_nrows, col_mask), log_s, -float('inf'))
     if unmatchrows is not None and unmatchcols is not None:
-        nrows -= 1
-        ncols -= 1
-        for b in range(batch_size):
-            ret_log_s[b, :nrows[b] + 1, ncols[b]] = -float('inf')
-            ret_log_s[b, nrows[b], :ncols[b]] = -float('inf')
         ret_log_s = ret_log_s[:, :-1, :-1]
-
-    if dummy_row:
-        if dummy_shape[1] > 0:
-            ret_log_s = ret_log_s[:, :-dummy_shape[1]]
-        for b in range(batch_size):
-            ret_log_s[b, ori_nrows[b]:nrows[b], :ncols[b]] = -float('inf')
+    if dummy_row and dummy_shape[1] > 0:
+        ret_log_s = ret_log_s[:, :-dummy_shape[1]]
 
     if np.any(transposed_batch):
         s_t = ret_log_s.transpose((0, 2, 1))
         s_t = np.concatenate((
             s_t[:, :ret_log_s.shape[1], :],
-            np.full((batch_size, ret_log_s.shape[1], ret_log_s.shape[2]-ret_log_s.shape[1]), -float('inf'))), axis=2)
+            np.full((batch_size, ret_log_s.shape[1], ret_log_s.shape[2]-ret_log_s.shape[1]), -float('inf'),
+                    dtype=ret_log_s.dtype)), axis=2)
         ret_log_s = np.where(transposed_batch.reshape(batch_size, 1, 1), s_t, ret_log_s)
 
     if transposed:
         ret_log_s = ret_log_s.transpose((0, 2, 1))
 
-    return np.exp(ret_log_s)
+    ret = [np.exp(ret_log_s)]
+    if return_dual:
+        log_u, log_v = log_u[:, :, 0], log_v[:, 0, :]
+        if unmatchrows is not None and unmatchcols is not None:
+            log_u, log_v = log_u[:, :-1], log_v[:, :-1]
+        if dummy_row and dummy_shape[1] > 0:
+            log_u = log_u[:, :-dummy_shape[1]]
+        if np.any(transposed_batch):
+            log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+        if transposed:
+            log_u, log_v = log_v, log_u
+        ret.append((log_u, log_v))
+    if return_iter:
+        ret.append(n_iter)
+    return tuple(ret) if len(ret) > 1 else ret[0]
+
+
+def _swap_dual_batch(log_u: np.ndarray, log_v: np.ndarray, transposed_batch: np.ndarray):
+    """
+    Swap the row and column dual potentials of the transposed instances in Sinkhorn. It is assumed that
+    log_u.shape[1] <= log_v.shape[1], and log_u is padded by zeros.
+    """
+    transposed_batch = transposed_batch.reshape(-1, 1)
+    log_u_pad = np.concatenate(
+        (log_u, np.zeros((log_u.shape[0], log_v.shape[1] - log_u.shape[1]), dtype=log_u.dtype)), axis=1)
+    return np.where(transposed_batch, log_v[:, :log_u.shape[1]], log_u), np.where(transposed_batch, log_u_pad, log_v)
 
 
 #############################################
@@ -235,96 +345,312 @@ def sinkhorn(s: np.ndarray, nrows: np.ndarray=None, ncols: np.ndarray=None,
 
 
 def rrwm(K: np.ndarray, n1: np.ndarray, n2: np.ndarray, n1max, n2max, x0: np.ndarray,
-         max_iter: int, sk_iter: int, alpha: float, beta: float) -> np.ndarray:
+         max_iter: int, sk_iter: int, alpha: float, beta: float, return_iter: bool=False):
     """
     numpy implementation of RRWM algorithm.
     """
+    K, x0 = _apply_compute_dtype(K, x0)
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
-    # rescale the values in K
-    d = K.sum(axis=2, keepdims=True)
-    dmax = d.max(axis=1, keepdims=True)
-    K = K / (dmax + d.min() * 1e-5) # d.min() * 1e-5 for numerical reasons
-    v = v0
+    # rescale the values in K (the scaling factor is applied after each matrix-vector product, so that K is not copied)
+    d = _aff_matvec(K, np.ones_like(v0))
+    k_scale = d.max(axis=1, keepdims=True) + d.min(axis=1, keepdims=True) * 1e-5 # d.min() * 1e-5 for numerical reasons
+
+    # all buffers are allocated before the iterations and updated inplace, thus the memory cost is independent of
+    # max_iter. They are only re-allocated when the converged instances are removed from the batch
+    def init_workspace(v, n1, n2):
+        v_mat = v.reshape((v.shape[0], n2max, n1max)).transpose((0, 2, 1)) # a view of v as the matching matrix
+        return np.empty_like(v), np.empty_like(v), np.empty((v.shape[0], 1, 1), dtype=v.dtype), \
+            np.empty((v.shape[0], n1max, n2max), dtype=v.dtype), v_mat, _SinkhornWorkspace(n1, n2, n1max, n2max, v.dtype)
+
+    x = np.empty_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=int)
+    active = np.arange(batch_num)
+    v = v0.copy()
+    last_v, buf, n, s, v_mat, sk_workspace = init_workspace(v, n1, n2)
     for i in range(max_iter):
         # random walk
-        v = np.matmul(K, v)
-        last_v = v
-        n = np.linalg.norm(v, ord=1, axis=1, keepdims=True)
-        v = v / n
+        _aff_matvec(K, v, out=last_v)
+        last_v /= k_scale
+        np.sum(np.abs(last_v, out=buf), axis=1, keepdims=True, out=n)
+        np.divide(last_v, n, out=v)
 
         # reweighted jump
-        s = v.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
-        s = beta * s / np.amax(s, axis=(1, 2), keepdims=True)
-        v = alpha * sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose((0, 2, 1)).reshape((batch_num, n1n2, 1)) + \
-            (1 - alpha) * v
-        n = np.linalg.norm(v, ord=1, axis=1, keepdims=True)
-        v = np.matmul(v, 1 / n)
-
-        if np.linalg.norm((v - last_v).squeeze(axis=-1), ord='fro') < 1e-5:
-            break
+        np.amax(v_mat, axis=(1, 2), keepdims=True, out=n)
+        np.divide(v_mat, n, out=s)
+        s *= beta
+        sk_workspace.sinkhorn(s, sk_iter)
+        s *= alpha
+        v *= 1 - alpha
+        v_mat += s
+        np.sum(np.abs(v, out=buf), axis=1, keepdims=True, out=n)
+        v /= n
+
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        np.subtract(v, last_v, out=buf)
+        converged = np.sqrt(np.sum(np.square(buf, out=buf), axis=(1, 2), dtype=np.float64)) < 1e-5
+        if np.any(converged):
+            x[active[converged]] = v[converged]
+            n_iter[active[converged]] = i + 1
+            keep = np.nonzero(~converged)[0]
+            active, v, n1, n2, k_scale = active[keep], v[keep], n1[keep], n2[keep], k_scale[keep]
+            if active.size == 0:
+                break
+            K = _take_batch(K, keep)
+            last_v, buf, n, s, v_mat, sk_workspace = init_workspace(v, n1, n2)
+    x[active] = v
 
-    return v.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+    x = x.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+    if return_iter:
+        return x, n_iter
+    else:
+        return x
+
+
+class _SinkhornWorkspace:
+    """
+    Masks and buffers of the Sinkhorn algorithm (with tau=1) called in the inner loop of RRWM. They are built before
+    the iterations of RRWM, and the Sinkhorn iterations are performed inplace. The results are the same as
+    ``sinkhorn(s, nrows, ncols, max_iter, batched_operation=True)``, where the smaller dimension of each instance is
+    normalized first.
+    """
+    def __init__(self, nrows: np.ndarray, ncols: np.ndarray, nrows_max: int, ncols_max: int, dtype):
+        batch_size = nrows.shape[0]
+        nrows = nrows.reshape(batch_size, 1, 1)
+        ncols = ncols.reshape(batch_size, 1, 1)
+        row_pad = np.arange(nrows_max).reshape(1, -1, 1) >= nrows
+        col_pad = np.arange(ncols_max).reshape(1, 1, -1) >= ncols
+        self.invalid = np.logical_or(row_pad, col_pad)
+        rows_first = nrows <= ncols if nrows_max <= ncols_max else nrows < ncols
+        # the padded rows (columns), and the instances not normalized at the even (odd) iterations are skipped
+        self.row_skip = (np.logical_or(row_pad, ~rows_first), np.logical_or(row_pad, rows_first))
+        self.col_skip = (np.logical_or(col_pad, rows_first), np.logical_or(col_pad, ~rows_first))
+        self.row_all_skipped = tuple(np.all(_) for _ in self.row_skip)
+        self.col_all_skipped = tuple(np.all(_) for _ in self.col_skip)
+        self.buf = np.empty((batch_size, nrows_max, ncols_max), dtype=dtype)
+        self.row_max = np.empty((batch_size, nrows_max, 1), dtype=dtype)
+        self.row_sum = np.empty((batch_size, nrows_max, 1), dtype=dtype)
+        self.col_max = np.empty((batch_size, 1, ncols_max), dtype=dtype)
+        self.col_sum = np.empty((batch_size, 1, ncols_max), dtype=dtype)
+
+    def sinkhorn(self, log_s: np.ndarray, max_iter: int):
+        """
+        Run Sinkhorn on log_s inplace. log_s is overwritten by the doubly-stochastic matrix.
+        """
+        np.copyto(log_s, -float('inf'), where=self.invalid)
+        for i in range(max_iter):
+            if not self.row_all_skipped[i % 2]:
+                self._normalize(log_s, 2, self.row_max, self.row_sum, self.row_skip[i % 2])
+            if not self.col_all_skipped[i % 2]:
+                self._normalize(log_s, 1, self.col_max, self.col_sum, self.col_skip[i % 2])
+        np.exp(log_s, out=log_s)
+
+    def _normalize(self, log_s, axis, log_max, log_sum, skip):
+        """
+        Inplace logsumexp normalization. The skipped rows (columns) are subtracted by 0.
+        """
+        np.amax(log_s, axis=axis, keepdims=True, out=log_max)
+        np.copyto(log_max, 0, where=skip)
+        np.subtract(log_s, log_max, out=self.buf)
+        np.exp(self.buf, out=self.buf)
+        np.sum(self.buf, axis=axis, keepdims=True, out=log_sum)
+        np.copyto(log_sum, 1, where=skip)
+        np.log(log_sum, out=log_sum)
+        log_sum += log_max
+        log_s -= log_sum
 
 
 def sm(K: np.ndarray, n1: np.ndarray, n2: np.ndarray, n1max, n2max, x0: np.ndarray,
-       max_iter: int) -> np.ndarray:
+       max_iter: int, return_iter: bool=False, eigen_solver: str='power'):
     """
     numpy implementation of SM algorithm.
     """
+    K, x0 = _apply_compute_dtype(K, x0)
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    if eigen_solver != 'power':
+        x, n_iter = _sm_krylov(K, n1, n2, n1max, n2max, v0, max_iter, eigen_solver)
+        x = x.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+        if return_iter:
+            return x, n_iter
+        else:
+            return x
+
+    x = np.empty_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=int)
+    active = np.arange(batch_num)
     v = vlast = v0
     for i in range(max_iter):
-        v = np.matmul(K, v)
+        v = _aff_matvec(K, v)
         n = np.linalg.norm(v, ord=2, axis=1)
-        v = np.matmul(v, (1 / n).reshape((batch_num, 1, 1)))
-        if np.linalg.norm((v - vlast).squeeze(-1), ord='fro') < 1e-5:
-            break
+        v = np.matmul(v, (1 / n).reshape((-1, 1, 1)))
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = np.linalg.norm((v - vlast).squeeze(-1), ord=2, axis=1) < 1e-5
+        if np.any(converged):
+            x[active[converged]] = v[converged]
+            n_iter[active[converged]] = i + 1
+            keep = np.nonzero(~converged)[0]
+            active, v = active[keep], v[keep]
+            if active.size == 0:
+                break
+            K = _take_batch(K, keep)
         vlast = v
+    x[active] = v
 
-    x = v.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
-    return x
+    x = x.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+    if return_iter:
+        return x, n_iter
+    else:
+        return x
+
+
+def _sm_krylov(K, n1, n2, n1max, n2max, v0, max_iter, eigen_solver):
+    """
+    Compute the leading eigenvector of each instance by a Krylov method from Scipy: eigsh (Lanczos) if eigen_solver is
+    'lanczos', or lobpcg if eigen_solver is 'lobpcg'. The eigenproblem is restricted to the non-padded entries of each
+    instance, and K is only accessed by matrix-vector products. The number of products is returned as n_iter.
+    """
+    batch_num, n1n2 = v0.shape[:2]
+    x = np.zeros_like(v0)
+    n_iter = np.zeros(batch_num, dtype=int)
+    for b in range(batch_num):
+        idx = (np.arange(n2[b]).reshape((-1, 1)) * n1max + np.arange(n1[b]).reshape((1, -1))).reshape(-1)
+        op, num_matvec = _valid_aff_operator(K, b, idx, n1n2)
+        init = v0[b, idx]
+        if len(idx) <= 2 or not np.any(init):
+            vec = np.linalg.eigh(op.matmat(np.eye(len(idx), dtype=op.dtype)))[1][:, -1:]
+        elif eigen_solver == 'lanczos':
+            try:
+                vec = scipy.sparse.linalg.eigsh(op, k=1, which='LA', v0=init[:, 0], maxiter=max_iter, tol=1e-5)[1]
+            except scipy.sparse.linalg.ArpackNoConvergence as err:
+                vec = err.eigenvectors if err.eigenvectors.size > 0 else init / np.linalg.norm(init)
+        else:
+            vec = scipy.sparse.linalg.lobpcg(op, init, largest=True, maxiter=max_iter, tol=1e-5)[1]
+        # the sign of an eigenvector is arbitrary, and the one with positive sum is taken (as power iteration does)
+        if np.sum(vec) < 0:
+            vec = -vec
+        x[b, idx] = vec
+        n_iter[b] = num_matvec[0]
+    return x, n_iter
+
+
+def _valid_aff_operator(K, b, idx, n1n2):
+    """
+    The affinity matrix of the b-th instance restricted to the entries idx, as a scipy LinearOperator which counts the
+    number of matrix-vector products. K can be a dense np.ndarray, a list of scipy sparse matrices, or a
+    FactorizedAffinity object
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        K_b = _take_batch(K, np.array([b]))
+
+        def k_matmat(y):
+            full = np.zeros((1, n1n2, y.shape[1]), dtype=K.dtype)
+            full[0, idx] = y
+            return _aff_matvec(K_b, full)[0, idx]
+        dtype = K.dtype
+    else:
+        K_b = K[b].tocsr()[idx][:, idx] if type(K) is list else K[b][np.ix_(idx, idx)]
+        k_matmat = lambda y: K_b @ y
+        dtype = K_b.dtype
+
+    num_matvec = [0]
+
+    def matmat(y):
+        num_matvec[0] += y.shape[1]
+        return np.asarray(k_matmat(y))
+    op = scipy.sparse.linalg.LinearOperator((len(idx), len(idx)), matvec=lambda y: matmat(y.reshape((-1, 1))),
+                                            matmat=matmat, dtype=dtype)
+    return op, num_matvec
 
 
 def ipfp(K: np.ndarray, n1: np.ndarray, n2: np.ndarray, n1max, n2max, x0: np.ndarray,
-         max_iter) -> np.ndarray:
+         max_iter, return_iter: bool=False):
     """
     numpy implementation of IPFP algorithm
     """
+    K, x0 = _apply_compute_dtype(K, x0)
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    x = np.empty_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=int)
+    active = np.arange(batch_num)
     v = v0
-    last_v = v
     best_v = v
-    best_obj = -1
-
-    def comp_obj_score(v1, K, v2):
-        return np.matmul(np.matmul(v1.reshape((batch_num, 1, -1)), K), v2)
+    best_obj = np.full((batch_num, 1, 1), -1, dtype=np.float64)
+    # K v and the objective score v^T K v are cached, thus only K binary_v is computed in each iteration
+    Kv = _aff_matvec(K, v)
+    v_obj = _bdot(v, Kv)
 
     for i in range(max_iter):
-        cost = np.matmul(K, v).reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+        cost = Kv.reshape((-1, n2max, n1max)).transpose((0, 2, 1))
         binary_sol = hungarian(cost, n1, n2)
-        binary_v = binary_sol.transpose((0, 2, 1)).reshape((batch_num, -1, 1))
-        alpha = comp_obj_score(v, K, binary_v - v)
-        beta = comp_obj_score(binary_v - v, K, binary_v - v)
+        binary_v = binary_sol.transpose((0, 2, 1)).reshape((-1, n1n2, 1))
+        Kb = _aff_matvec(K, binary_v)
+        current_obj = _bdot(binary_v, Kb)
+        v_Kb = _bdot(v, Kb)
+        alpha = v_Kb - v_obj # v^T K (binary_v - v)
+        beta = current_obj - _bdot(binary_v, Kv) - v_Kb + v_obj # (binary_v - v)^T K (binary_v - v)
         t0 = - alpha / beta
-        v = np.where(np.logical_or(beta >= 0, t0 >= 1), binary_v, v + t0 * (binary_v - v))
-        last_v_obj = comp_obj_score(last_v, K, last_v)
+        last_v_obj = v_obj
+        cond = np.logical_or(beta >= 0, t0 >= 1)
+        t0 = t0.astype(v.dtype)
+        v = np.where(cond, binary_v, v + t0 * (binary_v - v))
+        Kv = np.where(cond, Kb, Kv + t0 * (Kb - Kv))
+        v_obj = _bdot(v, Kv)
 
-        current_obj = comp_obj_score(binary_v, K, binary_v)
         best_v = np.where(current_obj > best_obj, binary_v, best_v)
         best_obj = np.where(current_obj > best_obj, current_obj, best_obj)
 
-        if np.max(np.abs(last_v_obj - current_obj) / last_v_obj) < 1e-3:
-            break
-        last_v = v
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (np.abs(last_v_obj - current_obj) / last_v_obj).reshape(-1) < 1e-3
+        if np.any(converged):
+            x[active[converged]] = best_v[converged]
+            n_iter[active[converged]] = i + 1
+            keep = np.nonzero(~converged)[0]
+            active, v, Kv, v_obj, best_v, best_obj, n1, n2 = \
+                (_[keep] for _ in (active, v, Kv, v_obj, best_v, best_obj, n1, n2))
+            if active.size == 0:
+                break
+            K = _take_batch(K, keep)
+    x[active] = best_v
 
-    pred_x = best_v.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
-    return pred_x
+    pred_x = x.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+    if return_iter:
+        return pred_x, n_iter
+    else:
+        return pred_x
+
+
+def _bdot(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
+    """
+    Batched inner product of (b x n x 1) vectors, with output shape (b x 1 x 1). It is accumulated in float64, because
+    the line search of IPFP takes the differences of these products
+    """
+    return np.matmul(v1.transpose((0, 2, 1)), v2, dtype=np.float64)
+
+
+def _apply_compute_dtype(K, x0):
+    """
+    Cast K and x0 to the compute dtype of the classic solvers, which is pygmtools.COMPUTE_DTYPE if it is set, or the
+    dtype of K otherwise. K can be a dense np.ndarray, a list of scipy sparse matrices, or a FactorizedAffinity object
+    """
+    dtype = K[0].dtype if type(K) is list else K.dtype
+    if pygmtools.COMPUTE_DTYPE is not None and dtype != pygmtools.COMPUTE_DTYPE:
+        dtype = np.dtype(pygmtools.COMPUTE_DTYPE)
+        if type(K) is pygmtools.utils.FactorizedAffinity:
+            K = pygmtools.utils.FactorizedAffinity(
+                *(None if _ is None else _.astype(dtype) for _ in (K.node_aff, K.edge_aff)),
+                K.connectivity1, K.connectivity2, K.n1max, K.n2max, K.batched, K.backend)
+        elif type(K) is list:
+            K = [_.astype(dtype) for _ in K]
+        else:
+            K = K.astype(dtype)
+    if x0 is not None and x0.dtype != dtype:
+        x0 = x0.astype(dtype)
+    return K, x0
 
 
 def _check_and_init_gm(K, n1, n2, n1max, n2max, x0):
     # get batch number
-    batch_num = K.shape[0]
-    n1n2 = K.shape[1]
+    batch_num, n1n2 = _get_shape(K)[:2]
+    dtype = K[0].dtype if type(K) is list else K.dtype
 
     # get values of n1, n2, n1max, n2max and check
     if n1 is None:
@@ -341,7 +667,7 @@ def _check_and_init_gm(K, n1, n2, n1max, n2max, x0):
 
     # initialize x0 (also v0)
     if x0 is None:
-        x0 = np.zeros((batch_num, n1max, n2max), dtype=K.dtype)
+        x0 = np.zeros((batch_num, n1max, n2max), dtype=dtype)
         for b in range(batch_num):
             x0[b, 0:n1[b], 0:n2[b]] = 1. / (n1[b] * n2[b])
     v0 = x0.transpose((0, 2, 1)).reshape((batch_num, n1n2, 1))
@@ -357,22 +683,22 @@ def cao_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_step, la
     m, n = num_graph, num_node
     param_lambda = lambda_init
 
-    def _comp_aff_score(x, k):
-        return np.expand_dims(np.expand_dims(pygmtools.utils.compute_affinity_score(x, k, backend='numpy'),axis=-1),axis=-1)
-
     for iter in range(max_iter):
         if iter >= iter_boost:
             param_lambda = np.min([param_lambda * lambda_step, lambda_max])
         # pair_con = get_batch_pc_opt(X)
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - np.eye(m) * pair_aff
         norm = np.max(pair_aff)
         for i in range(m):
             for j in range(m):
                 if i >= j:
                     continue
-                aff_ori = _comp_aff_score(X[i, j], K[i, j]) / norm
-                con_ori = _get_single_pc_opt(X, i, j)
+                aff_ori = _single_aff_score(K, i, j, X[i, j]) / norm
+                # X_combos[k] = X[i, k] * X[k, j] is shared by the consistency of all candidates of (i, j)
+                X_combos = np.matmul(X[i, :], X[:, j])
+                aff_combos = _single_aff_score(K, i, j, X_combos) / norm
+                con_ori = _get_single_pc_opt(X, i, j, X_combos=X_combos)
                 # con_ori = torch.sqrt(pair_con[i, j])
                 if iter < iter_boost:
                     score_ori = aff_ori
@@ -380,9 +706,9 @@ def cao_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_step, la
                     score_ori = aff_ori * (1 - param_lambda) + con_ori * param_lambda
                 X_upt = X[i, j]
                 for k in range(m):
-                    X_combo = np.matmul(X[i, k], X[k, j])
-                    aff_combo = _comp_aff_score(X_combo, K[i, j]) / norm
-                    con_combo = _get_single_pc_opt(X, i, j, X_combo)
+                    X_combo = X_combos[k]
+                    aff_combo = aff_combos[k]
+                    con_combo = _get_single_pc_opt(X, i, j, X_combo, X_combos)
                     # con_combo = torch.sqrt(pair_con[i, k] * pair_con[k, j])
                     if iter < iter_boost:
                         score_combo = aff_combo
@@ -408,19 +734,17 @@ def cao_fast_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_ste
     m, n = num_graph, num_node
     param_lambda = lambda_init
 
-    def _comp_aff_score(x, k):
-        return np.expand_dims(np.expand_dims(pygmtools.utils.compute_affinity_score(x, k, backend='numpy'),axis=-1),axis=-1)
-
     mask1 = np.arange(m).reshape(m, 1).repeat(m,axis=1)
     mask2 = np.arange(m).reshape(1, m).repeat(m,axis=0)
     mask = (mask1 < mask2).astype(float)
     X_mask = mask.reshape(m, m, 1, 1)
+    pc_cache = _PairConsistencyCache(X)
 
     for iter in range(max_iter):
         if iter >= iter_boost:
             param_lambda = np.min([param_lambda * lambda_step, lambda_max])
 
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - np.eye(m) * pair_aff
         norm = np.max(pair_aff)
 
@@ -430,12 +754,11 @@ def cao_fast_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_ste
         X2 = np.tile(X2,(m, 1, 1, 1, 1)).swapaxes(1, 2).reshape(-1, n, n)  # X2[i,j,k] = X[k,j]
         X_combo = np.matmul(X1, X2).reshape(m, m, m, n, n) # X_combo[i,j,k] = X[i, k] * X[k, j]
 
-        aff_ori = (_comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
-        pair_con = _get_batch_pc_opt(X)
+        aff_ori = _pair_aff_score(K, X) / norm
+        pair_con = pc_cache.update(X)
         con_ori = np.sqrt(pair_con)
 
-        K_repeat = np.repeat(K.reshape(m, m, 1, n * n, n * n),m,axis=2).reshape(-1, n * n, n * n)
-        aff_combo = (_comp_aff_score(X_combo.reshape(-1, n, n), K_repeat) / norm).reshape(m, m, m)
+        aff_combo = _pair_aff_score(K, X_combo) / norm
         con1 = pair_con.reshape(m, 1, m)
         con1 = np.tile(con1,(1, m, 1))  # con1[i,j,k] = pair_con[i,k]
         con2 = pair_con.reshape(1, m, m)
@@ -461,14 +784,76 @@ def cao_fast_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_ste
     return X
 
 
-def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
+def cao_chunked_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_step, lambda_max, iter_boost,
+                       memory_budget):
+    r"""
+    Numpy implementation of CAO solver in chunked config. It follows cao_fast_solver, but the intermediate graphs k are
+    processed in blocks, and the affinity of X[i, k] * X[k, j] is computed with K[i, j] directly. Thus, neither the
+    (m, m, m, n, n) tensors nor the repeated K are built
+
+    :param K: affinity matrix, (m, m, n*n, n*n)
+    :param X: initial matching, (m, m, n, n)
+    :param num_graph: number of graphs, int
+    :param num_node: number of nodes, int
+    :param memory_budget: the memory budget (in bytes) of the intermediate arrays of each block
+    :return: X, (m, m, n, n)
+    """
     m, n = num_graph, num_node
+    param_lambda = lambda_init
+    # each block of size chunk costs about 4 arrays of (m, m, chunk, n, n)
+    chunk = int(min(max(memory_budget // (4 * m * m * n * n * X.dtype.itemsize), 1), m))
+
+    mask1 = np.arange(m).reshape(m, 1).repeat(m,axis=1)
+    mask2 = np.arange(m).reshape(1, m).repeat(m,axis=0)
+    mask = (mask1 < mask2).astype(float)
+    X_mask = mask.reshape(m, m, 1, 1)
+    pc_cache = _PairConsistencyCache(X)
 
-    def _comp_aff_score(x, k):
-        return np.expand_dims(np.expand_dims(pygmtools.utils.compute_affinity_score(x, k, backend='numpy'),axis=-1),axis=-1)
+    for iter in range(max_iter):
+        if iter >= iter_boost:
+            param_lambda = np.min([param_lambda * lambda_step, lambda_max])
+
+        aff = _pair_aff_score(K, X)
+        pair_aff = aff - np.eye(m) * aff
+        norm = np.max(pair_aff)
+        aff_ori = aff / norm
+
+        aff_combo = np.empty((m, m, m), dtype=aff_ori.dtype)
+        for k0 in range(0, m, chunk):
+            k1 = min(k0 + chunk, m)
+            X_combo = np.matmul(X[:, None, k0:k1], X[None, k0:k1].swapaxes(1, 2)) # X_combo[i,j,k] = X[i,k] * X[k,j]
+            aff_combo[:, :, k0:k1] = _pair_aff_score(K, X_combo) / norm
+        pair_con = pc_cache.update(X)
+        con_ori = np.sqrt(pair_con)
+
+        con1 = pair_con.reshape(m, 1, m)  # con1[i,j,k] = pair_con[i,k]
+        con2 = pair_con.reshape(1, m, m).swapaxes(1, 2)  # con2[i,j,k] = pair_con[j,k]
+        con_combo = np.sqrt(con1 * con2)
+
+        if iter < iter_boost:
+            score_ori = aff_ori
+            score_combo = aff_combo
+        else:
+            score_ori = aff_ori * (1 - param_lambda) + con_ori * param_lambda
+            score_combo = aff_combo * (1 - param_lambda) + con_combo * param_lambda
+
+        idx = np.argmax(score_combo,axis=-1)
+        score_combo = np.max(score_combo, axis=-1)
+
+        if not np.all(score_combo + 1e-4 >= score_ori):
+            raise RuntimeError('CAO-chunked internal error', np.min(score_combo - score_ori))
+        X_upt = np.matmul(X[mask1, idx], X[idx, mask2])
+        X = X_upt * X_mask + X_upt.swapaxes(0,1).swapaxes(2,3) * X_mask.swapaxes(0,1) + X * (1 - X_mask - X_mask.swapaxes(0, 1))
+        if not np.all(X.swapaxes(0,1).swapaxes(2,3) == X):
+            raise RuntimeError('CAO-chunked internal error')
+    return X
+
+
+def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
+    m, n = num_graph, num_node
 
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - np.eye(m) * pair_aff
         norm = np.max(pair_aff)
 
@@ -480,32 +865,32 @@ def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
             for j in range(m):
                 if i >= j:
                     continue
-                score_ori = _comp_aff_score(X[i, j], K[i, j]) / norm
+                score_ori = _single_aff_score(K, i, j, X[i, j]) / norm
                 X_combo = np.matmul(X[i, k], X[k, j])
-                score_combo = _comp_aff_score(X_combo, K[i, j]) / norm
+                score_combo = _single_aff_score(K, i, j, X_combo) / norm
 
                 if score_combo > score_ori:
                     X[i, j] = X_combo
                     X[j, i] = X_combo.swapaxes(0, 1)
 
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - np.eye(m) * pair_aff
         norm = np.max(pair_aff)
 
-        pair_con = _get_batch_pc_opt(X)
         for i in range(m):
             for j in range(m):
                 if i >= j:
                     continue
-                aff_ori = _comp_aff_score(X[i, j], K[i, j]) / norm
-                con_ori = _get_single_pc_opt(X, i, j)
+                aff_ori = _single_aff_score(K, i, j, X[i, j]) / norm
+                X_combos = np.matmul(X[i, :], X[:, j])  # shared by the consistency of X[i, j] and X_combo
+                con_ori = _get_single_pc_opt(X, i, j, X_combos=X_combos)
                 # con_ori = torch.sqrt(pair_con[i, j])
                 score_ori = aff_ori * (1 - param_lambda) + con_ori * param_lambda
 
-                X_combo = np.matmul(X[i, k], X[k, j])
-                aff_combo = _comp_aff_score(X_combo, K[i, j]) / norm
-                con_combo = _get_single_pc_opt(X, i, j, X_combo)
+                X_combo = X_combos[k]
+                aff_combo = _single_aff_score(K, i, j, X_combo) / norm
+                con_combo = _get_single_pc_opt(X, i, j, X_combo, X_combos)
                 # con_combo = torch.sqrt(pair_con[i, k] * pair_con[k, j])
                 score_combo = aff_combo * (1 - param_lambda) + con_combo * param_lambda
 
@@ -518,16 +903,13 @@ def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
 def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
     m, n = num_graph, num_node
 
-    def _comp_aff_score(x, k):
-        return np.expand_dims(np.expand_dims(pygmtools.utils.compute_affinity_score(x, k, backend='numpy'),axis=-1),axis=-1)
-
     mask1 = np.arange(m).reshape(m, 1).repeat(m,axis=1)
     mask2 = np.arange(m).reshape(1, m).repeat(m,axis=0)
     mask = (mask1 < mask2).astype(float)
     X_mask = mask.reshape(m, m, 1, 1)
 
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - np.eye(m) * pair_aff
         norm = np.max(pair_aff)
 
@@ -541,8 +923,8 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
         X2 = np.tile(X2,(m, 1, 1, 1)).reshape(-1, n, n)  # X[i, j] = X[j, k]
         X_combo = np.matmul(X1, X2).reshape(m, m, n, n)
 
-        aff_ori = (_comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
-        aff_combo = (_comp_aff_score(X_combo.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
+        aff_ori = _pair_aff_score(K, X) / norm
+        aff_combo = _pair_aff_score(K, X_combo) / norm
 
         score_ori = aff_ori
         score_combo = aff_combo
@@ -552,12 +934,13 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
         X = X * (1.0 - upt) + X_combo * upt
         X = X * X_mask + X.swapaxes(0,1).swapaxes(2, 3) * (1 - X_mask)
 
+    pc_cache = _PairConsistencyCache(X)
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - np.eye(m) * pair_aff
         norm = np.max(pair_aff)
 
-        pair_con = _get_batch_pc_opt(X)
+        pair_con = pc_cache.update(X)
 
         X1 = X[:, k].reshape(m, 1, n, n)
         X1 = np.tile(X1,(1, m, 1, 1)).reshape(-1, n, n)  # X[i, j] = X[i, k]
@@ -565,8 +948,8 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
         X2 = np.tile(X2,(m, 1, 1, 1)).reshape(-1, n, n)  # X[i, j] = X[j, k]
         X_combo = np.matmul(X1, X2).reshape(m, m, n, n)
 
-        aff_ori = (_comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
-        aff_combo = (_comp_aff_score(X_combo.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
+        aff_ori = _pair_aff_score(K, X) / norm
+        aff_combo = _pair_aff_score(K, X_combo) / norm
 
         con_ori = np.sqrt(pair_con)
         con1 = pair_con[:, k].reshape(m, 1).repeat(m,axis=1)
@@ -583,24 +966,155 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
     return X
 
 
-def _get_single_pc_opt(X, i, j, Xij=None):
+def mgm_floyd_online_solver(K_new, x_new, X_anchor, anchors, num_node, param_lambda):
+    r"""
+    Numpy implementation of the online MGM-Floyd update. The matchings between the new graph and the existing graphs
+    are updated by the Floyd step through the anchor graphs a, i.e. X[i, new] <- X[i, a] * X[a, new]
+
+    :param K_new: affinity matrix between the existing graphs and the new graph, (m, n*n, n*n)
+    :param x_new: initial matching between the existing graphs and the new graph, (m, n, n)
+    :param X_anchor: X_anchor[i][t] = X[i, anchors[t]], list of lists of (n, n) matrices (None if i == anchors[t])
+    :param anchors: indices of the anchor graphs, (b,)
+    :param num_node: number of nodes, int
+    :param param_lambda: weight of the consistency term, float
+    :return: the updated matching between the existing graphs and the new graph, (m, n, n)
+    """
+    m, b, n = x_new.shape[0], len(anchors), num_node
+    eye = np.eye(n, dtype=x_new.dtype)
+    X_anchor = np.stack([np.stack([eye if x is None else x for x in row]) for row in X_anchor])
+    X_combo = np.matmul(X_anchor, np.expand_dims(x_new[anchors], 0))  # X_combo[i, t] = X[i, a_t] * X[a_t, new]
+
+    aff_ori = compute_affinity_score(x_new, K_new)
+    aff_combo = np.stack([compute_affinity_score(X_combo[:, t], K_new) for t in range(b)], axis=1)
+    norm = max(np.max(aff_ori), np.max(aff_combo))
+
+    # consistency is measured w.r.t. the paths through the anchors
+    con_ori = 1 - np.sum(np.abs(X_combo - np.expand_dims(x_new, 1)), axis=(1, 2, 3)) / (2 * n * b)
+    con_combo = np.stack([1 - np.sum(np.abs(X_combo - X_combo[:, t:t + 1]), axis=(1, 2, 3)) / (2 * n * b)
+                          for t in range(b)], axis=1)
+
+    score_ori = aff_ori / norm * (1 - param_lambda) + con_ori * param_lambda
+    score_combo = aff_combo / norm * (1 - param_lambda) + con_combo * param_lambda
+
+    best = np.argmax(score_combo, axis=1)
+    upt = (score_ori < score_combo[np.arange(m), best]).reshape(m, 1, 1)
+    return np.where(upt, X_combo[np.arange(m), best], x_new)
+
+
+def _pair_aff_score(K, X):
+    """
+    CAO/Floyd helper function (compute the affinity scores of all pairs)
+    :param K: (m, m, n*n, n*n) affinity matrix, or a PairwiseAffinity object
+    :param X: (m, m, n, n) or (m, m, c, n, n) the matchings, where X[i, j] is scored with K[i, j]
+    :return: (m, m) or (m, m, c) the affinity scores. The diagonal is zero for PairwiseAffinity
+    """
+    m, n = X.shape[0], X.shape[-1]
+    Xc = X.reshape(m, m, -1, n, n)
+    c = Xc.shape[2]
+    vx = Xc.swapaxes(3, 4).reshape(m, m, c, n * n).swapaxes(2, 3)  # (m, m, n*n, c)
+    if type(K) is pygmtools.utils.PairwiseAffinity:
+        i, j = np.triu_indices(m, 1)
+        # the score of X[j, i] with K[j, i] equals the score of X[j, i]^T with K[i, j]
+        vx = np.concatenate((vx[i, j], vx[j, i].reshape(-1, n, n, c).swapaxes(1, 2).reshape(-1, n * n, c)), axis=2)
+        score = np.sum(vx * _aff_matvec(K.K, vx), axis=1)
+        ret = np.zeros((m, m, c), dtype=score.dtype)
+        ret[i, j] = score[:, :c]
+        ret[j, i] = score[:, c:]
+    else:
+        vx = vx.reshape(m * m, n * n, c)
+        ret = np.sum(vx * np.matmul(K.reshape(m * m, n * n, n * n), vx), axis=1)
+    return ret.reshape(X.shape[:-2])
+
+
+def _single_aff_score(K, i, j, x):
+    """
+    CAO/Floyd helper function (compute the affinity scores of one pair)
+    :param K: (m, m, n*n, n*n) affinity matrix, or a PairwiseAffinity object
+    :param i: index
+    :param j: index
+    :param x: (n, n) or (c, n, n) the matchings of graph i and graph j
+    :return: () or (c,) the affinity scores
+    """
+    n = x.shape[-1]
+    xc = x.reshape(-1, n, n)
+    if type(K) is pygmtools.utils.PairwiseAffinity:
+        if i > j:
+            i, j, xc = j, i, xc.swapaxes(1, 2)
+        K_ij = _take_batch(K.K, [K.pair_index(i, j)])
+    else:
+        K_ij = np.expand_dims(K[i, j], 0)
+    vx = np.expand_dims(xc.swapaxes(1, 2).reshape(-1, n * n).swapaxes(0, 1), 0)  # (1, n*n, c)
+    return np.sum(vx * _aff_matvec(K_ij, vx), axis=1).reshape(x.shape[:-2])
+
+
+def _pairwise_matching(x, num_graph):
+    """
+    CAO/Floyd helper function (build the matchings of all pairs)
+    :param x: (m*(m-1)/2, n, n) the matchings of the pairs (i, j), i < j in the row-major order
+    :param num_graph: number of graphs, int
+    :return: (m, m, n, n) the matchings of all pairs
+    """
+    m, n = num_graph, x.shape[-1]
+    i, j = np.triu_indices(m, 1)
+    X = np.zeros((m, m, n, n), dtype=x.dtype)
+    X[i, j] = x
+    X[j, i] = x.swapaxes(1, 2)
+    X[np.arange(m), np.arange(m)] = np.eye(n, dtype=x.dtype)
+    return X
+
+
+def _get_single_pc_opt(X, i, j, Xij=None, X_combos=None):
     """
     CAO/Floyd helper function (compute consistency)
     :param X: (m, m, n, n) all the matching results
     :param i: index
     :param j: index
+    :param Xij: (optional) the matching to be evaluated, X[i, j] by default
+    :param X_combos: (optional) (m, n, n) the precomputed X[i, k] * X[k, j] for all k
     :return: the consistency of X_ij
     """
     m, _, n, _ = X.shape
     if Xij is None:
         Xij = X[i, j]
-    X1 = X[i, :].reshape(-1, n, n)
-    X2 = X[:, j].reshape(-1, n, n)
-    X_combo = np.matmul(X1, X2)
-    pair_con = 1 - np.sum(np.abs(Xij - X_combo)) / (2 * n * m)
+    if X_combos is None:
+        X_combos = np.matmul(X[i, :], X[:, j])
+    pair_con = 1 - np.sum(np.abs(Xij - X_combos)) / (2 * n * m)
     return pair_con
 
 
+class _PairConsistencyCache:
+    """
+    CAO/Floyd-fast helper class (compute consistency incrementally). The results are the same as _get_batch_pc_opt,
+    but the errors err[i, j, k] = |X[i, j] - X[i, k] * X[k, j]| are cached, and only the entries involving the updated
+    matchings are recomputed. Besides, the (m, m, m, n, n) tensor is never built.
+    """
+    def __init__(self, X):
+        m, n = X.shape[0], X.shape[2]
+        self.X = X.copy()
+        self.err = np.empty((m, m, m), dtype=X.dtype)
+        for i in range(m):
+            # X_combo[j, k] = X[i, k] * X[k, j]
+            X_combo = np.matmul(np.expand_dims(X[i], 0), X.swapaxes(0, 1))
+            self.err[i] = np.sum(np.abs(X_combo - np.expand_dims(X[i], 1)), axis=(2, 3))
+
+    def update(self, X):
+        """
+        Update the cache with the new matching results X, and return the (m, m) consistency of X
+        """
+        m, n = X.shape[0], X.shape[2]
+        changed = np.any(X != self.X, axis=(2, 3))
+        if np.any(changed):
+            self.X = X.copy()
+            # err[i, j, k] depends on X[i, j], X[i, k] and X[k, j]
+            outdated = np.expand_dims(changed, 2) | np.expand_dims(changed, 1) | np.expand_dims(changed.T, 0)
+            i, j, k = np.nonzero(outdated)
+            for s in range(0, i.shape[0], m * m):
+                _i, _j, _k = i[s:s + m * m], j[s:s + m * m], k[s:s + m * m]
+                X_combo = np.matmul(X[_i, _k], X[_k, _j])
+                self.err[_i, _j, _k] = np.sum(np.abs(X_combo - X[_i, _j]), axis=(1, 2))
+        return 1 - np.sum(self.err, axis=2) / (2 * n * m)
+
+
 def _get_batch_pc_opt(X):
     """
     CAO/Floyd-fast helper function (compute consistency in batch)
@@ -635,13 +1149,6 @@ def gamgm(
         ns = np.full((num_graphs,), A.shape[1], dtype='i4')
     n_indices = np.cumsum(ns, axis=0)
 
-    # build a super adjacency matrix A
-    supA = np.zeros((n_indices[-1], n_indices[-1]))
-    for i in range(num_graphs):
-        start_n = n_indices[i] - ns[i]
-        end_n = n_indices[i]
-        supA[start_n:end_n, start_n:end_n] = A[i, :ns[i], :ns[i]]
-
     # handle the type of n_univ
     if type(n_univ) is np.ndarray:
         n_univ = n_univ.item()
@@ -655,17 +1162,8 @@ def gamgm(
     if cluster_M is None:
         cluster_M = np.ones((num_graphs, num_graphs))
 
-    # reshape W into supW
-    supW = np.zeros((n_indices[-1], n_indices[-1]))
-    for i, j in itertools.product(range(num_graphs), repeat=2):
-        start_x = n_indices[i] - ns[i]
-        end_x = n_indices[i]
-        start_y = n_indices[j] - ns[j]
-        end_y = n_indices[j]
-        supW[start_x:end_x, start_y:end_y] = W[i, j, :ns[i], :ns[j]]
-
     U = gamgm_real(
-        supA, supW, ns, n_indices, n_univ, num_graphs, U0,
+        A, W, ns, n_indices, n_univ, num_graphs, U0,
         init_tau, min_tau, sk_gamma,
         sk_iter, max_iter, quad_weight,
         converge_thresh, outlier_thresh,
@@ -684,7 +1182,7 @@ def gamgm(
 
 
 def gamgm_real(
-        supA, supW, ns, n_indices, n_univ, num_graphs, U0,
+        A, W, ns, n_indices, n_univ, num_graphs, U0,
         init_tau, min_tau, sk_gamma,
         sk_iter, max_iter, quad_weight,
         converge_thresh, outlier_thresh,
@@ -692,21 +1190,58 @@ def gamgm_real(
         cluster_M, projector, hung_iter # these arguments are reserved for clustering
         ):
     """
-    The real forward function of GAMGM
+    The real forward function of GAMGM. The super adjacency matrix supA = diag(A_1, ..., A_m) and the super weight
+    matrix supW = [W_ij] are never built, and the products with them are computed by the blocks of each graph
     """
     U = U0
     sinkhorn_tau = init_tau
     iter_flag = True
 
+    n_max = A.shape[1]
+    # U[k] is the node node_idx[k] of graph graph_idx[k]
+    graph_idx = np.repeat(np.arange(num_graphs), ns)
+    node_idx = np.arange(n_indices[-1]) - np.repeat(n_indices - ns, ns)
+    U_pad = np.zeros((num_graphs, n_max, n_univ), dtype=U.dtype)
+    # the cluster weights are applied to the blocks of W once, and the padded rows of U_pad are always zero
+    supW_pad = (W * cluster_M.reshape(num_graphs, num_graphs, 1, 1)).swapaxes(1, 2).reshape(num_graphs * n_max, -1)
+    all_cluster = bool(np.all(cluster_M == 1))
+
+    def _quad_unary(U):
+        # block (i, j) of supA (UU^T * cluster_weight) supA is M_ij A_i U_i U_j^T A_j, thus the i-th block of the
+        # quad term is A_i U_i sum_j M_ij U_j^T A_j U_j
+        U_pad[graph_idx, node_idx] = U
+        AU = np.matmul(A, U_pad)
+        UAU = np.matmul(U_pad.swapaxes(1, 2), AU).reshape(num_graphs, -1)
+        if all_cluster:
+            # all graphs are in one cluster, the sum over j is shared by every graph
+            quad = np.matmul(AU, UAU.sum(axis=0).reshape(n_univ, n_univ))
+        else:
+            quad = np.matmul(AU, np.matmul(cluster_M, UAU).reshape(num_graphs, n_univ, n_univ))
+        unary = np.matmul(supW_pad, U_pad.reshape(-1, n_univ)).reshape(num_graphs, n_max, n_univ)
+        return quad[graph_idx, node_idx] * quad_weight * 2, unary[graph_idx, node_idx]
+
+    def _uut_diff(U1, U2):
+        # the Frobenius norm of U1 U1^T - U2 U2^T without building the (sum n) x (sum n) matrices. With S = U1 + U2
+        # and D = U1 - U2, U1 U1^T - U2 U2^T = (S D^T + D S^T) / 2, and its squared norm is
+        # (tr((D^T S)^2) + tr(S^T S D^T D)) / 2, where only n_univ x n_univ products are involved
+        S, D = U1 + U2, U1 - U2
+        DtS = np.matmul(D.T, S)
+        diff = (np.sum(DtS * DtS.T) + np.sum(np.matmul(S.T, S) * np.matmul(D.T, D))) / 2
+        return np.sqrt(max(diff, 0))
+
+    # graphs of different sizes are projected in one batched call on the padded layout
+    uniform_ns = bool(np.all(ns == ns[0]))
+    V_pad = np.zeros((num_graphs, n_max, n_univ), dtype=U.dtype)
+
+    def _hung_project(S):
+        V_pad[graph_idx, node_idx] = S
+        return hungarian(V_pad, ns)[graph_idx, node_idx]
+
     while iter_flag:
         for i in range(max_iter):
             # compact matrix form update of V
-            UUt = np.matmul(U, U.T)
-            lastUUt = UUt
-            cluster_weight = np.repeat(cluster_M, ns.astype('i4'), axis=0)
-            cluster_weight = np.repeat(cluster_weight, ns.astype('i4'), axis=1)
-            quad = np.matmul(np.matmul(np.matmul(supA, UUt * cluster_weight), supA), U) * quad_weight * 2
-            unary = np.matmul(supW * cluster_weight, U)
+            lastU = U
+            quad, unary = _quad_unary(U)
             if verbose:
                 if projector == 'sinkhorn':
                     print_str = f'tau={sinkhorn_tau:.3e}'
@@ -716,67 +1251,40 @@ def gamgm_real(
                       f'quad score: {(quad * U).sum():.3e}, unary score: {(unary * U).sum():.3e}')
             V = (quad + unary) / num_graphs
 
-            U_list = []
             if projector == 'hungarian':
-                n_start = 0
-                for n_end in n_indices:
-                    U_list.append(pygmtools.hungarian(V[n_start:n_end, :n_univ], backend='numpy'))
-                    n_start = n_end
+                U = _hung_project(V)
             elif projector == 'sinkhorn':
-                if np.all(ns == ns[0]):
+                if uniform_ns:
                     if ns[0] <= n_univ:
-                        U_list.append(
-                            sinkhorn(
-                                V.reshape(num_graphs, -1, n_univ),
-                                max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
-                            ).reshape(-1, n_univ))
+                        U = sinkhorn(
+                            V.reshape(num_graphs, -1, n_univ),
+                            max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
+                        ).reshape(-1, n_univ)
                     else:
-                        U_list.append(
-                            sinkhorn(
-                                V.reshape(num_graphs, -1, n_univ).swapaxes(1, 2),
-                                max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
-                            ).swapaxes(1, 2).reshape(-1, n_univ))
+                        U = sinkhorn(
+                            V.reshape(num_graphs, -1, n_univ).swapaxes(1, 2),
+                            max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
+                        ).swapaxes(1, 2).reshape(-1, n_univ)
                 else:
-                    V_list = []
-                    n1 = []
-                    n_start = 0
-                    for n_end in n_indices:
-                        V_list.append(V[n_start:n_end, :n_univ])
-                        n1.append(n_end - n_start)
-                        n_start = n_end
-                    V_batch = build_batch(V_list)
-                    U = sinkhorn(V_batch, n1,
+                    V_pad[graph_idx, node_idx] = V
+                    U = sinkhorn(V_pad, ns,
                                  max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True)
-                    n_start = 0
-                    for idx, n_end in enumerate(n_indices):
-                        U_list.append(U[idx, :n_end - n_start, :])
-                        n_start = n_end
+                    U = U[graph_idx, node_idx]
             else:
                 raise NameError('Unknown projecter name: {}'.format(projector))
 
-            U = np.concatenate(U_list, axis=0)
             if num_graphs == 2:
                 U[:ns[0], :] = np.eye(ns[0], n_univ)
 
             # calculate gap to discrete
             if projector == 'sinkhorn' and verbose:
-                U_list_hung = []
-                n_start = 0
-                for n_end in n_indices:
-                    U_list_hung.append(pygmtools.hungarian(V[n_start:n_end, :n_univ], backend='numpy'))
-                    n_start = n_end
-                U_hung = np.concatenate(U_list_hung, axis=0)
-                diff = np.linalg.norm(np.matmul(U, U.transpose()) - lastUUt)
+                U_hung = _hung_project(V)
+                diff = _uut_diff(U, lastU)
                 print(f'tau={sinkhorn_tau:.3e} #iter={i}/{max_iter} '
                       f'gap to discrete: {np.mean(np.abs(U - U_hung)):.3e}, iter diff: {diff:.3e}')
 
             if projector == 'hungarian' and outlier_thresh > 0:
-                U_hung = U
-                UUt = np.matmul(U_hung, U_hung.transpose())
-                cluster_weight = np.repeat(cluster_M, ns.astype('i4'), axis=0)
-                cluster_weight = np.repeat(cluster_weight, ns.astype('i4'), axis=1)
-                quad = np.linalg.multi_dot((supA, UUt * cluster_weight, supA, U_hung)) * quad_weight * 2
-                unary = np.matmul(supW * cluster_weight, U_hung)
+                quad, unary = _quad_unary(U)
                 max_vals = (unary + quad).max(axis=1)
                 U = U * (unary + quad > outlier_thresh)
                 if verbose:
@@ -786,7 +1294,7 @@ def gamgm_real(
                           f'min:{max_vals.min():.4f}, mean:{max_vals.mean():.4f}, '
                           f'median:{np.median(max_vals):.4f}, max:{max_vals.max():.4f}')
 
-            if np.linalg.norm(np.matmul(U, U.T) - lastUUt) < converge_thresh:
+            if _uut_diff(U, lastU) < converge_thresh:
                 break
 
         if verbose: print('-' * 20)
@@ -795,8 +1303,7 @@ def gamgm_real(
             if hung_iter:
                 pass
             else:
-                U_list = [pygmtools.hungarian(_, backend='numpy') for _ in U_list]
-                U = np.concatenate(U_list, axis=0)
+                U = _hung_project(U)
                 break
 
         # projection control
@@ -808,8 +1315,7 @@ def gamgm_real(
             if hung_iter:
                 projector = 'hungarian'
             else:
-                U_list = [pygmtools.hungarian(_, backend='numpy') for _ in U_list]
-                U = np.concatenate(U_list, axis=0)
+                U = _hung_project(U)
                 break
 
     return U
@@ -1148,8 +1654,13 @@ class NGM_Net():
         _sinkhorn_func = functools.partial(sinkhorn,
                                            dummy_row=False, max_iter=sk_max_iter, tau=sk_tau, batched_operation=False)
         emb = v0
-        A = (K != 0)
-        emb_K = np.expand_dims(K,axis=-1)
+        if type(K) is pygmtools.utils.FactorizedAffinity:
+            # K is applied implicitly, and A is the number of non-zero elements in each row of K
+            A = _factorized_aff_nnz(K)
+            emb_K = K
+        else:
+            A = (K != 0)
+            emb_K = np.expand_dims(K,axis=-1)
 
         # NGM qap solver
         for i in range(self.gnn_layer):
@@ -1285,7 +1796,7 @@ def compute_affinity_score(X, K):
     b, n, _ = X.shape
     vx = X.swapaxes(1,2).reshape(b, -1, 1)  # (b, n*n, 1)
     vxt = vx.swapaxes(1, 2)  # (b, 1, n*n)
-    affinity = np.squeeze(np.squeeze(np.matmul(np.matmul(vxt, K), vx),axis=-1),axis=-1)
+    affinity = np.squeeze(np.squeeze(np.matmul(vxt, _aff_matvec(K, vx)),axis=-1),axis=-1)
     return affinity
 
 
@@ -1332,10 +1843,134 @@ def generate_isomorphic_graphs(node_num, graph_num, node_feat_dim=0):
         return np.stack(As,axis=0), X_gt
 
 def _aff_mat_from_node_edge_aff(node_aff: np.ndarray, edge_aff: np.ndarray, connectivity1: np.ndarray, connectivity2: np.ndarray,
-                                n1, n2, ne1, ne2):
+                                n1, n2, ne1, ne2, out: np.ndarray=None):
     """
     numpy implementation of _aff_mat_from_node_edge_aff
     """
+    dtype, batch_size, n1, n2, ne1, ne2 = _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2,
+                                                             n1, n2, ne1, ne2)
+    n1max = max(n1)
+    n2max = max(n2)
+    n1n2 = n2max * n1max
+    if out is None:
+        k = np.zeros((batch_size, n1n2, n1n2), dtype=dtype)
+    else:
+        if out.shape != (batch_size, n1n2, n1n2) or not out.flags.c_contiguous:
+            raise ValueError(f'Expected a C-contiguous output buffer of shape {(batch_size, n1n2, n1n2)}, '
+                             f'got {out.shape}.')
+        k = out
+        k.fill(0)
+    # edge-wise affinity
+    if edge_aff is not None:
+        mask = _edge_pair_mask(edge_aff, ne1, ne2)
+        b_idx = np.arange(batch_size).reshape((-1, 1, 1))
+        # row index: start_g2 * n1max + start_g1, col index: end_g2 * n1max + end_g1
+        row = connectivity2[:, None, :, 0] * n1max + connectivity1[:, :, None, 0]
+        col = connectivity2[:, None, :, 1] * n1max + connectivity1[:, :, None, 1]
+        k.reshape(-1)[((b_idx * n1n2 + row) * n1n2 + col)[mask]] = edge_aff[mask]
+    # node-wise affinity
+    if node_aff is not None:
+        k.reshape((batch_size, -1))[:, np.arange(n1n2) * (n1n2 + 1)] = node_aff.swapaxes(1, 2).reshape((batch_size, -1))
+
+    return k
+
+
+def _sparse_aff_mat_from_node_edge_aff(node_aff: np.ndarray, edge_aff: np.ndarray, connectivity1: np.ndarray,
+                                       connectivity2: np.ndarray, n1, n2, ne1, ne2):
+    """
+    numpy implementation of _sparse_aff_mat_from_node_edge_aff. The output is a list of scipy.sparse.csr_matrix
+    """
+    dtype, batch_size, n1, n2, ne1, ne2 = _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2,
+                                                             n1, n2, ne1, ne2)
+    n1max = max(n1)
+    n2max = max(n2)
+    ks = []
+    for b in range(batch_size):
+        rows, cols, vals = [], [], []
+        # edge-wise affinity
+        if edge_aff is not None:
+            conn1 = connectivity1[b][:ne1[b]]
+            conn2 = connectivity2[b][:ne2[b]]
+            # row index: start_g2 * n1max + start_g1, col index: end_g2 * n1max + end_g1
+            row = (conn2[:, 0].reshape(1, -1) * n1max + conn1[:, 0].reshape(-1, 1)).reshape(-1)
+            col = (conn2[:, 1].reshape(1, -1) * n1max + conn1[:, 1].reshape(-1, 1)).reshape(-1)
+            val = edge_aff[b, :ne1[b], :ne2[b]].reshape(-1)
+            if node_aff is not None: # the diagonal is overwritten by node-wise affinity
+                off_diag = row != col
+                row, col, val = row[off_diag], col[off_diag], val[off_diag]
+            rows.append(row)
+            cols.append(col)
+            vals.append(val)
+        # node-wise affinity
+        if node_aff is not None:
+            diag = np.arange(n2max * n1max)
+            rows.append(diag)
+            cols.append(diag)
+            vals.append(node_aff[b].T.reshape(-1))
+        k = scipy.sparse.coo_matrix((np.concatenate(vals).astype(dtype), (np.concatenate(rows), np.concatenate(cols))),
+                                    shape=(n2max * n1max, n2max * n1max))
+        ks.append(k.tocsr())
+
+    return ks
+
+
+def _factorized_aff_mat_from_node_edge_aff(node_aff: np.ndarray, edge_aff: np.ndarray, connectivity1: np.ndarray,
+                                           connectivity2: np.ndarray, n1, n2, ne1, ne2):
+    """
+    numpy implementation of _factorized_aff_mat_from_node_edge_aff
+    """
+    dtype, batch_size, n1, n2, ne1, ne2 = _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2,
+                                                             n1, n2, ne1, ne2)
+    if edge_aff is not None:
+        connectivity1 = connectivity1.astype(np.int64)
+        connectivity2 = connectivity2.astype(np.int64)
+        mask = _edge_pair_mask(edge_aff, ne1, ne2)
+        if node_aff is not None: # the diagonal is overwritten by node-wise affinity
+            loop1 = connectivity1[:, :, 0] == connectivity1[:, :, 1]
+            loop2 = connectivity2[:, :, 0] == connectivity2[:, :, 1]
+            mask = mask & ~(np.expand_dims(loop1, 2) & np.expand_dims(loop2, 1))
+        edge_aff = np.where(mask, edge_aff, 0).astype(dtype)
+    return node_aff, edge_aff, connectivity1, connectivity2, max(n1), max(n2)
+
+
+def _factorized_aff_matvec(node_aff, edge_aff, connectivity1, connectivity2, n1max, n2max, v):
+    """
+    numpy implementation of FactorizedAffinity.matvec
+    """
+    batch_size = v.shape[0]
+    x = v.reshape((batch_size, n2max, n1max, -1)) # x[b, j, i] is the matching score of node i (G1) and node j (G2)
+    if node_aff is not None:
+        out = np.expand_dims(node_aff.swapaxes(1, 2), -1) * x
+    else:
+        out = np.zeros_like(x)
+    if edge_aff is not None:
+        num_channel = x.shape[-1]
+        b_idx = np.arange(batch_size).reshape((-1, 1, 1))
+        # gather from the ending nodes: (b x ne1 x ne2 x c)
+        msg = x[b_idx, connectivity2[:, None, :, 1], connectivity1[:, :, None, 1]] * np.expand_dims(edge_aff, -1)
+        # scatter to the starting nodes
+        idx = ((b_idx * n2max + connectivity2[:, None, :, 0]) * n1max + connectivity1[:, :, None, 0]).reshape(-1)
+        msg = msg.reshape((-1, num_channel))
+        out = out.reshape((-1, num_channel))
+        for c in range(num_channel):
+            out[:, c] += np.bincount(idx, weights=msg[:, c], minlength=out.shape[0]).astype(out.dtype)
+    return out.reshape(v.shape)
+
+
+def _factorized_aff_nnz(K):
+    """
+    Count the number of non-zero elements in each row of a FactorizedAffinity object, output shape (b x n1n2 x 1)
+    """
+    node_nz = (K.node_aff != 0).astype(K.dtype) if K.node_aff is not None else None
+    edge_nz = (K.edge_aff != 0).astype(K.dtype) if K.edge_aff is not None else None
+    ones = np.ones((K.shape[0], K.shape[1], 1), dtype=K.dtype)
+    return _factorized_aff_matvec(node_nz, edge_nz, K.connectivity1, K.connectivity2, K.n1max, K.n2max, ones)
+
+
+def _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2, n1, n2, ne1, ne2):
+    """
+    Infer the dtype, batch size and number of nodes/edges for building the affinity matrix
+    """
     if edge_aff is not None:
         dtype = edge_aff.dtype
         batch_size = edge_aff.shape[0]
@@ -1354,49 +1989,83 @@ def _aff_mat_from_node_edge_aff(node_aff: np.ndarray, edge_aff: np.ndarray, conn
             n1 = [node_aff.shape[1]] * batch_size
         if n2 is None:
             n2 = [node_aff.shape[2]] * batch_size
+    return dtype, batch_size, n1, n2, ne1, ne2
 
-    n1max = max(n1)
-    n2max = max(n2)
-    ks = []
-    for b in range(batch_size):
-        k = np.zeros((n2max, n1max, n2max, n1max), dtype=dtype)
-        # edge-wise affinity
-        if edge_aff is not None:
-            conn1 = connectivity1[b][:ne1[b]]
-            conn2 = connectivity2[b][:ne2[b]]
-            edge_indices = np.concatenate([conn1.repeat(ne2[b], axis=0), np.tile(conn2, (ne1[b], 1))], axis=1) # indices: start_g1, end_g1, start_g2, end_g2
-            edge_indices = (edge_indices[:, 2], edge_indices[:, 0], edge_indices[:, 3], edge_indices[:, 1]) # indices: start_g2, start_g1, end_g2, end_g1
-            k[edge_indices] = edge_aff[b, :ne1[b], :ne2[b]].reshape(-1)
-        k = k.reshape((n2max * n1max, n2max * n1max))
-        # node-wise affinity
-        if node_aff is not None:
-            k[np.arange(n2max * n1max), np.arange(n2max * n1max)] = node_aff[b].T.reshape(-1)
-        ks.append(k)
 
-    return np.stack(ks, axis=0)
+def _edge_pair_mask(edge_aff, ne1, ne2):
+    """
+    The mask of valid (i.e. non-padded) edge pairs in the edge affinity matrix, output shape (b x ne1max x ne2max)
+    """
+    mask1 = np.arange(edge_aff.shape[1]).reshape((1, -1)) < np.array(ne1).reshape((-1, 1))
+    mask2 = np.arange(edge_aff.shape[2]).reshape((1, -1)) < np.array(ne2).reshape((-1, 1))
+    return np.expand_dims(mask1, 2) & np.expand_dims(mask2, 1)
+
+
+def _aff_matvec(K, v, out=None):
+    """
+    numpy implementation of the batched matrix-vector product between affinity matrix K and v. K can be a dense
+    np.ndarray, a list of scipy sparse matrices, or a FactorizedAffinity object. The result is written to out if given
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        ret = K.matvec(v)
+    elif type(K) is list:
+        ret = np.stack([K[b] @ v[b] for b in range(len(K))], axis=0)
+    else:
+        return np.matmul(K, v, out=out)
+    if out is not None:
+        np.copyto(out, ret)
+        ret = out
+    return ret
+
+
+def _take_batch(K, idx):
+    """
+    numpy implementation of selecting the instances of index idx from the batched affinity matrix K. K can be a dense
+    np.ndarray, a list of scipy sparse matrices, or a FactorizedAffinity object
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        return pygmtools.utils.FactorizedAffinity(
+            *(None if _ is None else _[idx] for _ in (K.node_aff, K.edge_aff, K.connectivity1, K.connectivity2)),
+            K.n1max, K.n2max, backend=K.backend)
+    elif type(K) is list:
+        return [K[b] for b in idx]
+    else:
+        return K[idx]
+
+
+def _is_sparse(input):
+    """
+    Check if the input is a scipy sparse matrix, or a list of scipy sparse matrices (i.e. batched sparse matrix)
+    """
+    if type(input) is list:
+        return len(input) > 0 and all([scipy.sparse.issparse(_) for _ in input])
+    return scipy.sparse.issparse(input)
 
 
 def _check_data_type(input: np.ndarray, var_name, raise_err):
     """
     numpy implementation of _check_data_type
     """
-    if raise_err and type(input) is not np.ndarray:
-        raise ValueError(f'Expected Numpy ndarray{f" for variable {var_name}" if var_name is not None else ""}, '
-                         f'but got {type(input)}.')
-    return type(input) is np.ndarray
+    is_valid = type(input) is np.ndarray or _is_sparse(input)
+    if raise_err and not is_valid:
+        raise ValueError(f'Expected Numpy ndarray or Scipy sparse matrix'
+                         f'{f" for variable {var_name}" if var_name is not None else ""}, but got {type(input)}.')
+    return is_valid
 
 
 def _check_shape(input: np.ndarray, dim_num):
     """
     numpy implementation of _check_shape
     """
-    return len(input.shape) == dim_num
+    return len(_get_shape(input)) == dim_num
 
 
 def _get_shape(input: np.ndarray):
     """
     numpy implementation of _get_shape
     """
+    if type(input) is list: # batched sparse matrix
+        return (len(input),) + input[0].shape
     return input.shape
 
 
@@ -1404,6 +2073,8 @@ def _squeeze(input: np.ndarray, dim):
     """
     numpy implementation of _squeeze
     """
+    if type(input) is list and dim == 0: # batched sparse matrix
+        return input[0]
     return np.squeeze(input, axis=dim)
 
 
@@ -1411,6 +2082,8 @@ def _unsqueeze(input: np.ndarray, dim):
     """
     numpy implementation of _unsqueeze
     """
+    if scipy.sparse.issparse(input) and dim == 0:
+        return [input]
     return np.expand_dims(input, axis=dim)
 
 
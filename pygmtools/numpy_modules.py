@@ -351,13 +351,18 @@ class NGMConvLayer():
         """
         W_new = W
 
-        if norm is True:
-            A = normalize_abs(A,axis=2)
-        
         x1 = self.n_func.forward(x)
-        tmp1 = (np.expand_dims(A,axis=-1) * W_new).transpose((0, 3, 1, 2))
-        tmp2 = np.expand_dims(x1,axis=2).transpose((0, 3, 1, 2))
-        x2 = np.squeeze(np.matmul(tmp1,tmp2),axis=-1).swapaxes(1, 2)
+        if type(W_new) is np.ndarray:
+            if norm is True:
+                A = normalize_abs(A,axis=2)
+            tmp1 = (np.expand_dims(A,axis=-1) * W_new).transpose((0, 3, 1, 2))
+            tmp2 = np.expand_dims(x1,axis=2).transpose((0, 3, 1, 2))
+            x2 = np.squeeze(np.matmul(tmp1,tmp2),axis=-1).swapaxes(1, 2)
+        else:
+            # W is an implicit affinity operator (b x n x n), and A is the number of non-zeros in each row (b x n x 1)
+            x2 = W_new.matvec(x1)
+            if norm is True:
+                x2 = np.divide(x2, A, out=np.zeros_like(x2), where=A != 0)
         x2 += self.n_self_func.forward(x)
         
         if self.classifier is not None:
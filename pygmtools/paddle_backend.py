@@ -12,11 +12,10 @@ import itertools
 import functools
 import paddle
 import numpy as np
-from multiprocessing import Pool
 import os
 
 import pygmtools.utils
-from pygmtools.numpy_backend import _hung_kernel
+from pygmtools.numpy_backend import _hung_batch
 
 
 #############################################
@@ -25,7 +24,7 @@ from pygmtools.numpy_backend import _hung_kernel
 
 def hungarian(s: paddle.Tensor, n1: paddle.Tensor=None, n2: paddle.Tensor=None,
               unmatch1: paddle.Tensor=None, unmatch2: paddle.Tensor=None,
-              nproc: int=1) -> paddle.Tensor:
+              nproc: int=None, topk: int=None) -> paddle.Tensor:
     """
     Paddle implementation of Hungarian algorithm
     """
@@ -50,12 +49,7 @@ def hungarian(s: paddle.Tensor, n1: paddle.Tensor=None, n2: paddle.Tensor=None,
     else:
         unmatch2 = [None] * batch_num
 
-    if nproc > 1:
-        with Pool(processes=nproc) as pool:
-            mapresult = pool.starmap_async(_hung_kernel, zip(perm_mat, n1, n2, unmatch1, unmatch2))
-            perm_mat = np.stack(mapresult.get())
-    else:
-        perm_mat = np.stack([_hung_kernel(perm_mat[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+    perm_mat = _hung_batch(perm_mat, n1, n2, unmatch1, unmatch2, nproc, topk)
 
     perm_mat = paddle.to_tensor(perm_mat, place=device)
 
@@ -64,18 +58,27 @@ def hungarian(s: paddle.Tensor, n1: paddle.Tensor=None, n2: paddle.Tensor=None,
 
 def sinkhorn(s: paddle.Tensor, nrows: paddle.Tensor=None, ncols: paddle.Tensor=None,
              unmatchrows: paddle.Tensor=None, unmatchcols: paddle.Tensor=None,
-             dummy_row: bool=False, max_iter: int=10, tau: float=1., batched_operation: bool=False) -> paddle.Tensor:
+             dummy_row: bool=False, max_iter: int=10, tau: float=1., batched_operation: bool=False,
+             tol: float=None, dual=None, return_dual: bool=False, return_iter: bool=False):
     """
     Paddle implementation of Sinkhorn algorithm
     """
     batch_size = s.shape[0]
 
+    # the dual potentials are in the log domain, with shape (b x n1max), (b x n2max)
+    if dual is not None:
+        log_u, log_v = dual
+    else:
+        log_u = paddle.zeros((batch_size, s.shape[1]), dtype=s.dtype)
+        log_v = paddle.zeros((batch_size, s.shape[2]), dtype=s.dtype)
+
     if s.shape[2] >= s.shape[1]:
         transposed = False
     else:
         s = s.transpose((0, 2, 1))
         nrows, ncols = ncols, nrows
         unmatchrows, unmatchcols = unmatchcols, unmatchrows
+        log_u, log_v = log_v, log_u
         transposed = True
 
     if nrows is None:
@@ -90,7 +93,7 @@ def sinkhorn(s: paddle.Tensor, nrows: paddle.Tensor=None, ncols: paddle.Tensor=N
         s_t = s.transpose((0, 2, 1))
         s_t = paddle.concat((
             s_t[:, :s.shape[1], :],
-            paddle.to_tensor(paddle.full((batch_size, s.shape[1], s.shape[2]-s.shape[1]), -float('inf')), place=s.place)), axis=2)
+            paddle.to_tensor(paddle.full((batch_size, s.shape[1], s.shape[2]-s.shape[1]), -float('inf'), dtype=s.dtype), place=s.place)), axis=2)
         s = paddle.where(transposed_batch.reshape((batch_size, 1, 1)), s_t, s)
 
         new_nrows = paddle.where(transposed_batch, ncols, nrows)
@@ -108,6 +111,8 @@ def sinkhorn(s: paddle.Tensor, nrows: paddle.Tensor=None, ncols: paddle.Tensor=N
             unmatchrows = new_unmatchrows
             unmatchcols = new_unmatchcols
 
+        log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+
     # operations are performed on log_s
     log_s = s / tau
     if unmatchrows is not None and unmatchcols is not None:
@@ -124,91 +129,111 @@ def sinkhorn(s: paddle.Tensor, nrows: paddle.Tensor=None, ncols: paddle.Tensor=N
         log_s = paddle.concat((log_s, paddle.to_tensor(paddle.full(dummy_shape, -float('inf'), dtype=log_s.dtype), place=log_s.place)), axis=1)
         if unmatchrows is not None:
             unmatchrows = paddle.concat((unmatchrows, paddle.to_tensor(paddle.full((dummy_shape[0], dummy_shape[1]), -float('inf'), dtype=log_s.dtype), place=log_s.place)), axis=1)
-        for b in range(batch_size):
-            log_s[b, ori_nrows[b]:nrows[b], :ncols[b]] = -100
+        log_u = paddle.concat((log_u, paddle.zeros((dummy_shape[0], dummy_shape[1]), dtype=log_u.dtype)), axis=1)
+    else:
+        ori_nrows = nrows
+
+    # all masks are built by broadcasting the node numbers, thus no loop over the batch is needed
+    nrows = nrows.reshape((batch_size, 1, 1))
+    ncols = ncols.reshape((batch_size, 1, 1))
+    ori_nrows = ori_nrows.reshape((batch_size, 1, 1))
 
     # assign the unmatch weights
     if unmatchrows is not None and unmatchcols is not None:
-        new_log_s = paddle.to_tensor(paddle.full((log_s.shape[0], log_s.shape[1]+1, log_s.shape[2]+1), -float('inf'), dtype=log_s.dtype), place=log_s.place)
-        new_log_s[:, :-1, :-1] = log_s
-        log_s = new_log_s
-        for b in range(batch_size):
-            log_s[b, :nrows[b], ncols[b]] = unmatchrows[b, :nrows[b]]
-            log_s[b, nrows[b], :ncols[b]] = unmatchcols[b, :ncols[b]]
-    row_mask = paddle.zeros((batch_size, log_s.shape[1], 1), dtype=paddle.bool)
-    col_mask = paddle.zeros((batch_size, 1, log_s.shape[2]), dtype=paddle.bool)
-    for b in range(batch_size):
-        row_mask[b, :nrows[b], 0] = 1
-        col_mask[b, 0, :ncols[b]] = 1
+        log_s = paddle.concat((log_s, paddle.full((batch_size, log_s.shape[1], 1), -float('inf'), dtype=log_s.dtype)), axis=2)
+        log_s = paddle.concat((log_s, paddle.full((batch_size, 1, log_s.shape[2]), -float('inf'), dtype=log_s.dtype)), axis=1)
+        unmatchrows = paddle.concat((unmatchrows, paddle.full((batch_size, 1), -float('inf'), dtype=log_s.dtype)), axis=1)
+        unmatchcols = paddle.concat((unmatchcols, paddle.full((batch_size, 1), -float('inf'), dtype=log_s.dtype)), axis=1)
+        log_u = paddle.concat((log_u, paddle.zeros((batch_size, 1), dtype=log_u.dtype)), axis=1)
+        log_v = paddle.concat((log_v, paddle.zeros((batch_size, 1), dtype=log_v.dtype)), axis=1)
+    row_idx = paddle.arange(log_s.shape[1], dtype=nrows.dtype).reshape((1, -1, 1))
+    col_idx = paddle.arange(log_s.shape[2], dtype=ncols.dtype).reshape((1, 1, -1))
+    row_mask = (row_idx < nrows).expand((batch_size, log_s.shape[1], 1))
+    col_mask = (col_idx < ncols).expand((batch_size, 1, log_s.shape[2]))
+    neg_inf = paddle.full_like(log_s, -float('inf'))
+    if dummy_row:
+        log_s = paddle.where(paddle.logical_and(paddle.logical_and(row_idx >= ori_nrows, row_mask), col_mask),
+                             paddle.full_like(log_s, -100), log_s)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols += 1
-        nrows += 1
-
-    if batched_operation:
-        for b in range(batch_size):
-            log_s[b, nrows[b]:, :] = -float('inf')
-            log_s[b, :, ncols[b]:] = -float('inf')
-
-        for i in range(max_iter):
-            if i % 2 == 0:
-                log_sum = paddle.logsumexp(log_s, 2, keepdim=True)
-                log_s = log_s - paddle.where(row_mask, log_sum, paddle.zeros_like(log_sum))
-                nan_indices = paddle.nonzero(paddle.isnan(log_s), True)
-                if not nan_indices[0].size == 0:
-                    raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-            else:
-                log_sum = paddle.logsumexp(log_s, 1, keepdim=True)
-                log_s = log_s - paddle.where(col_mask, log_sum, paddle.zeros_like(log_sum))
-                nan_indices = paddle.nonzero(paddle.isnan(log_s), True)
-                if not nan_indices[0].size == 0:
-                    raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-
-        ret_log_s = log_s
+        log_s = paddle.where(paddle.logical_and(row_mask, col_idx == ncols), unmatchrows.unsqueeze(2).expand(log_s.shape), log_s)
+        log_s = paddle.where(paddle.logical_and(row_idx == nrows, col_mask), unmatchcols.unsqueeze(1).expand(log_s.shape), log_s)
+        valid_mask = paddle.logical_and(row_idx <= nrows, col_idx <= ncols)
     else:
-        ret_log_s = paddle.to_tensor(paddle.full((batch_size, log_s.shape[1], log_s.shape[2]), -float('inf')), place=log_s.place, dtype=log_s.dtype)
-
-        for b in range(batch_size):
-            row_slice = slice(0, nrows[b])
-            col_slice = slice(0, ncols[b])
-            log_s_b = log_s[b, row_slice, col_slice]
-            row_mask_b = row_mask[b, row_slice, :]
-            col_mask_b = col_mask[b, :, col_slice]
-
-            for i in range(max_iter):
-                if i % 2 == 0:
-                    log_sum = paddle.logsumexp(log_s_b, 1, keepdim=True)
-                    log_s_b = log_s_b - paddle.where(row_mask_b, log_sum, paddle.zeros_like(log_sum))
-                else:
-                    log_sum = paddle.logsumexp(log_s_b, 0, keepdim=True)
-                    log_s_b = log_s_b - paddle.where(col_mask_b, log_sum, paddle.zeros_like(log_sum))
-
-            ret_log_s[b, row_slice, col_slice] = log_s_b
-
+        valid_mask = paddle.logical_and(row_mask, col_mask)
+    log_u = log_u.reshape((batch_size, -1, 1))
+    log_v = log_v.reshape((batch_size, 1, -1))
+    log_s = paddle.where(valid_mask, log_s + log_u + log_v, neg_inf)
+
+    # the iterations are performed on the whole batch. The rows (columns) excluded by the masks are replaced by zeros
+    # before logsumexp, otherwise the gradient of logsumexp over all -inf elements is NaN
+    zeros = paddle.zeros_like(log_s)
+    active = paddle.ones((batch_size, 1, 1), dtype=paddle.bool)
+    n_iter = max_iter
+    for i in range(max_iter):
+        if i % 2 == 0:
+            log_sum = paddle.logsumexp(paddle.where(row_mask, log_s, zeros), 2, keepdim=True)
+            if tol is not None and i > 0:
+                # the columns are normalized by the last iteration, and the rows are checked for convergence
+                err = paddle.where(row_mask, paddle.abs(paddle.exp(log_sum) - 1), paddle.zeros_like(log_sum))
+                active = paddle.logical_and(active, paddle.amax(err, axis=1, keepdim=True) >= tol)
+                if not paddle.any(active):
+                    n_iter = i
+                    break
+            log_sum = paddle.where(paddle.logical_and(row_mask, active), log_sum, paddle.zeros_like(log_sum))
+            log_u = log_u - log_sum
+        else:
+            log_sum = paddle.logsumexp(paddle.where(col_mask, log_s, zeros), 1, keepdim=True)
+            log_sum = paddle.where(paddle.logical_and(col_mask, active), log_sum, paddle.zeros_like(log_sum))
+            log_v = log_v - log_sum
+        # NaN may only be introduced by the normalization factors, which are much smaller than log_s to check
+        if batched_operation and not paddle.all(paddle.isfinite(log_sum)):
+            raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
+        log_s = log_s - log_sum
+
+    # remove the unmatch weights and the dummy rows
+    ret_log_s = paddle.where(paddle.logical_and(row_idx < ori_nrows, col_mask), log_s, neg_inf)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols -= 1
-        nrows -= 1
-        for b in range(batch_size):
-            ret_log_s[b, :nrows[b] + 1, ncols[b]] = -float('inf')
-            ret_log_s[b, nrows[b], :ncols[b]] = -float('inf')
         ret_log_s = ret_log_s[:, :-1, :-1]
-
-    if dummy_row:
-        if dummy_shape[1] > 0:
-            ret_log_s = ret_log_s[:, :-dummy_shape[1]]
-        for b in range(batch_size):
-            ret_log_s[b, ori_nrows[b]:nrows[b], :ncols[b]] = -float('inf')
+    if dummy_row and dummy_shape[1] > 0:
+        ret_log_s = ret_log_s[:, :-dummy_shape[1]]
 
     if paddle.any(transposed_batch):
         s_t = ret_log_s.transpose((0, 2, 1))
         s_t = paddle.concat((
             s_t[:, :ret_log_s.shape[1], :],
-            paddle.to_tensor(paddle.full((batch_size, ret_log_s.shape[1], ret_log_s.shape[2]-ret_log_s.shape[1]), -float('inf')), place=log_s.place)), axis=2)
+            paddle.to_tensor(paddle.full((batch_size, ret_log_s.shape[1], ret_log_s.shape[2]-ret_log_s.shape[1]), -float('inf'), dtype=ret_log_s.dtype), place=log_s.place)), axis=2)
         ret_log_s = paddle.where(transposed_batch.reshape((batch_size, 1, 1)), s_t, ret_log_s)
 
     if transposed:
         ret_log_s = ret_log_s.transpose((0, 2, 1))
 
-    return paddle.exp(ret_log_s)
+    ret = [paddle.exp(ret_log_s)]
+    if return_dual:
+        log_u, log_v = log_u[:, :, 0], log_v[:, 0, :]
+        if unmatchrows is not None and unmatchcols is not None:
+            log_u, log_v = log_u[:, :-1], log_v[:, :-1]
+        if dummy_row and dummy_shape[1] > 0:
+            log_u = log_u[:, :-dummy_shape[1]]
+        if paddle.any(transposed_batch):
+            log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+        if transposed:
+            log_u, log_v = log_v, log_u
+        ret.append((log_u, log_v))
+    if return_iter:
+        ret.append(n_iter)
+    return tuple(ret) if len(ret) > 1 else ret[0]
+
+
+def _swap_dual_batch(log_u: paddle.Tensor, log_v: paddle.Tensor, transposed_batch: paddle.Tensor):
+    """
+    Swap the row and column dual potentials of the transposed instances in Sinkhorn. It is assumed that
+    log_u.shape[1] <= log_v.shape[1], and log_u is padded by zeros.
+    """
+    transposed_batch = transposed_batch.reshape((-1, 1))
+    log_u_pad = paddle.concat(
+        (log_u, paddle.zeros((log_u.shape[0], log_v.shape[1] - log_u.shape[1]), dtype=log_u.dtype)), axis=1)
+    return paddle.where(transposed_batch, log_v[:, :log_u.shape[1]], log_u), \
+        paddle.where(transposed_batch, log_u_pad, log_v)
 
 
 #############################################
@@ -217,15 +242,18 @@ def sinkhorn(s: paddle.Tensor, nrows: paddle.Tensor=None, ncols: paddle.Tensor=N
 
 
 def rrwm(K: paddle.Tensor, n1: paddle.Tensor, n2: paddle.Tensor, n1max, n2max, x0: paddle.Tensor,
-         max_iter: int, sk_iter: int, alpha: float, beta: float) -> paddle.Tensor:
+         max_iter: int, sk_iter: int, alpha: float, beta: float, return_iter: bool=False):
     """
     Paddle implementation of RRWM algorithm.
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
     # rescale the values in K
     d = paddle.sum(K, axis=2, keepdim=True)
-    dmax = paddle.max(d, axis=1, keepdim=True)
-    K = K / (dmax + paddle.min(d) * 1e-5)
+    K = K / (paddle.max(d, axis=1, keepdim=True) + paddle.min(d, axis=1, keepdim=True) * 1e-5)
+    # the converged instances are removed from the batch, and their results are written to x
+    x = paddle.zeros_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=np.int64)
+    active = np.arange(batch_num)
     v = v0
     for i in range(max_iter):
         # random walk
@@ -235,72 +263,134 @@ def rrwm(K: paddle.Tensor, n1: paddle.Tensor, n2: paddle.Tensor, n1max, n2max, x
         v = v / n
 
         # reweighted jump
-        s = paddle.reshape(v, (batch_num, n2max, n1max)).transpose((0, 2, 1))
+        s = paddle.reshape(v, (-1, n2max, n1max)).transpose((0, 2, 1))
         s = beta * s / s.max(axis=1, keepdim=True).max(axis=2, keepdim=True)
-        v = alpha * paddle.reshape(sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose((0, 2, 1)),(batch_num, n1n2, 1)) + \
+        v = alpha * paddle.reshape(sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose((0, 2, 1)),(-1, n1n2, 1)) + \
             (1 - alpha) * v
         n = paddle.norm(v, p=1, axis=1, keepdim=True)
         v = paddle.matmul(v, 1 / n)
 
-        if paddle.norm(v - last_v) < 1e-5:
-            break
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (paddle.norm(v - last_v, axis=[1, 2]) < 1e-5).numpy()
+        if np.any(converged):
+            x, active, n_iter, keep = _update_converged(x, v, active, n_iter, converged, i)
+            if keep is None:
+                break
+            v, n1, n2, K = (paddle.gather(_, keep) for _ in (v, n1, n2, K))
+    else:
+        x = paddle.scatter(x, paddle.to_tensor(active, place=x.place), v)
 
-    return v.reshape((batch_num, n2max, n1max)).transpose((0, 2, 1))
+    x = paddle.reshape(x, (batch_num, n2max, n1max)).transpose((0, 2, 1))
+    if return_iter:
+        return x, paddle.to_tensor(n_iter, place=x.place)
+    else:
+        return x
 
 
 def sm(K: paddle.Tensor, n1: paddle.Tensor, n2: paddle.Tensor, n1max, n2max, x0: paddle.Tensor,
-       max_iter: int) -> paddle.Tensor:
+       max_iter: int, return_iter: bool=False):
     """
     Paddle implementation of SM algorithm.
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    x = paddle.zeros_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=np.int64)
+    active = np.arange(batch_num)
     v = vlast = v0
-    for _ in range(max_iter):
+    for i in range(max_iter):
         v = paddle.bmm(K, v)
         n = paddle.norm(v, p=2, axis=1)
-        v = paddle.matmul(v, paddle.reshape(1 / n, (batch_num, 1, 1)))
-        if paddle.norm(v - vlast) < 1e-5:
-            break
+        v = paddle.matmul(v, paddle.reshape(1 / n, (-1, 1, 1)))
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (paddle.norm(v - vlast, axis=[1, 2]) < 1e-5).numpy()
+        if np.any(converged):
+            x, active, n_iter, keep = _update_converged(x, v, active, n_iter, converged, i)
+            if keep is None:
+                break
+            v, K = (paddle.gather(_, keep) for _ in (v, K))
         vlast = v
+    else:
+        x = paddle.scatter(x, paddle.to_tensor(active, place=x.place), v)
 
-    x = paddle.reshape(v, (batch_num, n2max, n1max)).transpose((0, 2, 1))
-    return x
+    x = paddle.reshape(x, (batch_num, n2max, n1max)).transpose((0, 2, 1))
+    if return_iter:
+        return x, paddle.to_tensor(n_iter, place=x.place)
+    else:
+        return x
 
 
 def ipfp(K: paddle.Tensor, n1: paddle.Tensor, n2: paddle.Tensor, n1max, n2max, x0: paddle.Tensor,
-         max_iter) -> paddle.Tensor:
+         max_iter, return_iter: bool=False):
     """
     Paddle implementation of IPFP algorithm
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    x = paddle.zeros_like(v0)
+    n_iter = np.full(batch_num, max_iter, dtype=np.int64)
+    active = np.arange(batch_num)
     v = v0
-    last_v = v
     best_v = v
     best_obj = paddle.to_tensor(paddle.full((batch_num, 1, 1), -1.), place=K.place)
-
-    def comp_obj_score(v1, K, v2):
-        return paddle.bmm(paddle.bmm(paddle.reshape(v1, (batch_num, 1, -1)), K), v2)
+    # K v and the objective score v^T K v are cached, thus only K binary_v is computed in each iteration
+    Kv = paddle.bmm(K, v)
+    v_obj = _bdot(v, Kv)
 
     for i in range(max_iter):
-        cost = paddle.reshape(paddle.bmm(K, v),(batch_num, n2max, n1max)).transpose((0, 2, 1))
+        cost = paddle.reshape(Kv, (-1, n2max, n1max)).transpose((0, 2, 1))
         binary_sol = hungarian(cost, n1, n2)
-        binary_v = paddle.reshape(binary_sol.transpose((0, 2, 1)),(batch_num, -1, 1))
-        alpha = comp_obj_score(v, K, binary_v - v)
-        beta = comp_obj_score(binary_v - v, K, binary_v - v)
+        binary_v = paddle.reshape(binary_sol.transpose((0, 2, 1)),(-1, n1n2, 1))
+        Kb = paddle.bmm(K, binary_v)
+        current_obj = _bdot(binary_v, Kb)
+        v_Kb = _bdot(v, Kb)
+        alpha = v_Kb - v_obj # v^T K (binary_v - v)
+        beta = current_obj - _bdot(binary_v, Kv) - v_Kb + v_obj # (binary_v - v)^T K (binary_v - v)
         t0 = - alpha / beta
-        v = paddle.where(paddle.logical_or(beta >= 0, t0 >= 1), binary_v, v + t0 * (binary_v - v))
-        last_v_obj = comp_obj_score(last_v, K, last_v)
+        last_v_obj = v_obj
+        cond = paddle.logical_or(beta >= 0, t0 >= 1)
+        v = paddle.where(cond, binary_v, v + t0 * (binary_v - v))
+        Kv = paddle.where(cond, Kb, Kv + t0 * (Kb - Kv))
+        v_obj = _bdot(v, Kv)
 
-        current_obj = comp_obj_score(binary_v, K, binary_v)
         best_v = paddle.where(current_obj > best_obj, binary_v, best_v)
         best_obj = paddle.where(current_obj > best_obj, current_obj, best_obj)
 
-        if paddle.max(paddle.abs(last_v_obj - current_obj) / last_v_obj) < 1e-3:
-            break
-        last_v = v
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (paddle.abs(last_v_obj - current_obj) / last_v_obj < 1e-3).numpy().reshape(-1)
+        if np.any(converged):
+            x, active, n_iter, keep = _update_converged(x, best_v, active, n_iter, converged, i)
+            if keep is None:
+                break
+            v, Kv, v_obj, best_v, best_obj, n1, n2, K = \
+                (paddle.gather(_, keep) for _ in (v, Kv, v_obj, best_v, best_obj, n1, n2, K))
+    else:
+        x = paddle.scatter(x, paddle.to_tensor(active, place=x.place), best_v)
+
+    pred_x = paddle.reshape(x, (batch_num, n2max, n1max)).transpose((0, 2, 1))
+    if return_iter:
+        return pred_x, paddle.to_tensor(n_iter, place=x.place)
+    else:
+        return pred_x
+
 
-    pred_x = paddle.reshape(best_v, (batch_num, n2max, n1max)).transpose((0, 2, 1))
-    return pred_x
+def _bdot(v1: paddle.Tensor, v2: paddle.Tensor) -> paddle.Tensor:
+    """
+    Batched inner product of (b x n x 1) vectors, with output shape (b x 1 x 1)
+    """
+    return paddle.bmm(v1.transpose((0, 2, 1)), v2)
+
+
+def _update_converged(x, v, active, n_iter, converged, i):
+    """
+    Write the results of the converged instances to x, and get the index of the remaining instances in the batch
+    (None if all instances are converged). active and n_iter are numpy arrays maintained on the host.
+    """
+    idx = np.nonzero(converged)[0]
+    x = paddle.scatter(x, paddle.to_tensor(active[idx], place=x.place), paddle.gather(v, paddle.to_tensor(idx, place=x.place)))
+    n_iter[active[idx]] = i + 1
+    if np.all(converged):
+        return x, active, n_iter, None
+    keep = np.nonzero(~converged)[0]
+    return x, active[keep], n_iter, paddle.to_tensor(keep, place=x.place)
 
 
 def _check_and_init_gm(K, n1, n2, n1max, n2max, x0):
@@ -35,30 +35,31 @@ astar_pretrain_path = {
 #                  A*  Wrapper functions                      #
 ###############################################################
 
-def classic_astar_kernel(K_padded, n1, n2, beam_width):
+def classic_astar_kernel(K_padded, n1, n2, beam_width, epsilon=0., time_budget=0., max_expansions=0):
     """
-    The true implementation of astar function
+    The true implementation of astar function, returns the matching and the lower bound of its cost
     """
-    cache_dict = {}
-    hun_func = functools.partial(heuristic_prediction_hun, cache_dict=cache_dict)
-
-    x_pred, _ = c_astar(
+    x_pred, _, lower_bound = c_astar(
         None,
         -K_padded, # maximize problem -> minimize problem
         n1, n2,
         None,
-        hun_func,
+        None, # the Hungarian heuristic is computed natively by c_astar
         net_pred=False,
         beam_width=beam_width,
         trust_fact=1.,
         no_pred_size=0,
+        epsilon=epsilon,
+        time_budget=time_budget,
+        max_expansions=max_expansions,
     )
 
-    return x_pred
+    return x_pred, lower_bound
 
 
 def genn_astar_kernel(feat1, feat2, A1, A2, n1, n2, channel, filters_1, filters_2, filters_3,
-                 tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain, use_net):
+                 tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain, use_net,
+                 epsilon=0., time_budget=0., max_expansions=0):
     """
     The true implementation of genn_astar function
     """
@@ -95,6 +96,9 @@ def genn_astar_kernel(feat1, feat2, A1, A2, n1, n2, channel, filters_1, filters_
         args['astar_beam_width'] = beam_width
         args['astar_trust_fact'] = trust_fact
         args['astar_no_pred'] = no_pred_size
+        args['astar_epsilon'] = epsilon
+        args['astar_time_budget'] = time_budget
+        args['astar_max_expansions'] = max_expansions
         args['pretrain'] = pretrain
         args['use_net'] = use_net
 
@@ -200,6 +204,9 @@ def default_parameter():
     params['astar_beam_width'] = 0
     params['astar_trust_fact'] = 1
     params['astar_no_pred'] = 0
+    params['astar_epsilon'] = 0
+    params['astar_time_budget'] = 0
+    params['astar_max_expansions'] = 0
     params['use_net'] = True
     return params
 
@@ -572,7 +579,6 @@ class GENN(torch.nn.Module):
     def reset_cache(self):
         self.gnn_1_cache = dict()
         self.gnn_2_cache = dict()
-        self.heuristic_cache = dict()
 
     def setup_layers(self):
         """
@@ -701,16 +707,17 @@ class GENN(torch.nn.Module):
 
             self.reset_cache()
 
-            heuristic_func = functools.partial(heuristic_prediction_hun, cache_dict=self.heuristic_cache)
-
-            x_pred_b, _ = c_astar(
+            x_pred_b, _, _ = c_astar(
                 data, k_b, ns_1[b].item(), ns_2[b].item(),
                 self.net_prediction_cache,
-                heuristic_func,
+                None, # if use_net=False, the Hungarian heuristic is computed natively by c_astar
                 net_pred=self.args['use_net'],
                 beam_width=self.args['astar_beam_width'],
                 trust_fact=self.args['astar_trust_fact'],
                 no_pred_size=self.args['astar_no_pred'],
+                epsilon=self.args['astar_epsilon'],
+                time_budget=self.args['astar_time_budget'],
+                max_expansions=self.args['astar_max_expansions'],
             )
             x_pred[b, :ns_1[b] + 1, :ns_2[b] + 1] = x_pred_b
 
@@ -12,7 +12,6 @@ import itertools
 import functools
 import torch
 import numpy as np
-from multiprocessing import Pool
 from torch import Tensor
 import os
 import pygmtools.utils
@@ -22,12 +21,12 @@ import pygmtools.utils
 #     Linear Assignment Problem Solvers     #
 #############################################
 
-from pygmtools.numpy_backend import _hung_kernel
+from pygmtools.numpy_backend import _hung_batch, _get_thread_pool
 
 
 def hungarian(s: Tensor, n1: Tensor = None, n2: Tensor = None,
               unmatch1: Tensor = None, unmatch2: Tensor = None,
-              nproc: int = 1) -> Tensor:
+              nproc: int = None, topk: int = None) -> Tensor:
     """
     Pytorch implementation of Hungarian algorithm
     """
@@ -52,13 +51,7 @@ def hungarian(s: Tensor, n1: Tensor = None, n2: Tensor = None,
     else:
         unmatch2 = [None] * batch_num
 
-    if nproc > 1:
-        with Pool(processes=nproc) as pool:
-            mapresult = pool.starmap_async(_hung_kernel, zip(perm_mat, n1, n2, unmatch1, unmatch2))
-            perm_mat = np.stack(mapresult.get())
-    else:
-        perm_mat = np.stack(
-            [_hung_kernel(perm_mat[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+    perm_mat = _hung_batch(perm_mat, n1, n2, unmatch1, unmatch2, nproc, topk)
 
     perm_mat = torch.from_numpy(perm_mat).to(device)
 
@@ -67,18 +60,27 @@ def hungarian(s: Tensor, n1: Tensor = None, n2: Tensor = None,
 
 def sinkhorn(s: Tensor, nrows: Tensor = None, ncols: Tensor = None,
              unmatchrows: Tensor = None, unmatchcols: Tensor = None,
-             dummy_row: bool = False, max_iter: int = 10, tau: float = 1., batched_operation: bool = False) -> Tensor:
+             dummy_row: bool = False, max_iter: int = 10, tau: float = 1., batched_operation: bool = False,
+             tol: float = None, dual=None, return_dual: bool = False, return_iter: bool = False):
     """
     Pytorch implementation of Sinkhorn algorithm
     """
     batch_size = s.shape[0]
 
+    # the dual potentials are in the log domain, with shape (b x n1max), (b x n2max)
+    if dual is not None:
+        log_u, log_v = dual
+    else:
+        log_u = torch.zeros(batch_size, s.shape[1], device=s.device, dtype=s.dtype)
+        log_v = torch.zeros(batch_size, s.shape[2], device=s.device, dtype=s.dtype)
+
     if s.shape[2] >= s.shape[1]:
         transposed = False
     else:
         s = s.transpose(1, 2)
         nrows, ncols = ncols, nrows
         unmatchrows, unmatchcols = unmatchcols, unmatchrows
+        log_u, log_v = log_v, log_u
         transposed = True
 
     if nrows is None:
@@ -111,6 +113,8 @@ def sinkhorn(s: Tensor, nrows: Tensor = None, ncols: Tensor = None,
             unmatchrows = new_unmatchrows
             unmatchcols = new_unmatchcols
 
+        log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+
     # operations are performed on log_s
     log_s = s / tau
     if unmatchrows is not None and unmatchcols is not None:
@@ -130,79 +134,72 @@ def sinkhorn(s: Tensor, nrows: Tensor = None, ncols: Tensor = None,
             unmatchrows = torch.cat((unmatchrows,
                                      torch.full((dummy_shape[0], dummy_shape[1]), -float('inf'), device=log_s.device,
                                                 dtype=log_s.dtype)), dim=1)
-        for b in range(batch_size):
-            log_s[b, ori_nrows[b]:nrows[b], :ncols[b]] = -100
+        log_u = torch.nn.functional.pad(log_u, (0, dummy_shape[1]))
+    else:
+        ori_nrows = nrows
+
+    # all masks are built by broadcasting the node numbers, thus no loop over the batch is needed
+    nrows = nrows.view(batch_size, 1, 1)
+    ncols = ncols.view(batch_size, 1, 1)
+    ori_nrows = ori_nrows.view(batch_size, 1, 1)
 
     # assign the unmatch weights
     if unmatchrows is not None and unmatchcols is not None:
-        new_log_s = torch.full((log_s.shape[0], log_s.shape[1] + 1, log_s.shape[2] + 1), -float('inf'),
-                               device=log_s.device, dtype=log_s.dtype)
-        new_log_s[:, :-1, :-1] = log_s
-        log_s = new_log_s
-        for b in range(batch_size):
-            log_s[b, :nrows[b], ncols[b]] = unmatchrows[b, :nrows[b]]
-            log_s[b, nrows[b], :ncols[b]] = unmatchcols[b, :ncols[b]]
-    row_mask = torch.zeros(batch_size, log_s.shape[1], 1, dtype=torch.bool, device=log_s.device)
-    col_mask = torch.zeros(batch_size, 1, log_s.shape[2], dtype=torch.bool, device=log_s.device)
-    for b in range(batch_size):
-        row_mask[b, :nrows[b], 0] = 1
-        col_mask[b, 0, :ncols[b]] = 1
+        log_s = torch.nn.functional.pad(log_s, (0, 1, 0, 1), value=-float('inf'))
+        unmatchrows = torch.nn.functional.pad(unmatchrows, (0, 1), value=-float('inf'))
+        unmatchcols = torch.nn.functional.pad(unmatchcols, (0, 1), value=-float('inf'))
+        log_u = torch.nn.functional.pad(log_u, (0, 1))
+        log_v = torch.nn.functional.pad(log_v, (0, 1))
+    row_idx = torch.arange(log_s.shape[1], device=log_s.device).view(1, -1, 1)
+    col_idx = torch.arange(log_s.shape[2], device=log_s.device).view(1, 1, -1)
+    row_mask = row_idx < nrows
+    col_mask = col_idx < ncols
+    neg_inf = torch.full_like(log_s, -float('inf'))
+    if dummy_row:
+        log_s = torch.where(torch.logical_and(torch.logical_and(row_idx >= ori_nrows, row_mask), col_mask),
+                            torch.full_like(log_s, -100), log_s)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols += 1
-        nrows += 1
-
-    if batched_operation:
-        for b in range(batch_size):
-            log_s[b, nrows[b]:, :] = -float('inf')
-            log_s[b, :, ncols[b]:] = -float('inf')
-
-        for i in range(max_iter):
-            if i % 2 == 0:
-                log_sum = torch.logsumexp(log_s, 2, keepdim=True)
-                log_s = log_s - torch.where(row_mask, log_sum, torch.zeros_like(log_sum))
-                if torch.any(torch.isnan(log_s)):
-                    raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-            else:
-                log_sum = torch.logsumexp(log_s, 1, keepdim=True)
-                log_s = log_s - torch.where(col_mask, log_sum, torch.zeros_like(log_sum))
-                if torch.any(torch.isnan(log_s)):
-                    raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
-
-        ret_log_s = log_s
+        log_s = torch.where(torch.logical_and(row_mask, col_idx == ncols), unmatchrows.unsqueeze(2), log_s)
+        log_s = torch.where(torch.logical_and(row_idx == nrows, col_mask), unmatchcols.unsqueeze(1), log_s)
+        valid_mask = torch.logical_and(row_idx <= nrows, col_idx <= ncols)
     else:
-        ret_log_s = torch.full((batch_size, log_s.shape[1], log_s.shape[2]), -float('inf'), device=log_s.device,
-                               dtype=log_s.dtype)
-
-        for b in range(batch_size):
-            row_slice = slice(0, nrows[b])
-            col_slice = slice(0, ncols[b])
-            log_s_b = log_s[b, row_slice, col_slice]
-            row_mask_b = row_mask[b, row_slice, :]
-            col_mask_b = col_mask[b, :, col_slice]
-
-            for i in range(max_iter):
-                if i % 2 == 0:
-                    log_sum = torch.logsumexp(log_s_b, 1, keepdim=True)
-                    log_s_b = log_s_b - torch.where(row_mask_b, log_sum, torch.zeros_like(log_sum))
-                else:
-                    log_sum = torch.logsumexp(log_s_b, 0, keepdim=True)
-                    log_s_b = log_s_b - torch.where(col_mask_b, log_sum, torch.zeros_like(log_sum))
-
-            ret_log_s[b, row_slice, col_slice] = log_s_b
-
+        valid_mask = torch.logical_and(row_mask, col_mask)
+    log_u = log_u.view(batch_size, -1, 1)
+    log_v = log_v.view(batch_size, 1, -1)
+    log_s = torch.where(valid_mask, log_s + log_u + log_v, neg_inf)
+
+    # the iterations are performed on the whole batch. The rows (columns) excluded by the masks are replaced by zeros
+    # before logsumexp, otherwise the gradient of logsumexp over all -inf elements is NaN
+    zeros = torch.zeros_like(log_s)
+    active = torch.ones(batch_size, 1, 1, dtype=torch.bool, device=log_s.device)
+    n_iter = max_iter
+    for i in range(max_iter):
+        if i % 2 == 0:
+            log_sum = torch.logsumexp(torch.where(row_mask, log_s, zeros), 2, keepdim=True)
+            if tol is not None and i > 0:
+                # the columns are normalized by the last iteration, and the rows are checked for convergence
+                err = torch.where(row_mask, torch.abs(torch.exp(log_sum) - 1), torch.zeros_like(log_sum))
+                active = torch.logical_and(active, torch.amax(err, dim=1, keepdim=True) >= tol)
+                if not torch.any(active):
+                    n_iter = i
+                    break
+            log_sum = torch.where(torch.logical_and(row_mask, active), log_sum, torch.zeros_like(log_sum))
+            log_u = log_u - log_sum
+        else:
+            log_sum = torch.logsumexp(torch.where(col_mask, log_s, zeros), 1, keepdim=True)
+            log_sum = torch.where(torch.logical_and(col_mask, active), log_sum, torch.zeros_like(log_sum))
+            log_v = log_v - log_sum
+        # NaN may only be introduced by the normalization factors, which are much smaller than log_s to check
+        if batched_operation and not torch.all(torch.isfinite(log_sum)):
+            raise RuntimeError(f'NaN encountered in Sinkhorn iter_num={i}/{max_iter}')
+        log_s = log_s - log_sum
+
+    # remove the unmatch weights and the dummy rows
+    ret_log_s = torch.where(torch.logical_and(row_idx < ori_nrows, col_mask), log_s, neg_inf)
     if unmatchrows is not None and unmatchcols is not None:
-        ncols -= 1
-        nrows -= 1
-        for b in range(batch_size):
-            ret_log_s[b, :nrows[b] + 1, ncols[b]] = -float('inf')
-            ret_log_s[b, nrows[b], :ncols[b]] = -float('inf')
         ret_log_s = ret_log_s[:, :-1, :-1]
-
-    if dummy_row:
-        if dummy_shape[1] > 0:
-            ret_log_s = ret_log_s[:, :-dummy_shape[1]]
-        for b in range(batch_size):
-            ret_log_s[b, ori_nrows[b]:nrows[b], :ncols[b]] = -float('inf')
+    if dummy_row and dummy_shape[1] > 0:
+        ret_log_s = ret_log_s[:, :-dummy_shape[1]]
 
     if torch.any(transposed_batch):
         s_t = ret_log_s.transpose(1, 2)
@@ -215,7 +212,32 @@ def sinkhorn(s: Tensor, nrows: Tensor = None, ncols: Tensor = None,
     if transposed:
         ret_log_s = ret_log_s.transpose(1, 2)
 
-    return torch.exp(ret_log_s)
+    ret = [torch.exp(ret_log_s)]
+    if return_dual:
+        log_u, log_v = log_u[:, :, 0], log_v[:, 0, :]
+        if unmatchrows is not None and unmatchcols is not None:
+            log_u, log_v = log_u[:, :-1], log_v[:, :-1]
+        if dummy_row and dummy_shape[1] > 0:
+            log_u = log_u[:, :-dummy_shape[1]]
+        if torch.any(transposed_batch):
+            log_u, log_v = _swap_dual_batch(log_u, log_v, transposed_batch)
+        if transposed:
+            log_u, log_v = log_v, log_u
+        ret.append((log_u, log_v))
+    if return_iter:
+        ret.append(n_iter)
+    return tuple(ret) if len(ret) > 1 else ret[0]
+
+
+def _swap_dual_batch(log_u: Tensor, log_v: Tensor, transposed_batch: Tensor):
+    """
+    Swap the row and column dual potentials of the transposed instances in Sinkhorn. It is assumed that
+    log_u.shape[1] <= log_v.shape[1], and log_u is padded by zeros.
+    """
+    transposed_batch = transposed_batch.view(-1, 1)
+    log_u_pad = torch.nn.functional.pad(log_u, (0, log_v.shape[1] - log_u.shape[1]))
+    return torch.where(transposed_batch, log_v[:, :log_u.shape[1]], log_u), \
+        torch.where(transposed_batch, log_u_pad, log_v)
 
 
 #############################################
@@ -224,99 +246,319 @@ def sinkhorn(s: Tensor, nrows: Tensor = None, ncols: Tensor = None,
 
 
 def rrwm(K: Tensor, n1: Tensor, n2: Tensor, n1max, n2max, x0: Tensor,
-         max_iter: int, sk_iter: int, alpha: float, beta: float) -> Tensor:
+         max_iter: int, sk_iter: int, alpha: float, beta: float, return_iter: bool = False):
     """
     Pytorch implementation of RRWM algorithm.
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
-    # rescale the values in K
-    d = K.sum(dim=2, keepdim=True)
-    dmax = d.max(dim=1, keepdim=True).values
-    K = K / (dmax + d.min() * 1e-5)
-    v = v0
-    for i in range(max_iter):
-        # random walk
-        v = torch.bmm(K, v)
-        last_v = v
-        n = torch.norm(v, p=1, dim=1, keepdim=True)
-        v = v / n
-
-        # reweighted jump
-        s = v.view(batch_num, n2max, n1max).transpose(1, 2)
-        s = beta * s / s.max(dim=1, keepdim=True).values.max(dim=2, keepdim=True).values
-        v = alpha * sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose(1, 2).reshape(batch_num, n1n2, 1) + \
-            (1 - alpha) * v
-        n = torch.norm(v, p=1, dim=1, keepdim=True)
-        v = torch.matmul(v, 1 / n)
-
-        if torch.norm(v - last_v) < 1e-5:
-            break
+    # rescale the values in K (the scaling factor is applied after each matrix-vector product, so that K is not copied)
+    d = _aff_matvec(K, torch.ones_like(v0))
+    k_scale = d.amax(dim=1, keepdim=True) + d.amin(dim=1, keepdim=True) * 1e-5
+
+    # the converged instances are removed from the batch, and their results are written to x
+    x = torch.zeros_like(v0)
+    n_iter = torch.full((batch_num,), max_iter, dtype=torch.long, device=v0.device)
+    active = torch.arange(batch_num, device=v0.device)
+
+    if torch.is_grad_enabled() and (_requires_grad(K) or v0.requires_grad):
+        # the gradient is required, and the out-of-place implementation is called
+        v = v0
+        for i in range(max_iter):
+            # random walk
+            v = _aff_matvec(K, v) / k_scale
+            last_v = v
+            n = torch.norm(v, p=1, dim=1, keepdim=True)
+            v = v / n
+
+            # reweighted jump
+            s = v.view(-1, n2max, n1max).transpose(1, 2)
+            s = beta * s / s.max(dim=1, keepdim=True).values.max(dim=2, keepdim=True).values
+            v = alpha * sinkhorn(s, n1, n2, max_iter=sk_iter, batched_operation=True).transpose(1, 2).reshape(-1, n1n2, 1) + \
+                (1 - alpha) * v
+            n = torch.norm(v, p=1, dim=1, keepdim=True)
+            v = torch.matmul(v, 1 / n)
+
+            # the convergence is checked for each instance, and the converged ones are removed from the batch
+            converged = torch.norm(v - last_v, dim=(1, 2)) < 1e-5
+            if torch.any(converged):
+                x = x.index_copy(0, active[converged], v[converged])
+                n_iter[active[converged]] = i + 1
+                keep = torch.nonzero(~converged).view(-1)
+                active, v, n1, n2, k_scale = active[keep], v[keep], n1[keep], n2[keep], k_scale[keep]
+                if active.numel() == 0:
+                    break
+                K = _take_batch(K, keep)
+        x = x.index_copy(0, active, v)
 
-    return v.view(batch_num, n2max, n1max).transpose(1, 2)
+    else:
+        # all buffers are allocated before the iterations and updated inplace, thus the memory cost is independent of
+        # max_iter. They are only re-allocated when the converged instances are removed from the batch
+        n1max, n2max = int(n1max), int(n2max)
+
+        def init_workspace(v, n1, n2):
+            v_mat = v.view(v.shape[0], n2max, n1max).transpose(1, 2) # a view of v as the matching matrix
+            return torch.empty_like(v), torch.empty_like(v), \
+                torch.empty(v.shape[0], 1, 1, dtype=v.dtype, device=v.device), \
+                torch.empty(v.shape[0], n1max, n2max, dtype=v.dtype, device=v.device), v_mat, \
+                _SinkhornWorkspace(n1, n2, n1max, n2max, v.dtype)
+
+        v = v0.clone()
+        last_v, buf, n, s, v_mat, sk_workspace = init_workspace(v, n1, n2)
+        for i in range(max_iter):
+            # random walk
+            _aff_matvec(K, v, out=last_v)
+            last_v /= k_scale
+            torch.sum(torch.abs(last_v, out=buf), dim=1, keepdim=True, out=n)
+            torch.div(last_v, n, out=v)
+
+            # reweighted jump
+            torch.amax(v_mat, dim=(1, 2), keepdim=True, out=n)
+            torch.div(v_mat, n, out=s)
+            s *= beta
+            sk_workspace.sinkhorn(s, sk_iter)
+            s *= alpha
+            v *= 1 - alpha
+            v_mat += s
+            torch.sum(torch.abs(v, out=buf), dim=1, keepdim=True, out=n)
+            v /= n
+
+            # the convergence is checked for each instance, and the converged ones are removed from the batch
+            torch.sub(v, last_v, out=buf)
+            converged = torch.norm(buf, dim=(1, 2)) < 1e-5
+            if torch.any(converged):
+                x[active[converged]] = v[converged]
+                n_iter[active[converged]] = i + 1
+                keep = torch.nonzero(~converged).view(-1)
+                active, v, n1, n2, k_scale = active[keep], v[keep], n1[keep], n2[keep], k_scale[keep]
+                if active.numel() == 0:
+                    break
+                K = _take_batch(K, keep)
+                last_v, buf, n, s, v_mat, sk_workspace = init_workspace(v, n1, n2)
+        x[active] = v
+
+    x = x.view(batch_num, n2max, n1max).transpose(1, 2)
+    if return_iter:
+        return x, n_iter
+    else:
+        return x
+
+
+class _SinkhornWorkspace:
+    """
+    Masks and buffers of the Sinkhorn algorithm (with tau=1) called in the inner loop of RRWM. They are built before
+    the iterations of RRWM, and the Sinkhorn iterations are performed inplace. The results are the same as
+    ``sinkhorn(s, nrows, ncols, max_iter, batched_operation=True)``, where the smaller dimension of each instance is
+    normalized first.
+    """
+    def __init__(self, nrows: Tensor, ncols: Tensor, nrows_max: int, ncols_max: int, dtype):
+        batch_size = nrows.shape[0]
+        device = nrows.device
+        nrows = nrows.view(batch_size, 1, 1)
+        ncols = ncols.view(batch_size, 1, 1)
+        row_pad = torch.arange(nrows_max, device=device).view(1, -1, 1) >= nrows
+        col_pad = torch.arange(ncols_max, device=device).view(1, 1, -1) >= ncols
+        self.invalid = torch.logical_or(row_pad, col_pad)
+        rows_first = nrows <= ncols if nrows_max <= ncols_max else nrows < ncols
+        # the padded rows (columns), and the instances not normalized at the even (odd) iterations are skipped
+        self.row_skip = (torch.logical_or(row_pad, ~rows_first), torch.logical_or(row_pad, rows_first))
+        self.col_skip = (torch.logical_or(col_pad, rows_first), torch.logical_or(col_pad, ~rows_first))
+        self.row_all_skipped = tuple(torch.all(_).item() for _ in self.row_skip)
+        self.col_all_skipped = tuple(torch.all(_).item() for _ in self.col_skip)
+        self.buf = torch.empty(batch_size, nrows_max, ncols_max, dtype=dtype, device=device)
+        self.row_max = torch.empty(batch_size, nrows_max, 1, dtype=dtype, device=device)
+        self.row_sum = torch.empty(batch_size, nrows_max, 1, dtype=dtype, device=device)
+        self.col_max = torch.empty(batch_size, 1, ncols_max, dtype=dtype, device=device)
+        self.col_sum = torch.empty(batch_size, 1, ncols_max, dtype=dtype, device=device)
+
+    def sinkhorn(self, log_s: Tensor, max_iter: int):
+        """
+        Run Sinkhorn on log_s inplace. log_s is overwritten by the doubly-stochastic matrix.
+        """
+        log_s.masked_fill_(self.invalid, -float('inf'))
+        for i in range(max_iter):
+            if not self.row_all_skipped[i % 2]:
+                self._normalize(log_s, 2, self.row_max, self.row_sum, self.row_skip[i % 2])
+            if not self.col_all_skipped[i % 2]:
+                self._normalize(log_s, 1, self.col_max, self.col_sum, self.col_skip[i % 2])
+        log_s.exp_()
+
+    def _normalize(self, log_s, dim, log_max, log_sum, skip):
+        """
+        Inplace logsumexp normalization. The skipped rows (columns) are subtracted by 0.
+        """
+        torch.amax(log_s, dim=dim, keepdim=True, out=log_max)
+        log_max.masked_fill_(skip, 0)
+        torch.sub(log_s, log_max, out=self.buf)
+        self.buf.exp_()
+        torch.sum(self.buf, dim=dim, keepdim=True, out=log_sum)
+        log_sum.masked_fill_(skip, 1)
+        log_sum.log_()
+        log_sum += log_max
+        log_s -= log_sum
 
 
 def sm(K: Tensor, n1: Tensor, n2: Tensor, n1max, n2max, x0: Tensor,
-       max_iter: int) -> Tensor:
+       max_iter: int, return_iter: bool = False, eigen_solver: str = 'power'):
     """
     Pytorch implementation of SM algorithm.
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    if eigen_solver != 'power':
+        x, n_iter = _sm_lobpcg(K, n1, n2, n1max, n2max, v0, max_iter)
+        x = x.view(batch_num, n2max, n1max).transpose(1, 2)
+        if return_iter:
+            return x, n_iter
+        else:
+            return x
+
+    x = torch.zeros_like(v0)
+    n_iter = torch.full((batch_num,), max_iter, dtype=torch.long, device=v0.device)
+    active = torch.arange(batch_num, device=v0.device)
     v = vlast = v0
     for i in range(max_iter):
-        v = torch.bmm(K, v)
+        v = _aff_matvec(K, v)
         n = torch.norm(v, p=2, dim=1)
-        v = torch.matmul(v, (1 / n).view(batch_num, 1, 1))
-        if torch.norm(v - vlast) < 1e-5:
-            break
+        v = torch.matmul(v, (1 / n).view(-1, 1, 1))
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = torch.norm(v - vlast, dim=(1, 2)) < 1e-5
+        if torch.any(converged):
+            x = x.index_copy(0, active[converged], v[converged])
+            n_iter[active[converged]] = i + 1
+            keep = torch.nonzero(~converged).view(-1)
+            active, v = active[keep], v[keep]
+            if active.numel() == 0:
+                break
+            K = _take_batch(K, keep)
         vlast = v
+    x = x.index_copy(0, active, v)
+
+    x = x.view(batch_num, n2max, n1max).transpose(1, 2)
+    if return_iter:
+        return x, n_iter
+    else:
+        return x
+
 
-    x = v.view(batch_num, n2max, n1max).transpose(1, 2)
-    return x
+def _sm_lobpcg(K, n1, n2, n1max, n2max, v0, max_iter):
+    """
+    Compute the leading eigenvector of each instance by torch.lobpcg. The eigenproblem is restricted to the non-padded
+    entries of each instance. K can be a dense or sparse Tensor. The number of matrix-vector products is returned as
+    n_iter.
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        raise NotImplementedError('eigen_solver=lobpcg does not support FactorizedAffinity in pytorch backend.')
+    batch_num = v0.shape[0]
+    x = torch.zeros_like(v0)
+    n_iter = torch.zeros(batch_num, dtype=torch.long, device=v0.device)
+    for b in range(batch_num):
+        idx = (torch.arange(n2[b], device=v0.device).view(-1, 1) * n1max +
+               torch.arange(n1[b], device=v0.device).view(1, -1)).view(-1)
+        K_b = K[b].index_select(0, idx).index_select(1, idx)
+        init = v0[b, idx]
+        if idx.numel() < 3 or not torch.any(init != 0):
+            # torch.lobpcg requires at least 3 rows for one eigenpair
+            K_b = K_b.to_dense() if K_b.is_sparse else K_b
+            vec = torch.linalg.eigh(K_b)[1][:, -1:]
+            n_iter[b] = 1
+        else:
+            num_matvec = [0]
+            last_basis = [0, 0]
+
+            def tracker(worker):
+                # the products of each step of torch.lobpcg (method='ortho'): the first step multiplies X by K three
+                # times (norm, Rayleigh-Ritz and residual), the following ones multiply the non-converged columns of
+                # the last basis S, and X for the residual
+                n = worker.iparams['n']
+                if worker.ivars['istep'] == 1:
+                    num_matvec[0] += 3 * n
+                else:
+                    num_matvec[0] += last_basis[0] - last_basis[1] + n
+                last_basis[:] = worker.ivars['converged_end'], worker.ivars['converged_count']
+            vec = torch.lobpcg(K_b, k=1, X=init, niter=max_iter, tol=1e-5, largest=True, tracker=tracker)[1]
+            n_iter[b] = num_matvec[0]
+        # the sign of an eigenvector is arbitrary, and the one with positive sum is taken (as power iteration does)
+        vec = vec * torch.where(torch.sum(vec) < 0, -1, 1)
+        x = x.index_put((torch.full_like(idx, b), idx), vec)
+    return x, n_iter
 
 
 def ipfp(K: Tensor, n1: Tensor, n2: Tensor, n1max, n2max, x0: Tensor,
-         max_iter) -> Tensor:
+         max_iter, return_iter: bool = False):
     """
     Pytorch implementation of IPFP algorithm
     """
     batch_num, n1, n2, n1max, n2max, n1n2, v0 = _check_and_init_gm(K, n1, n2, n1max, n2max, x0)
+    x = torch.zeros_like(v0)
+    n_iter = torch.full((batch_num,), max_iter, dtype=torch.long, device=v0.device)
+    active = torch.arange(batch_num, device=v0.device)
+    # the LAPs are solved by the (persistent) Hungarian workers, and only the cost matrices are copied to the host
+    n1_np, n2_np = n1.cpu().numpy(), n2.cpu().numpy()
     v = v0
-    last_v = v
     best_v = v
-    best_obj = -1
-
-    def comp_obj_score(v1, K, v2):
-        return torch.bmm(torch.bmm(v1.view(batch_num, 1, -1), K), v2)
+    best_obj = torch.full((batch_num, 1, 1), -1, dtype=v0.dtype, device=v0.device)
+    # K v and the objective score v^T K v are cached, thus only K binary_v is computed in each iteration
+    Kv = _aff_matvec(K, v)
+    v_obj = _bdot(v, Kv)
 
     for i in range(max_iter):
-        cost = torch.bmm(K, v).reshape(batch_num, n2max, n1max).transpose(1, 2)
-        binary_sol = hungarian(cost, n1, n2)
-        binary_v = binary_sol.transpose(1, 2).view(batch_num, -1, 1)
-        alpha = comp_obj_score(v, K, binary_v - v)
-        beta = comp_obj_score(binary_v - v, K, binary_v - v)
+        cost = Kv.reshape(-1, n2max, n1max).transpose(1, 2)
+        binary_sol = _hung_batch(-cost.cpu().detach().numpy(), n1_np, n2_np,
+                                 [None] * n1_np.shape[0], [None] * n1_np.shape[0])
+        binary_v = torch.from_numpy(binary_sol).to(v.device).transpose(1, 2).reshape(-1, n1n2, 1)
+        Kb = _aff_matvec(K, binary_v)
+        current_obj = _bdot(binary_v, Kb)
+        v_Kb = _bdot(v, Kb)
+        alpha = v_Kb - v_obj # v^T K (binary_v - v)
+        beta = current_obj - _bdot(binary_v, Kv) - v_Kb + v_obj # (binary_v - v)^T K (binary_v - v)
         t0 = - alpha / beta
-        v = torch.where(torch.logical_or(beta >= 0, t0 >= 1), binary_v, v + t0 * (binary_v - v))
-        last_v_obj = comp_obj_score(last_v, K, last_v)
+        last_v_obj = v_obj
+        cond = torch.logical_or(beta >= 0, t0 >= 1)
+        v = torch.where(cond, binary_v, v + t0 * (binary_v - v))
+        Kv = torch.where(cond, Kb, Kv + t0 * (Kb - Kv))
+        v_obj = _bdot(v, Kv)
 
-        current_obj = comp_obj_score(binary_v, K, binary_v)
         best_v = torch.where(current_obj > best_obj, binary_v, best_v)
         best_obj = torch.where(current_obj > best_obj, current_obj, best_obj)
 
-        if torch.max(torch.abs(last_v_obj - current_obj) / last_v_obj) < 1e-3:
-            break
-        last_v = v
+        # the convergence is checked for each instance, and the converged ones are removed from the batch
+        converged = (torch.abs(last_v_obj - current_obj) / last_v_obj).view(-1) < 1e-3
+        if torch.any(converged):
+            x = x.index_copy(0, active[converged], best_v[converged])
+            n_iter[active[converged]] = i + 1
+            keep = torch.nonzero(~converged).view(-1)
+            active, v, Kv, v_obj, best_v, best_obj = (_[keep] for _ in (active, v, Kv, v_obj, best_v, best_obj))
+            if active.numel() == 0:
+                break
+            K = _take_batch(K, keep)
+            n1_np, n2_np = n1_np[keep.cpu().numpy()], n2_np[keep.cpu().numpy()]
+    x = x.index_copy(0, active, best_v)
+
+    pred_x = x.reshape(batch_num, n2max, n1max).transpose(1, 2)
+    if return_iter:
+        return pred_x, n_iter
+    else:
+        return pred_x
 
-    pred_x = best_v.reshape(batch_num, n2max, n1max).transpose(1, 2)
-    return pred_x
+
+def _bdot(v1: Tensor, v2: Tensor) -> Tensor:
+    """
+    Batched inner product of (b x n x 1) vectors, with output shape (b x 1 x 1)
+    """
+    return torch.bmm(v1.transpose(1, 2), v2)
 
 
-def astar(K, n1, n2, n1max, n2max, beam_width):
+def astar(K, n1, n2, n1max, n2max, beam_width, nproc=None, epsilon=0., time_budget=None, max_expansions=None):
     """
-    Pytorch implementation of ASTAR algorithm (for solving QAP)
+    Pytorch implementation of ASTAR algorithm (for solving QAP), returns the matching and the upper bound of its score
     """
     from .pytorch_astar_modules import classic_astar_kernel
 
     batch_num, n1, n2, n1max, n2max, n1n2, _ = _check_and_init_gm(K, n1, n2, n1max, n2max, None)
+    if nproc is None:
+        nproc = pygmtools.NPROC
+    # 0 means no limit in c_astar
+    time_budget = 0. if time_budget is None else time_budget
+    max_expansions = 0 if max_expansions is None else max_expansions
 
     # must have n1 <= n2 for classic_astar_kernel
     if torch.any(n1 > n2):
@@ -329,22 +571,31 @@ def astar(K, n1, n2, n1max, n2max, beam_width):
     # Also, n1 n2 is switched (it is column-wise vectorization in the repo, only here is row-wise vectorization)
     # The following code transforms K to fit these
     K = K.reshape(batch_num, n2max, n1max, n2max, n1max)
+    args_list = []
     for b in range(batch_num):
-        real_K = K[b, :n2[b], :n1[b], :n2[b], :n1[b]]
-        K_padded = torch.cat((real_K, torch.zeros((1, n1[b], n2[b], n1[b]), dtype=K.dtype, device=K.device)), dim=0)
-        K_padded = torch.cat((K_padded, torch.zeros((n2[b] + 1, 1, n2[b], n1[b]), dtype=K.dtype, device=K.device)), dim=1)
-        K_padded = torch.cat((K_padded, torch.zeros((n2[b] + 1, n1[b] + 1, 1, n1[b]), dtype=K.dtype, device=K.device)), dim=2)
-        K_padded = torch.cat((K_padded, torch.zeros((n2[b] + 1, n1[b] + 1, n2[b] + 1, 1), dtype=K.dtype, device=K.device)), dim=3)
-        # K_padded shape: (n2[b]+1) x (n1[b]+1) x (n2[b]+1) x (n1[b]+1)
+        _n1, _n2 = n1[b].item(), n2[b].item()
+        # K_padded shape: (n1[b]+1) x (n2[b]+1) x (n1[b]+1) x (n2[b]+1), the dummy rows/columns are zero
+        K_padded = torch.zeros((_n1 + 1, _n2 + 1, _n1 + 1, _n2 + 1), dtype=K.dtype, device=K.device)
+        K_padded[:_n1, :_n2, :_n1, :_n2] = K[b, :_n2, :_n1, :_n2, :_n1].permute([1, 0, 3, 2])
+        padded_n1n2 = (_n1 + 1) * (_n2 + 1)
+        args_list.append((K_padded.reshape(padded_n1n2, padded_n1n2), _n1, _n2, beam_width,
+                          epsilon, time_budget, max_expansions))
+
+    if nproc > 1 and batch_num > 1:
+        # the Hungarian heuristic and the cost of partial matchings are computed natively by c_astar without the GIL,
+        # thus the instances are dispatched to the persistent thread pool of astar (nothing is copied).
+        # GENN or custom heuristics call back into Python for every tree node, and would need processes instead
+        result_list = list(_get_thread_pool('astar', nproc).map(classic_astar_kernel, *zip(*args_list)))
+    else:
+        result_list = [classic_astar_kernel(*_) for _ in args_list]
 
-        K_padded = K_padded.permute([1, 0, 3, 2]) # shape: (n1[b]+1) x (n2[b]+1) x (n1[b]+1) x (n2[b]+1)
-        padded_n1n2 = (n1[b] + 1) * (n2[b] + 1)
-        K_padded = K_padded.reshape(padded_n1n2, padded_n1n2)
-        x_pred_b = classic_astar_kernel(K_padded, n1[b].item(), n2[b].item(), beam_width) # shape: (n1[b]+1) x (n2[b]+1)
-        # Remove the padded dimension
-        x_pred[b, :n1[b], :n2[b]] = x_pred_b[:n1[b], :n2[b]]
+    for b in range(batch_num):
+        # Remove the padded dimension, result_list[b][0] shape: (n1[b]+1) x (n2[b]+1)
+        x_pred[b, :n1[b], :n2[b]] = result_list[b][0][:n1[b], :n2[b]]
+    # c_astar minimizes the cost -K, thus its lower bound is the upper bound of the score
+    score_bound = torch.tensor([-bound for _, bound in result_list], dtype=K.dtype, device=K.device)
 
-    return x_pred
+    return x_pred, score_bound
 
 
 def _check_and_init_gm(K, n1, n2, n1max, n2max, x0):
@@ -396,24 +647,24 @@ def cao_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_step, la
     """
     m, n = num_graph, num_node
     param_lambda = lambda_init
-    device = K.device
-
-    def _comp_aff_score(x, k):
-        return pygmtools.utils.compute_affinity_score(x, k, backend='pytorch').unsqueeze(-1).unsqueeze(-1)
+    device = X.device
 
     for iter in range(max_iter):
         if iter >= iter_boost:
             param_lambda = np.min([param_lambda * lambda_step, lambda_max])
         # pair_con = get_batch_pc_opt(X)
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - torch.eye(m, device=device) * pair_aff
         norm = torch.max(pair_aff)
         for i in range(m):
             for j in range(m):
                 if i >= j:
                     continue
-                aff_ori = _comp_aff_score(X[i, j], K[i, j]) / norm
-                con_ori = _get_single_pc_opt(X, i, j)
+                aff_ori = _single_aff_score(K, i, j, X[i, j]) / norm
+                # X_combos[k] = X[i, k] * X[k, j] is shared by the consistency of all candidates of (i, j)
+                X_combos = torch.bmm(X[i, :], X[:, j])
+                aff_combos = _single_aff_score(K, i, j, X_combos) / norm
+                con_ori = _get_single_pc_opt(X, i, j, X_combos=X_combos)
                 # con_ori = torch.sqrt(pair_con[i, j])
                 if iter < iter_boost:
                     score_ori = aff_ori
@@ -421,9 +672,9 @@ def cao_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_step, la
                     score_ori = aff_ori * (1 - param_lambda) + con_ori * param_lambda
                 X_upt = X[i, j]
                 for k in range(m):
-                    X_combo = torch.matmul(X[i, k], X[k, j])
-                    aff_combo = _comp_aff_score(X_combo, K[i, j]) / norm
-                    con_combo = _get_single_pc_opt(X, i, j, X_combo)
+                    X_combo = X_combos[k]
+                    aff_combo = aff_combos[k]
+                    con_combo = _get_single_pc_opt(X, i, j, X_combo, X_combos)
                     # con_combo = torch.sqrt(pair_con[i, k] * pair_con[k, j])
                     if iter < iter_boost:
                         score_combo = aff_combo
@@ -449,20 +700,18 @@ def cao_fast_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_ste
     m, n = num_graph, num_node
     param_lambda = lambda_init
 
-    def _comp_aff_score(x, k):
-        return pygmtools.utils.compute_affinity_score(x, k, backend='pytorch').unsqueeze(-1).unsqueeze(-1)
-
-    device = K.device
+    device = X.device
     mask1 = torch.arange(m).reshape(m, 1).repeat(1, m).to(device)
     mask2 = torch.arange(m).reshape(1, m).repeat(m, 1).to(device)
     mask = (mask1 < mask2).float()
     X_mask = mask.reshape(m, m, 1, 1)
+    pc_cache = _PairConsistencyCache(X)
 
     for iter in range(max_iter):
         if iter >= iter_boost:
             param_lambda = np.min([param_lambda * lambda_step, lambda_max])
 
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - torch.eye(m, device=device) * pair_aff
         norm = torch.max(pair_aff)
 
@@ -470,12 +719,11 @@ def cao_fast_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_ste
         X2 = X.reshape(1, m, m, n, n).repeat(m, 1, 1, 1, 1).transpose(1, 2).reshape(-1, n, n)  # X2[i,j,k] = X[k,j]
         X_combo = torch.bmm(X1, X2).reshape(m, m, m, n, n)  # X_combo[i,j,k] = X[i, k] * X[k, j]
 
-        aff_ori = (_comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
-        pair_con = _get_batch_pc_opt(X)
+        aff_ori = _pair_aff_score(K, X) / norm
+        pair_con = pc_cache.update(X)
         con_ori = torch.sqrt(pair_con)
 
-        K_repeat = K.reshape(m, m, 1, n * n, n * n).repeat(1, 1, m, 1, 1).reshape(-1, n * n, n * n)
-        aff_combo = (_comp_aff_score(X_combo.reshape(-1, n, n), K_repeat) / norm).reshape(m, m, m)
+        aff_combo = _pair_aff_score(K, X_combo) / norm
         con1 = pair_con.reshape(m, 1, m).repeat(1, m, 1)  # con1[i,j,k] = pair_con[i,k]
         con2 = pair_con.reshape(1, m, m).repeat(m, 1, 1).transpose(1, 2)  # con2[i,j,k] = pair_con[j,k]
         con_combo = torch.sqrt(con1 * con2)
@@ -500,15 +748,79 @@ def cao_fast_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_ste
     return X
 
 
-def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
+def cao_chunked_solver(K, X, num_graph, num_node, max_iter, lambda_init, lambda_step, lambda_max, iter_boost,
+                       memory_budget):
+    r"""
+    Pytorch implementation of CAO solver in chunked config. It follows cao_fast_solver, but the intermediate graphs k
+    are processed in blocks, and the affinity of X[i, k] * X[k, j] is computed with K[i, j] directly. Thus, neither the
+    (m, m, m, n, n) tensors nor the repeated K are built
+
+    :param K: affinity matrix, (m, m, n*n, n*n)
+    :param X: initial matching, (m, m, n, n)
+    :param num_graph: number of graphs, int
+    :param num_node: number of nodes, int
+    :param memory_budget: the memory budget (in bytes) of the intermediate tensors of each block
+    :return: X, (m, m, n, n)
+    """
     m, n = num_graph, num_node
-    device = K.device
+    param_lambda = lambda_init
+    # each block of size chunk costs about 4 tensors of (m, m, chunk, n, n)
+    chunk = int(min(max(memory_budget // (4 * m * m * n * n * X.element_size()), 1), m))
+
+    device = X.device
+    mask1 = torch.arange(m).reshape(m, 1).repeat(1, m).to(device)
+    mask2 = torch.arange(m).reshape(1, m).repeat(m, 1).to(device)
+    mask = (mask1 < mask2).float()
+    X_mask = mask.reshape(m, m, 1, 1)
+    pc_cache = _PairConsistencyCache(X)
+
+    for iter in range(max_iter):
+        if iter >= iter_boost:
+            param_lambda = np.min([param_lambda * lambda_step, lambda_max])
+
+        aff = _pair_aff_score(K, X)
+        pair_aff = aff - torch.eye(m, device=device) * aff
+        norm = torch.max(pair_aff)
+        aff_ori = aff / norm
+
+        aff_combo = torch.empty(m, m, m, dtype=aff_ori.dtype, device=device)
+        for k0 in range(0, m, chunk):
+            k1 = min(k0 + chunk, m)
+            X_combo = torch.matmul(X[:, None, k0:k1], X[None, k0:k1].transpose(1, 2))  # X_combo[i,j,k] = X[i,k] * X[k,j]
+            aff_combo[:, :, k0:k1] = _pair_aff_score(K, X_combo) / norm
+        pair_con = pc_cache.update(X)
+        con_ori = torch.sqrt(pair_con)
+
+        con1 = pair_con.reshape(m, 1, m)  # con1[i,j,k] = pair_con[i,k]
+        con2 = pair_con.reshape(1, m, m).transpose(1, 2)  # con2[i,j,k] = pair_con[j,k]
+        con_combo = torch.sqrt(con1 * con2)
+
+        if iter < iter_boost:
+            score_ori = aff_ori
+            score_combo = aff_combo
+        else:
+            score_ori = aff_ori * (1 - param_lambda) + con_ori * param_lambda
+            score_combo = aff_combo * (1 - param_lambda) + con_combo * param_lambda
+
+        score_combo, idx = torch.max(score_combo, dim=-1)
 
-    def _comp_aff_score(x, k):
-        return pygmtools.utils.compute_affinity_score(x, k, backend='pytorch').unsqueeze(-1).unsqueeze(-1)
+        if not torch.all(score_combo + 1e-4 >= score_ori):
+            raise RuntimeError('CAO-chunked internal error', torch.min(score_combo - score_ori))
+
+        X_upt = torch.matmul(X[mask1, idx], X[idx, mask2])
+        X = X_upt * X_mask + X_upt.transpose(0, 1).transpose(2, 3) * X_mask.transpose(0, 1) + X * (
+                    1 - X_mask - X_mask.transpose(0, 1))
+        if not torch.all(X.transpose(0, 1).transpose(2, 3) == X):
+            raise RuntimeError('CAO-chunked internal error')
+    return X
+
+
+def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
+    m, n = num_graph, num_node
+    device = X.device
 
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - torch.eye(m, device=device) * pair_aff
         norm = torch.max(pair_aff)
 
@@ -520,32 +832,32 @@ def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
             for j in range(m):
                 if i >= j:
                     continue
-                score_ori = _comp_aff_score(X[i, j], K[i, j]) / norm
+                score_ori = _single_aff_score(K, i, j, X[i, j]) / norm
                 X_combo = torch.matmul(X[i, k], X[k, j])
-                score_combo = _comp_aff_score(X_combo, K[i, j]) / norm
+                score_combo = _single_aff_score(K, i, j, X_combo) / norm
 
                 if score_combo > score_ori:
                     X[i, j] = X_combo
                     X[j, i] = X_combo.transpose(0, 1)
 
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - torch.eye(m, device=device) * pair_aff
         norm = torch.max(pair_aff)
 
-        pair_con = _get_batch_pc_opt(X)
         for i in range(m):
             for j in range(m):
                 if i >= j:
                     continue
-                aff_ori = _comp_aff_score(X[i, j], K[i, j]) / norm
-                con_ori = _get_single_pc_opt(X, i, j)
+                aff_ori = _single_aff_score(K, i, j, X[i, j]) / norm
+                X_combos = torch.bmm(X[i, :], X[:, j])  # shared by the consistency of X[i, j] and X_combo
+                con_ori = _get_single_pc_opt(X, i, j, X_combos=X_combos)
                 # con_ori = torch.sqrt(pair_con[i, j])
                 score_ori = aff_ori * (1 - param_lambda) + con_ori * param_lambda
 
-                X_combo = torch.matmul(X[i, k], X[k, j])
-                aff_combo = _comp_aff_score(X_combo, K[i, j]) / norm
-                con_combo = _get_single_pc_opt(X, i, j, X_combo)
+                X_combo = X_combos[k]
+                aff_combo = _single_aff_score(K, i, j, X_combo) / norm
+                con_combo = _get_single_pc_opt(X, i, j, X_combo, X_combos)
                 # con_combo = torch.sqrt(pair_con[i, k] * pair_con[k, j])
                 score_combo = aff_combo * (1 - param_lambda) + con_combo * param_lambda
 
@@ -557,10 +869,7 @@ def mgm_floyd_solver(K, X, num_graph, num_node, param_lambda):
 
 def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
     m, n = num_graph, num_node
-    device = K.device
-
-    def _comp_aff_score(x, k):
-        return pygmtools.utils.compute_affinity_score(x, k, backend='pytorch').unsqueeze(-1).unsqueeze(-1)
+    device = X.device
 
     mask1 = torch.arange(m).reshape(m, 1).repeat(1, m)
     mask2 = torch.arange(m).reshape(1, m).repeat(m, 1)
@@ -568,7 +877,7 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
     X_mask = mask.reshape(m, m, 1, 1)
 
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - torch.eye(m, device=device) * pair_aff
         norm = torch.max(pair_aff)
 
@@ -580,8 +889,8 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
         X2 = X[k, :].reshape(1, m, n, n).repeat(m, 1, 1, 1).reshape(-1, n, n)  # X[i, j] = X[j, k]
         X_combo = torch.bmm(X1, X2).reshape(m, m, n, n)
 
-        aff_ori = (_comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
-        aff_combo = (_comp_aff_score(X_combo.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
+        aff_ori = _pair_aff_score(K, X) / norm
+        aff_combo = _pair_aff_score(K, X_combo) / norm
 
         score_ori = aff_ori
         score_combo = aff_combo
@@ -591,19 +900,20 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
         X = X * (1.0 - upt) + X_combo * upt
         X = X * X_mask + X.transpose(0, 1).transpose(2, 3) * (1 - X_mask)
 
+    pc_cache = _PairConsistencyCache(X)
     for k in range(m):
-        pair_aff = _comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)).reshape(m, m)
+        pair_aff = _pair_aff_score(K, X)
         pair_aff = pair_aff - torch.eye(m, device=device) * pair_aff
         norm = torch.max(pair_aff)
 
-        pair_con = _get_batch_pc_opt(X)
+        pair_con = pc_cache.update(X)
 
         X1 = X[:, k].reshape(m, 1, n, n).repeat(1, m, 1, 1).reshape(-1, n, n)  # X[i, j] = X[i, k]
         X2 = X[k, :].reshape(1, m, n, n).repeat(m, 1, 1, 1).reshape(-1, n, n)  # X[i, j] = X[j, k]
         X_combo = torch.bmm(X1, X2).reshape(m, m, n, n)
 
-        aff_ori = (_comp_aff_score(X.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
-        aff_combo = (_comp_aff_score(X_combo.reshape(-1, n, n), K.reshape(-1, n * n, n * n)) / norm).reshape(m, m)
+        aff_ori = _pair_aff_score(K, X) / norm
+        aff_combo = _pair_aff_score(K, X_combo) / norm
 
         con_ori = torch.sqrt(pair_con)
         con1 = pair_con[:, k].reshape(m, 1).repeat(1, m)
@@ -620,24 +930,158 @@ def mgm_floyd_fast_solver(K, X, num_graph, num_node, param_lambda):
     return X
 
 
-def _get_single_pc_opt(X, i, j, Xij=None):
+def mgm_floyd_online_solver(K_new, x_new, X_anchor, anchors, num_node, param_lambda):
+    r"""
+    Pytorch implementation of the online MGM-Floyd update. The matchings between the new graph and the existing graphs
+    are updated by the Floyd step through the anchor graphs a, i.e. X[i, new] <- X[i, a] * X[a, new]
+
+    :param K_new: affinity matrix between the existing graphs and the new graph, (m, n*n, n*n)
+    :param x_new: initial matching between the existing graphs and the new graph, (m, n, n)
+    :param X_anchor: X_anchor[i][t] = X[i, anchors[t]], list of lists of (n, n) matrices (None if i == anchors[t])
+    :param anchors: indices of the anchor graphs, (b,)
+    :param num_node: number of nodes, int
+    :param param_lambda: weight of the consistency term, float
+    :return: the updated matching between the existing graphs and the new graph, (m, n, n)
+    """
+    m, b, n = x_new.shape[0], len(anchors), num_node
+    device = x_new.device
+    eye = torch.eye(n, dtype=x_new.dtype, device=device)
+    X_anchor = torch.stack([torch.stack([eye if x is None else x for x in row]) for row in X_anchor])
+    anchors = torch.as_tensor(anchors, dtype=torch.long, device=device)
+    X_combo = torch.matmul(X_anchor, x_new[anchors].unsqueeze(0))  # X_combo[i, t] = X[i, a_t] * X[a_t, new]
+
+    aff_ori = compute_affinity_score(x_new, K_new)
+    aff_combo = torch.stack([compute_affinity_score(X_combo[:, t], K_new) for t in range(b)], dim=1)
+    norm = torch.max(torch.max(aff_ori), torch.max(aff_combo))
+
+    # consistency is measured w.r.t. the paths through the anchors
+    con_ori = 1 - torch.sum(torch.abs(X_combo - x_new.unsqueeze(1)), dim=(1, 2, 3)) / (2 * n * b)
+    con_combo = torch.stack([1 - torch.sum(torch.abs(X_combo - X_combo[:, t:t + 1]), dim=(1, 2, 3)) / (2 * n * b)
+                             for t in range(b)], dim=1)
+
+    score_ori = aff_ori / norm * (1 - param_lambda) + con_ori * param_lambda
+    score_combo = aff_combo / norm * (1 - param_lambda) + con_combo * param_lambda
+
+    best = torch.argmax(score_combo, dim=1)
+    arange = torch.arange(m, device=device)
+    upt = (score_ori < score_combo[arange, best]).reshape(m, 1, 1)
+    return torch.where(upt, X_combo[arange, best], x_new)
+
+
+def _pair_aff_score(K, X):
+    """
+    CAO/Floyd helper function (compute the affinity scores of all pairs)
+    :param K: (m, m, n*n, n*n) affinity matrix, or a PairwiseAffinity object
+    :param X: (m, m, n, n) or (m, m, c, n, n) the matchings, where X[i, j] is scored with K[i, j]
+    :return: (m, m) or (m, m, c) the affinity scores. The diagonal is zero for PairwiseAffinity
+    """
+    m, n = X.shape[0], X.shape[-1]
+    Xc = X.reshape(m, m, -1, n, n)
+    c = Xc.shape[2]
+    vx = Xc.transpose(3, 4).reshape(m, m, c, n * n).transpose(2, 3)  # (m, m, n*n, c)
+    if type(K) is pygmtools.utils.PairwiseAffinity:
+        i, j = torch.triu_indices(m, m, 1, device=X.device)
+        # the score of X[j, i] with K[j, i] equals the score of X[j, i]^T with K[i, j]
+        vx = torch.cat((vx[i, j], vx[j, i].reshape(-1, n, n, c).transpose(1, 2).reshape(-1, n * n, c)), dim=2)
+        score = torch.sum(vx * _aff_matvec(K.K, vx), dim=1)
+        ret = torch.zeros(m, m, c, dtype=score.dtype, device=X.device)
+        ret[i, j] = score[:, :c]
+        ret[j, i] = score[:, c:]
+    else:
+        vx = vx.reshape(m * m, n * n, c)
+        ret = torch.sum(vx * torch.bmm(K.reshape(m * m, n * n, n * n), vx), dim=1)
+    return ret.reshape(X.shape[:-2])
+
+
+def _single_aff_score(K, i, j, x):
+    """
+    CAO/Floyd helper function (compute the affinity scores of one pair)
+    :param K: (m, m, n*n, n*n) affinity matrix, or a PairwiseAffinity object
+    :param i: index
+    :param j: index
+    :param x: (n, n) or (c, n, n) the matchings of graph i and graph j
+    :return: () or (c,) the affinity scores
+    """
+    n = x.shape[-1]
+    xc = x.reshape(-1, n, n)
+    if type(K) is pygmtools.utils.PairwiseAffinity:
+        if i > j:
+            i, j, xc = j, i, xc.transpose(1, 2)
+        K_ij = _take_batch(K.K, torch.tensor([K.pair_index(i, j)], device=x.device))
+    else:
+        K_ij = K[i, j].unsqueeze(0)
+    vx = xc.transpose(1, 2).reshape(-1, n * n).transpose(0, 1).unsqueeze(0)  # (1, n*n, c)
+    return torch.sum(vx * _aff_matvec(K_ij, vx), dim=1).reshape(x.shape[:-2])
+
+
+def _pairwise_matching(x, num_graph):
+    """
+    CAO/Floyd helper function (build the matchings of all pairs)
+    :param x: (m*(m-1)/2, n, n) the matchings of the pairs (i, j), i < j in the row-major order
+    :param num_graph: number of graphs, int
+    :return: (m, m, n, n) the matchings of all pairs
+    """
+    m, n = num_graph, x.shape[-1]
+    i, j = torch.triu_indices(m, m, 1, device=x.device)
+    X = torch.zeros(m, m, n, n, dtype=x.dtype, device=x.device)
+    X[i, j] = x
+    X[j, i] = x.transpose(1, 2)
+    X[torch.arange(m), torch.arange(m)] = torch.eye(n, dtype=x.dtype, device=x.device)
+    return X
+
+
+def _get_single_pc_opt(X, i, j, Xij=None, X_combos=None):
     """
     CAO/Floyd helper function (compute consistency)
     :param X: (m, m, n, n) all the matching results
     :param i: index
     :param j: index
+    :param Xij: (optional) the matching to be evaluated, X[i, j] by default
+    :param X_combos: (optional) (m, n, n) the precomputed X[i, k] * X[k, j] for all k
     :return: the consistency of X_ij
     """
     m, _, n, _ = X.size()
     if Xij is None:
         Xij = X[i, j]
-    X1 = X[i, :].reshape(-1, n, n)
-    X2 = X[:, j].reshape(-1, n, n)
-    X_combo = torch.bmm(X1, X2)
-    pair_con = 1 - torch.sum(torch.abs(Xij - X_combo)) / (2 * n * m)
+    if X_combos is None:
+        X_combos = torch.bmm(X[i, :], X[:, j])
+    pair_con = 1 - torch.sum(torch.abs(Xij - X_combos)) / (2 * n * m)
     return pair_con
 
 
+class _PairConsistencyCache:
+    """
+    CAO/Floyd-fast helper class (compute consistency incrementally). The results are the same as _get_batch_pc_opt,
+    but the errors err[i, j, k] = |X[i, j] - X[i, k] * X[k, j]| are cached, and only the entries involving the updated
+    matchings are recomputed. Besides, the (m, m, m, n, n) tensor is never built.
+    """
+    def __init__(self, X):
+        m, n = X.shape[0], X.shape[2]
+        self.X = X.clone()
+        self.err = torch.empty(m, m, m, dtype=X.dtype, device=X.device)
+        for i in range(m):
+            # X_combo[j, k] = X[i, k] * X[k, j]
+            X_combo = torch.matmul(X[i].unsqueeze(0), X.transpose(0, 1))
+            self.err[i] = torch.sum(torch.abs(X_combo - X[i].unsqueeze(1)), dim=(2, 3))
+
+    def update(self, X):
+        """
+        Update the cache with the new matching results X, and return the (m, m) consistency of X
+        """
+        m, n = X.shape[0], X.shape[2]
+        changed = torch.any((X != self.X).reshape(m, m, -1), dim=-1)
+        if torch.any(changed):
+            self.X = X.clone()
+            # err[i, j, k] depends on X[i, j], X[i, k] and X[k, j]
+            outdated = changed.unsqueeze(2) | changed.unsqueeze(1) | changed.t().unsqueeze(0)
+            i, j, k = torch.nonzero(outdated, as_tuple=True)
+            for s in range(0, i.shape[0], m * m):
+                _i, _j, _k = i[s:s + m * m], j[s:s + m * m], k[s:s + m * m]
+                X_combo = torch.bmm(X[_i, _k], X[_k, _j])
+                self.err[_i, _j, _k] = torch.sum(torch.abs(X_combo - X[_i, _j]), dim=(1, 2))
+        return 1 - torch.sum(self.err, dim=2) / (2 * n * m)
+
+
 def _get_batch_pc_opt(X):
     """
     CAO/Floyd-fast helper function (compute consistency in batch)
@@ -669,13 +1113,6 @@ def gamgm(
         ns = torch.full((num_graphs,), A.shape[1], dtype=torch.int, device=A.device)
     n_indices = torch.cumsum(ns, dim=0)
 
-    # build a super adjacency matrix A
-    supA = torch.zeros(n_indices[-1], n_indices[-1], device=A.device)
-    for i in range(num_graphs):
-        start_n = n_indices[i] - ns[i]
-        end_n = n_indices[i]
-        supA[start_n:end_n, start_n:end_n] = A[i, :ns[i], :ns[i]]
-
     # handle the type of n_univ
     if type(n_univ) is torch.Tensor:
         n_univ = n_univ.item()
@@ -689,18 +1126,12 @@ def gamgm(
     if cluster_M is None:
         cluster_M = torch.ones(num_graphs, num_graphs, device=A.device)
 
-    # reshape W into supW
-    supW = torch.zeros(n_indices[-1], n_indices[-1], device=A.device)
-    for i, j in itertools.product(range(num_graphs), repeat=2):
-        start_x = n_indices[i] - ns[i]
-        end_x = n_indices[i]
-        start_y = n_indices[j] - ns[j]
-        end_y = n_indices[j]
-        supW[start_x:end_x, start_y:end_y] = W[i, j, :ns[i], :ns[j]]
+    # the computation follows the dtype of U
+    A, W = A.to(dtype=U0.dtype), W.to(dtype=U0.dtype)
 
     U = GAMGMTorchFunc.apply(
         bb_smooth,
-        supA, supW, ns, n_indices, n_univ, num_graphs, U0,
+        A, W, ns, n_indices, n_univ, num_graphs, U0,
         init_tau, min_tau, sk_gamma,
         sk_iter, max_iter, quad_weight,
         converge_thresh, outlier_thresh,
@@ -725,14 +1156,14 @@ class GAMGMTorchFunc(torch.autograd.Function):
     """
 
     @staticmethod
-    def forward(ctx, bb_smooth, supA, supW, ns, n_indices, n_univ, num_graphs, U0, *args):
+    def forward(ctx, bb_smooth, A, W, ns, n_indices, n_univ, num_graphs, U0, *args):
         # save parameters
         ctx.bb_smooth = bb_smooth
-        ctx.named_args = supA, supW, ns, n_indices, n_univ, num_graphs, U0
+        ctx.named_args = A, W, ns, n_indices, n_univ, num_graphs, U0
         ctx.list_args = args
 
         # real solver function
-        U = gamgm_real(supA, supW, ns, n_indices, n_univ, num_graphs, U0, *args)
+        U = gamgm_real(A, W, ns, n_indices, n_univ, num_graphs, U0, *args)
 
         # save result
         ctx.U = U
@@ -742,36 +1173,46 @@ class GAMGMTorchFunc(torch.autograd.Function):
     def backward(ctx, dU):
         epsilon = 1e-8
         bb_smooth = ctx.bb_smooth
-        supA, supW, ns, n_indices, n_univ, num_graphs, U0 = ctx.named_args
+        A, W, ns, n_indices, n_univ, num_graphs, U0 = ctx.named_args
         args = ctx.list_args
         U = ctx.U
 
-        for i, j in itertools.product(range(num_graphs), repeat=2):
-            start_x = n_indices[i] - ns[i]
-            end_x = n_indices[i]
-            start_y = n_indices[j] - ns[j]
-            end_y = n_indices[j]
-            supW[start_x:end_x, start_y:end_y] += bb_smooth * torch.mm(dU[start_x:end_x],
-                                                                       dU[start_y:end_y].transpose(0, 1))
-
-        U_prime = gamgm_real(supA, supW, ns, n_indices, n_univ, num_graphs, U0, *args)
-
-        grad_supW = torch.zeros(n_indices[-1], n_indices[-1], device=supW.device)
-        for i, j in itertools.product(range(num_graphs), repeat=2):
-            start_x = n_indices[i] - ns[i]
-            end_x = n_indices[i]
-            start_y = n_indices[j] - ns[j]
-            end_y = n_indices[j]
-            X = torch.mm(U[start_x:end_x], U[start_y:end_y].transpose(0, 1))
-            X_prime = torch.mm(U_prime[start_x:end_x], U_prime[start_y:end_y].transpose(0, 1))
-            grad_supW[start_x:end_x, start_y:end_y] = -(X - X_prime) / (bb_smooth + epsilon)
-
-        return_list = [None, None, grad_supW] + [None] * (len(ctx.needs_input_grad) - 3)
+        # the (i, j) block of the pairwise matchings is U_i U_j^T, which is zero for the padded nodes
+        def _pairwise_blocks(U):
+            U_pad = _gamgm_pad(U, ns, n_indices, num_graphs, W.shape[2])
+            return torch.einsum('iad,jbd->ijab', U_pad, U_pad)
+
+        W_prime = W + bb_smooth * _pairwise_blocks(dU)
+        U_prime = gamgm_real(A, W_prime, ns, n_indices, n_univ, num_graphs, U0, *args)
+
+        grad_W = -(_pairwise_blocks(U) - _pairwise_blocks(U_prime)) / (bb_smooth + epsilon)
+
+        return_list = [None, None, grad_W] + [None] * (len(ctx.needs_input_grad) - 3)
         return tuple(return_list)
 
 
+def _gamgm_pad(U, ns, n_indices, num_graphs, n_max):
+    """
+    GAMGM helper function (convert the stacked U of all graphs to the padded (m, n_max, d) tensor)
+    """
+    graph_idx, node_idx = _gamgm_node_index(ns, n_indices, num_graphs)
+    U_pad = torch.zeros(num_graphs, n_max, U.shape[1], dtype=U.dtype, device=U.device)
+    U_pad[graph_idx, node_idx] = U
+    return U_pad
+
+
+def _gamgm_node_index(ns, n_indices, num_graphs):
+    """
+    GAMGM helper function (the row U[k] of the stacked U is the node node_idx[k] of graph graph_idx[k])
+    """
+    ns = ns.to(dtype=torch.long)
+    graph_idx = torch.repeat_interleave(torch.arange(num_graphs, device=ns.device), ns)
+    node_idx = torch.arange(graph_idx.shape[0], device=ns.device) - torch.repeat_interleave(n_indices - ns, ns)
+    return graph_idx, node_idx
+
+
 def gamgm_real(
-        supA, supW, ns, n_indices, n_univ, num_graphs, U0,
+        A, W, ns, n_indices, n_univ, num_graphs, U0,
         init_tau, min_tau, sk_gamma,
         sk_iter, max_iter, quad_weight,
         converge_thresh, outlier_thresh,
@@ -779,21 +1220,54 @@ def gamgm_real(
         cluster_M, projector, hung_iter  # these arguments are reserved for clustering
 ):
     """
-    The real forward function of GAMGM
+    The real forward function of GAMGM. The super adjacency matrix supA = diag(A_1, ..., A_m) and the super weight
+    matrix supW = [W_ij] are never built, and the products with them are computed by the blocks of each graph
     """
     U = U0
     sinkhorn_tau = init_tau
     iter_flag = True
 
+    n_max = A.shape[1]
+    graph_idx, node_idx = _gamgm_node_index(ns, n_indices, num_graphs)
+    # the cluster weights are applied to the blocks of W once
+    supW_pad = (W * cluster_M.reshape(num_graphs, num_graphs, 1, 1)).transpose(1, 2).reshape(num_graphs * n_max, -1)
+    all_cluster = bool(torch.all(cluster_M == 1))
+
+    def _quad_unary(U):
+        # block (i, j) of supA (UU^T * cluster_weight) supA is M_ij A_i U_i U_j^T A_j, thus the i-th block of the
+        # quad term is A_i U_i sum_j M_ij U_j^T A_j U_j
+        U_pad = _gamgm_pad(U, ns, n_indices, num_graphs, n_max)
+        AU = torch.bmm(A, U_pad)
+        UAU = torch.bmm(U_pad.transpose(1, 2), AU).reshape(num_graphs, -1)
+        if all_cluster:
+            # all graphs are in one cluster, the sum over j is shared by every graph
+            quad = torch.matmul(AU, UAU.sum(dim=0).reshape(n_univ, n_univ))
+        else:
+            quad = torch.bmm(AU, torch.mm(cluster_M, UAU).reshape(num_graphs, n_univ, n_univ))
+        unary = torch.mm(supW_pad, U_pad.reshape(-1, n_univ)).reshape(num_graphs, n_max, n_univ)
+        return quad[graph_idx, node_idx] * quad_weight * 2, unary[graph_idx, node_idx]
+
+    def _uut_diff(U1, U2):
+        # the Frobenius norm of U1 U1^T - U2 U2^T without building the (sum n) x (sum n) matrices. With S = U1 + U2
+        # and D = U1 - U2, U1 U1^T - U2 U2^T = (S D^T + D S^T) / 2, and its squared norm is
+        # (tr((D^T S)^2) + tr(S^T S D^T D)) / 2, where only n_univ x n_univ products are involved
+        S, D = U1 + U2, U1 - U2
+        DtS = torch.mm(D.t(), S)
+        diff = (torch.sum(DtS * DtS.t()) + torch.sum(torch.mm(S.t(), S) * torch.mm(D.t(), D))) / 2
+        return torch.sqrt(torch.clamp(diff, min=0))
+
+    # graphs of different sizes are projected in one batched call on the padded layout
+    uniform_ns = bool(torch.all(ns == ns[0]))
+    ns_long = ns.to(dtype=torch.long)
+
+    def _hung_project(S):
+        return hungarian(_gamgm_pad(S, ns, n_indices, num_graphs, n_max), ns_long)[graph_idx, node_idx]
+
     while iter_flag:
         for i in range(max_iter):
             # compact matrix form update of V
-            UUt = torch.mm(U, U.t())
-            lastUUt = UUt
-            cluster_weight = torch.repeat_interleave(cluster_M, ns.to(dtype=torch.long), dim=0)
-            cluster_weight = torch.repeat_interleave(cluster_weight, ns.to(dtype=torch.long), dim=1)
-            quad = torch.chain_matmul(supA, UUt * cluster_weight, supA, U) * quad_weight * 2
-            unary = torch.mm(supW * cluster_weight, U)
+            lastU = U
+            quad, unary = _quad_unary(U)
             if verbose:
                 if projector == 'sinkhorn':
                     print_str = f'tau={sinkhorn_tau:.3e}'
@@ -803,68 +1277,39 @@ def gamgm_real(
                                   f'quad score: {(quad * U).sum():.3e}, unary score: {(unary * U).sum():.3e}')
             V = (quad + unary) / num_graphs
 
-            U_list = []
             if projector == 'hungarian':
-                n_start = 0
-                for n_end in n_indices:
-                    U_list.append(pygmtools.hungarian(V[n_start:n_end, :n_univ], backend='pytorch'))
-                    n_start = n_end
+                U = _hung_project(V)
             elif projector == 'sinkhorn':
-                if torch.all(ns == ns[0]):
+                if uniform_ns:
                     if ns[0] <= n_univ:
-                        U_list.append(
-                            sinkhorn(
-                                V.reshape(num_graphs, -1, n_univ),
-                                max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
-                            ).reshape(-1, n_univ))
+                        U = sinkhorn(
+                            V.reshape(num_graphs, -1, n_univ),
+                            max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
+                        ).reshape(-1, n_univ)
                     else:
-                        U_list.append(
-                            sinkhorn(
-                                V.reshape(num_graphs, -1, n_univ).transpose(1, 2),
-                                max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
-                            ).transpose(1, 2).reshape(-1, n_univ))
+                        U = sinkhorn(
+                            V.reshape(num_graphs, -1, n_univ).transpose(1, 2),
+                            max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True
+                        ).transpose(1, 2).reshape(-1, n_univ)
                 else:
-                    V_list = []
-                    n1 = []
-                    n_start = 0
-                    for n_end in n_indices:
-                        V_list.append(V[n_start:n_end, :n_univ])
-                        n1.append(n_end - n_start)
-                        n_start = n_end
-                    V_batch = build_batch(V_list)
-                    n1 = torch.tensor(n1, device=V_batch.device)
-                    U = sinkhorn(V_batch, n1,
+                    U = sinkhorn(_gamgm_pad(V, ns, n_indices, num_graphs, n_max), ns_long,
                                  max_iter=sk_iter, tau=sinkhorn_tau, batched_operation=True, dummy_row=True)
-                    n_start = 0
-                    for idx, n_end in enumerate(n_indices):
-                        U_list.append(U[idx, :n_end - n_start, :])
-                        n_start = n_end
+                    U = U[graph_idx, node_idx]
             else:
                 raise NameError('Unknown projecter name: {}'.format(projector))
 
-            U = torch.cat(U_list, dim=0)
             if num_graphs == 2:
                 U[:ns[0], :] = torch.eye(ns[0], n_univ, device=U.device)
 
             # calculate gap to discrete
             if projector == 'sinkhorn' and verbose:
-                U_list_hung = []
-                n_start = 0
-                for n_end in n_indices:
-                    U_list_hung.append(pygmtools.hungarian(V[n_start:n_end, :n_univ], backend='pytorch'))
-                    n_start = n_end
-                U_hung = torch.cat(U_list_hung, dim=0)
-                diff = torch.norm(torch.mm(U, U.t()) - lastUUt)
+                U_hung = _hung_project(V)
+                diff = _uut_diff(U, lastU)
                 print(f'tau={sinkhorn_tau:.3e} #iter={i}/{max_iter} '
                       f'gap to discrete: {torch.mean(torch.abs(U - U_hung)):.3e}, iter diff: {diff:.3e}')
 
             if projector == 'hungarian' and outlier_thresh > 0:
-                U_hung = U
-                UUt = torch.mm(U_hung, U_hung.t())
-                cluster_weight = torch.repeat_interleave(cluster_M, ns.to(dtype=torch.long), dim=0)
-                cluster_weight = torch.repeat_interleave(cluster_weight, ns.to(dtype=torch.long), dim=1)
-                quad = torch.chain_matmul(supA, UUt * cluster_weight, supA, U_hung) * quad_weight * 2
-                unary = torch.mm(supW * cluster_weight, U_hung)
+                quad, unary = _quad_unary(U)
                 max_vals = (unary + quad).max(dim=1).values
                 U = U * (unary + quad > outlier_thresh)
                 if verbose:
@@ -872,7 +1317,7 @@ def gamgm_real(
                           f'unary+quad score thresh={outlier_thresh:.3f}, #>thresh={torch.sum(max_vals > outlier_thresh)}/{max_vals.shape[0]}'
                           f' min:{max_vals.min():.4f}, mean:{max_vals.mean():.4f}, median:{max_vals.median():.4f}, max:{max_vals.max():.4f}')
 
-            if torch.norm(torch.mm(U, U.t()) - lastUUt) < converge_thresh:
+            if _uut_diff(U, lastU) < converge_thresh:
                 break
 
         if verbose: print('-' * 20)
@@ -881,8 +1326,7 @@ def gamgm_real(
             if hung_iter:
                 pass
             else:
-                U_list = [pygmtools.hungarian(_, backend='pytorch') for _ in U_list]
-                U = torch.cat(U_list, dim=0)
+                U = _hung_project(U)
                 break
 
         # projection control
@@ -894,8 +1338,7 @@ def gamgm_real(
             if hung_iter:
                 projector = 'hungarian'
             else:
-                U_list = [pygmtools.hungarian(_, backend='pytorch') for _ in U_list]
-                U = torch.cat(U_list, dim=0)
+                U = _hung_project(U)
                 break
 
     return U
@@ -1199,8 +1642,13 @@ class NGM_Net(torch.nn.Module):
         _sinkhorn_func = functools.partial(sinkhorn,
                                            dummy_row=False, max_iter=sk_max_iter, tau=sk_tau, batched_operation=False)
         emb = v0
-        A = (K != 0).to(K.dtype)
-        emb_K = K.unsqueeze(-1)
+        if type(K) is pygmtools.utils.FactorizedAffinity:
+            # K is applied implicitly, and A is the number of non-zero elements in each row of K
+            A = _factorized_aff_nnz(K)
+            emb_K = K
+        else:
+            A = (K != 0).to(K.dtype)
+            emb_K = K.unsqueeze(-1)
 
         # NGM qap solver
         for i in range(self.gnn_layer):
@@ -1259,14 +1707,19 @@ def ngm(K, n1, n2, n1max, n2max, x0, gnn_channels, sk_emb, sk_max_iter, sk_tau,
 
 
 def genn_astar(feat1, feat2, A1, A2, n1, n2, channel, filters_1, filters_2, filters_3,
-          tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain):
+          tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain,
+          epsilon=0., time_budget=None, max_expansions=None):
     """
     Pytorch implementation of GENN-ASTAR
     """
     from .pytorch_astar_modules import genn_astar_kernel
 
+    # 0 means no limit in c_astar
+    time_budget = 0. if time_budget is None else time_budget
+    max_expansions = 0 if max_expansions is None else max_expansions
     return genn_astar_kernel(feat1, feat2, A1, A2, n1, n2, channel, filters_1, filters_2, filters_3,
-          tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain, use_net=True)
+          tensor_neurons, beam_width, trust_fact, no_pred_size, network, pretrain, use_net=True,
+          epsilon=epsilon, time_budget=time_budget, max_expansions=max_expansions)
     
     
 #############################################
@@ -1342,7 +1795,7 @@ def compute_affinity_score(X, K):
     b, n, _ = X.size()
     vx = X.transpose(1, 2).reshape(b, -1, 1)  # (b, n*n, 1)
     vxt = vx.transpose(1, 2)  # (b, 1, n*n)
-    affinity = torch.bmm(torch.bmm(vxt, K), vx).squeeze(-1).squeeze(-1)
+    affinity = torch.bmm(vxt, _aff_matvec(K, vx)).squeeze(-1).squeeze(-1)
     return affinity
 
 
@@ -1424,10 +1877,138 @@ def permutation_loss(pred_dsmat: Tensor, gt_perm: Tensor, n1: Tensor, n2: Tensor
 
 
 def _aff_mat_from_node_edge_aff(node_aff: Tensor, edge_aff: Tensor, connectivity1: Tensor, connectivity2: Tensor,
-                                n1, n2, ne1, ne2):
+                                n1, n2, ne1, ne2, out: Tensor = None):
     """
     Pytorch implementation of _aff_mat_from_node_edge_aff
     """
+    device, dtype, batch_size, n1, n2, ne1, ne2 = _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2,
+                                                                     n1, n2, ne1, ne2)
+    n1max = int(max(n1))
+    n2max = int(max(n2))
+    n1n2 = n2max * n1max
+    if out is None:
+        k = torch.zeros(batch_size, n1n2, n1n2, dtype=dtype, device=device)
+    else:
+        if out.shape != (batch_size, n1n2, n1n2) or not out.is_contiguous():
+            raise ValueError(f'Expected a contiguous output buffer of shape {(batch_size, n1n2, n1n2)}, '
+                             f'got {tuple(out.shape)}.')
+        k = out.zero_()
+    # edge-wise affinity
+    if edge_aff is not None:
+        mask = _edge_pair_mask(edge_aff, ne1, ne2)
+        b_idx = torch.arange(batch_size, device=device).view(-1, 1, 1)
+        conn1 = connectivity1.to(torch.long)
+        conn2 = connectivity2.to(torch.long)
+        # row index: start_g2 * n1max + start_g1, col index: end_g2 * n1max + end_g1
+        row = conn2[:, None, :, 0] * n1max + conn1[:, :, None, 0]
+        col = conn2[:, None, :, 1] * n1max + conn1[:, :, None, 1]
+        k.view(-1)[((b_idx * n1n2 + row) * n1n2 + col)[mask]] = edge_aff[mask].to(dtype)
+    # node-wise affinity
+    if node_aff is not None:
+        k_diag = torch.diagonal(k, dim1=1, dim2=2)
+        k_diag[:] = node_aff.transpose(1, 2).reshape(batch_size, -1)
+
+    return k
+
+
+def _sparse_aff_mat_from_node_edge_aff(node_aff: Tensor, edge_aff: Tensor, connectivity1: Tensor,
+                                       connectivity2: Tensor, n1, n2, ne1, ne2):
+    """
+    Pytorch implementation of _sparse_aff_mat_from_node_edge_aff. The output is a torch.sparse_coo_tensor
+    """
+    device, dtype, batch_size, n1, n2, ne1, ne2 = _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2,
+                                                                     n1, n2, ne1, ne2)
+    n1max = int(max(n1))
+    n2max = int(max(n2))
+    indices, values = [], []
+    for b in range(batch_size):
+        # edge-wise affinity
+        if edge_aff is not None:
+            conn1 = connectivity1[b][:ne1[b]].to(torch.long)
+            conn2 = connectivity2[b][:ne2[b]].to(torch.long)
+            # row index: start_g2 * n1max + start_g1, col index: end_g2 * n1max + end_g1
+            row = (conn2[:, 0].view(1, -1) * n1max + conn1[:, 0].view(-1, 1)).view(-1)
+            col = (conn2[:, 1].view(1, -1) * n1max + conn1[:, 1].view(-1, 1)).view(-1)
+            val = edge_aff[b, :ne1[b], :ne2[b]].reshape(-1)
+            if node_aff is not None: # the diagonal is overwritten by node-wise affinity
+                off_diag = row != col
+                row, col, val = row[off_diag], col[off_diag], val[off_diag]
+            indices.append(torch.stack((torch.full_like(row, b), row, col)))
+            values.append(val)
+        # node-wise affinity
+        if node_aff is not None:
+            diag = torch.arange(n2max * n1max, device=device)
+            indices.append(torch.stack((torch.full_like(diag, b), diag, diag)))
+            values.append(node_aff[b].transpose(0, 1).reshape(-1))
+
+    return torch.sparse_coo_tensor(torch.cat(indices, dim=1), torch.cat(values).to(dtype),
+                                   (batch_size, n2max * n1max, n2max * n1max)).coalesce()
+
+
+def _factorized_aff_mat_from_node_edge_aff(node_aff: Tensor, edge_aff: Tensor, connectivity1: Tensor,
+                                           connectivity2: Tensor, n1, n2, ne1, ne2):
+    """
+    Pytorch implementation of _factorized_aff_mat_from_node_edge_aff
+    """
+    device, dtype, batch_size, n1, n2, ne1, ne2 = _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2,
+                                                                     n1, n2, ne1, ne2)
+    if edge_aff is not None:
+        connectivity1 = connectivity1.to(torch.long)
+        connectivity2 = connectivity2.to(torch.long)
+        mask = _edge_pair_mask(edge_aff, ne1, ne2)
+        if node_aff is not None: # the diagonal is overwritten by node-wise affinity
+            loop1 = connectivity1[:, :, 0] == connectivity1[:, :, 1]
+            loop2 = connectivity2[:, :, 0] == connectivity2[:, :, 1]
+            mask = mask & ~(loop1.unsqueeze(2) & loop2.unsqueeze(1))
+        edge_aff = edge_aff * mask.to(dtype)
+    return node_aff, edge_aff, connectivity1, connectivity2, int(max(n1)), int(max(n2))
+
+
+def _edge_pair_mask(edge_aff, ne1, ne2):
+    """
+    The mask of valid (i.e. non-padded) edge pairs in the edge affinity matrix, output shape (b x ne1max x ne2max)
+    """
+    device = edge_aff.device
+    mask1 = torch.arange(edge_aff.shape[1], device=device).view(1, -1) < torch.as_tensor(ne1, device=device).view(-1, 1)
+    mask2 = torch.arange(edge_aff.shape[2], device=device).view(1, -1) < torch.as_tensor(ne2, device=device).view(-1, 1)
+    return mask1.unsqueeze(2) & mask2.unsqueeze(1)
+
+
+def _factorized_aff_matvec(node_aff, edge_aff, connectivity1, connectivity2, n1max, n2max, v):
+    """
+    Pytorch implementation of FactorizedAffinity.matvec
+    """
+    batch_size = v.shape[0]
+    x = v.reshape(batch_size, n2max, n1max, -1) # x[b, j, i] is the matching score of node i (G1) and node j (G2)
+    if node_aff is not None:
+        out = node_aff.transpose(1, 2).unsqueeze(-1) * x
+    else:
+        out = torch.zeros_like(x)
+    if edge_aff is not None:
+        num_channel = x.shape[-1]
+        b_idx = torch.arange(batch_size, device=v.device).view(-1, 1, 1)
+        # gather from the ending nodes: (b x ne1 x ne2 x c)
+        msg = x[b_idx, connectivity2[:, None, :, 1], connectivity1[:, :, None, 1]] * edge_aff.unsqueeze(-1)
+        # scatter to the starting nodes
+        idx = ((b_idx * n2max + connectivity2[:, None, :, 0]) * n1max + connectivity1[:, :, None, 0]).view(-1)
+        out = out.reshape(-1, num_channel).index_add(0, idx, msg.reshape(-1, num_channel).to(out.dtype))
+    return out.reshape(v.shape)
+
+
+def _factorized_aff_nnz(K):
+    """
+    Count the number of non-zero elements in each row of a FactorizedAffinity object, output shape (b x n1n2 x 1)
+    """
+    node_nz = (K.node_aff != 0).to(K.dtype) if K.node_aff is not None else None
+    edge_nz = (K.edge_aff != 0).to(K.dtype) if K.edge_aff is not None else None
+    ones = torch.ones(K.shape[0], K.shape[1], 1, dtype=K.dtype, device=K.device)
+    return _factorized_aff_matvec(node_nz, edge_nz, K.connectivity1, K.connectivity2, K.n1max, K.n2max, ones)
+
+
+def _get_aff_mat_sizes(node_aff, edge_aff, connectivity1, connectivity2, n1, n2, ne1, ne2):
+    """
+    Infer the device, dtype, batch size and number of nodes/edges for building the affinity matrix
+    """
     if edge_aff is not None:
         device = edge_aff.device
         dtype = edge_aff.dtype
@@ -1448,29 +2029,46 @@ def _aff_mat_from_node_edge_aff(node_aff: Tensor, edge_aff: Tensor, connectivity
             n1 = [node_aff.shape[1]] * batch_size
         if n2 is None:
             n2 = [node_aff.shape[2]] * batch_size
+    return device, dtype, batch_size, n1, n2, ne1, ne2
 
-    n1max = max(n1)
-    n2max = max(n2)
-    ks = []
-    for b in range(batch_size):
-        k = torch.zeros(n2max, n1max, n2max, n1max, dtype=dtype, device=device)
-        # edge-wise affinity
-        if edge_aff is not None:
-            conn1 = connectivity1[b][:ne1[b]]
-            conn2 = connectivity2[b][:ne2[b]]
-            edge_indices = torch.cat([conn1.repeat_interleave(ne2[b], dim=0), conn2.repeat(ne1[b], 1)],
-                                     dim=1)  # indices: start_g1, end_g1, start_g2, end_g2
-            edge_indices = (edge_indices[:, 2], edge_indices[:, 0], edge_indices[:, 3],
-                            edge_indices[:, 1])  # indices: start_g2, start_g1, end_g2, end_g1
-            k[edge_indices] = edge_aff[b, :ne1[b], :ne2[b]].reshape(-1)
-        k = k.reshape(n2max * n1max, n2max * n1max)
-        # node-wise affinity
-        if node_aff is not None:
-            k_diag = torch.diagonal(k)
-            k_diag[:] = node_aff[b].transpose(0, 1).reshape(-1)
-        ks.append(k)
 
-    return torch.stack(ks, dim=0)
+def _aff_matvec(K, v, out=None):
+    """
+    Pytorch implementation of the batched matrix-vector product between affinity matrix K and v. K can be a dense
+    Tensor, a sparse Tensor, or a FactorizedAffinity object. The result is written to out if given
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        ret = K.matvec(v)
+    elif K.is_sparse:
+        ret = torch.bmm(K, v)
+    else:
+        return torch.bmm(K, v, out=out)
+    if out is not None:
+        out.copy_(ret)
+        ret = out
+    return ret
+
+
+def _take_batch(K, idx):
+    """
+    Pytorch implementation of selecting the instances of index idx from the batched affinity matrix K. K can be a dense
+    Tensor, a sparse Tensor, or a FactorizedAffinity object
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        return pygmtools.utils.FactorizedAffinity(
+            *(None if _ is None else _[idx] for _ in (K.node_aff, K.edge_aff, K.connectivity1, K.connectivity2)),
+            K.n1max, K.n2max, backend=K.backend)
+    else:
+        return K.index_select(0, idx)
+
+
+def _requires_grad(K):
+    """
+    Check if the gradient is required for the affinity matrix K, which can be a Tensor or a FactorizedAffinity object
+    """
+    if type(K) is pygmtools.utils.FactorizedAffinity:
+        return any(type(_) is Tensor and _.requires_grad for _ in (K.node_aff, K.edge_aff))
+    return K.requires_grad
 
 
 def _check_data_type(input: Tensor, var_name, raise_err):
@@ -1501,6 +2099,8 @@ def _squeeze(input, dim):
     """
     Pytorch implementation of _squeeze
     """
+    if input.is_sparse:
+        return input.select(dim, 0) if input.shape[dim] == 1 else input
     return input.squeeze(dim)
 
 
@@ -263,11 +263,16 @@ class NGMConvLayer(nn.Module):
         """
         W_new = W
 
-        if norm is True:
-            A = F.normalize(A, p=1, dim=2)
-
         x1 = self.n_func(x)
-        x2 = torch.matmul((A.unsqueeze(-1) * W_new).permute(0, 3, 1, 2), x1.unsqueeze(2).permute(0, 3, 1, 2)).squeeze(-1).transpose(1, 2)
+        if type(W_new) is Tensor:
+            if norm is True:
+                A = F.normalize(A, p=1, dim=2)
+            x2 = torch.matmul((A.unsqueeze(-1) * W_new).permute(0, 3, 1, 2), x1.unsqueeze(2).permute(0, 3, 1, 2)).squeeze(-1).transpose(1, 2)
+        else:
+            # W is an implicit affinity operator (b x n x n), and A is the number of non-zeros in each row (b x n x 1)
+            x2 = W_new.matvec(x1)
+            if norm is True:
+                x2 = x2 / A.clamp(min=1e-12)
         x2 += self.n_self_func(x)
 
         if self.classifier is not None:
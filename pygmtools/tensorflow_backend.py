@@ -11,10 +11,9 @@
 import tensorflow as tf
 import tensorflow.experimental.numpy as tnp
 import numpy as np
-from multiprocessing import Pool
 
 import pygmtools.utils
-from pygmtools.numpy_backend import _hung_kernel
+from pygmtools.numpy_backend import _hung_batch
 
 
 #############################################
@@ -24,7 +23,7 @@ from pygmtools.numpy_backend import _hung_kernel
 
 def hungarian(s: tf.Tensor, n1: tf.Tensor=None, n2: tf.Tensor=None,
               unmatch1: tf.Tensor=None, unmatch2: tf.Tensor=None,
-              nproc: int=1) -> tf.Tensor:
+              nproc: int=None, topk: int=None) -> tf.Tensor:
     """
     Tensorflow implementation of Hungarian algorithm
     """
@@ -51,12 +50,7 @@ def hungarian(s: tf.Tensor, n1: tf.Tensor=None, n2: tf.Tensor=None,
         else:
             unmatch2 = [None] * batch_num
 
-    if nproc > 1:
-        with Pool(processes=nproc) as pool:
-            mapresult = pool.starmap_async(_hung_kernel, zip(perm_mat, n1, n2, unmatch1, unmatch2))
-            perm_mat = tnp.stack(mapresult.get())
-    else:
-        perm_mat = tnp.stack([_hung_kernel(perm_mat[b], n1[b], n2[b], unmatch1[b], unmatch2[b]) for b in range(batch_num)])
+    perm_mat = _hung_batch(perm_mat, n1, n2, unmatch1, unmatch2, nproc, topk)
 
 
     with tf.device(device):
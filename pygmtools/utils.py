@@ -19,6 +19,7 @@ import hashlib
 import importlib
 import importlib.util
 import inspect
+import numbers
 import os
 import shutil
 import time
@@ -94,9 +95,68 @@ def set_backend(new_backend: str):
     pygmtools.BACKEND = new_backend
 
 
+def set_nproc(nproc: int):
+    """
+    Set the default number of parallel workers for the CPU solvers (e.g. :func:`~pygmtools.linear_solvers.hungarian`).
+    The current setting is stored in the variable ``pygmtools.NPROC``.
+
+    :param nproc: int, number of parallel workers. ``1`` means no parallelization
+
+    .. note::
+        The workers are kept in a persistent pool which is reused across calls, therefore the parallelization also
+        pays off for small problems that are solved many times (e.g. Hungarian inside a training loop).
+
+    .. dropdown:: Example
+
+        ::
+
+            >>> import pygmtools as pygm
+            >>> pygm.utils.set_nproc(4) # all following calls to Hungarian use 4 workers by default
+            >>> pygm.NPROC
+            4
+    """
+    if not isinstance(nproc, numbers.Integral) or nproc < 1:
+        raise ValueError(f'nproc should be a positive integer, got {nproc}.')
+    pygmtools.NPROC = int(nproc)
+
+
+def set_compute_dtype(dtype: str=None):
+    """
+    Set the dtype policy of the classic graph matching solvers (:func:`~pygmtools.classic_solvers.rrwm`,
+    :func:`~pygmtools.classic_solvers.sm` and :func:`~pygmtools.classic_solvers.ipfp`). The current setting is stored
+    in the variable ``pygmtools.COMPUTE_DTYPE``.
+
+    :param dtype: string, the dtype of computation. Possible values are ``[None, 'float32', 'float64']``. ``None``
+                  means the solvers compute in the dtype of the input affinity matrix
+
+    .. note::
+        If ``dtype`` is set, the affinity matrix and the initial solution are cast to ``dtype`` before the iterations,
+        and all buffers are allocated in ``dtype``. The inner products for the line search of IPFP are accumulated in
+        ``float64`` anyway. Computing in ``float32`` halves the memory traffic of the matrix-vector products, at the
+        cost of a lower precision of the continuous solution.
+
+    .. note::
+        Only ``numpy`` backend is supported. For the other backends, please cast the input tensors directly.
+
+    .. dropdown:: Example
+
+        ::
+
+            >>> import pygmtools as pygm
+            >>> pygm.utils.set_compute_dtype('float32') # the classic solvers compute in float32 by default
+            >>> pygm.COMPUTE_DTYPE
+            'float32'
+            >>> pygm.utils.set_compute_dtype(None) # follow the dtype of the input
+    """
+    if dtype not in (None, 'float32', 'float64'):
+        raise ValueError(f'Unknown compute dtype {dtype}. Supported: None, float32, float64.')
+    pygmtools.COMPUTE_DTYPE = dtype
+
+
 def build_aff_mat(node_feat1, edge_feat1, connectivity1, node_feat2, edge_feat2, connectivity2,
                   n1=None, ne1=None, n2=None, ne2=None,
                   node_aff_fn=None, edge_aff_fn=None,
+                  layout: str='dense', out=None,
                   backend=None):
     r"""
     Build affinity matrix for graph matching from input node/edge features. The affinity matrix encodes both node-wise
@@ -129,12 +189,39 @@ def build_aff_mat(node_feat1, edge_feat1, connectivity1, node_feat2, edge_feat2,
                         ``edge_aff_fn(2D Tensor, 2D Tensor) -> 2D Tensor``, which accepts two edge feature tensors and
                         outputs the edge-wise affinity tensor. See :func:`~pygmtools.utils.inner_prod_aff_fn` as an
                         example.
+    :param layout: (default: ``'dense'``) the layout of the output affinity matrix. ``'dense'`` returns a dense tensor;
+                   ``'sparse'`` returns a sparse matrix which only stores the :math:`ne_1 ne_2 + n_1 n_2` non-zero
+                   elements; ``'factorized'`` returns a :class:`~pygmtools.utils.FactorizedAffinity` object which
+                   never builds the affinity matrix (``'sparse'`` and ``'factorized'`` are supported by ``numpy`` and
+                   ``pytorch`` backends, see the note below)
+    :param out: (optional) :math:`(b\times n_1n_2 \times n_1n_2)` a preallocated (contiguous) output tensor. If given,
+                the dense affinity matrix is written into ``out`` and no new memory is allocated for it. Only available
+                for ``layout='dense'`` with ``numpy`` and ``pytorch`` backends
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
     :return: :math:`(b\times n_1n_2 \times n_1n_2)` the affinity matrix
 
     .. note::
         This function also supports non-batched input, by ignoring all batch dimensions in the input tensors.
 
+    .. note::
+        The dense affinity matrix requires :math:`O((n_1 n_2)^2)` memory, which becomes prohibitive for large graphs.
+        With ``layout='sparse'``, the memory cost grows with the number of edges instead:
+
+        * ``numpy`` backend: a list of ``scipy.sparse.csr_matrix`` (one for each instance in the batch), or a single
+          ``scipy.sparse.csr_matrix`` for non-batched input;
+        * ``pytorch`` backend: a ``torch.sparse_coo_tensor`` of size :math:`(b\times n_1n_2 \times n_1n_2)`.
+
+        The sparse affinity matrix can be directly fed into :func:`~pygmtools.classic_solvers.rrwm`,
+        :func:`~pygmtools.classic_solvers.sm`, :func:`~pygmtools.classic_solvers.ipfp` and
+        :func:`~pygmtools.utils.compute_affinity_score`.
+
+        With ``layout='factorized'``, only the node/edge affinities and the connectivities are stored, and the
+        affinity matrix is applied implicitly (see :class:`~pygmtools.utils.FactorizedAffinity`). It requires
+        :math:`O(ne_1 ne_2 + n_1 n_2)` memory and computation for each matrix-vector product, and is accepted by
+        :func:`~pygmtools.classic_solvers.rrwm`, :func:`~pygmtools.classic_solvers.sm`,
+        :func:`~pygmtools.classic_solvers.ipfp`, :func:`~pygmtools.neural_solvers.ngm` and
+        :func:`~pygmtools.utils.compute_affinity_score`.
+
     .. note::
         If you want to implement your customized affinity function, make sure it respects the input & output dimensions:
 
@@ -330,8 +417,23 @@ def build_aff_mat(node_feat1, edge_feat1, connectivity1, node_feat2, edge_feat2,
     node_aff = node_aff_fn(node_feat1, node_feat2) if node_feat1 is not None else None
     edge_aff = edge_aff_fn(edge_feat1, edge_feat2) if edge_feat1 is not None else None
 
-    result = _aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2, n1, n2, ne1, ne2,
-                                         backend=backend)
+    if out is not None and layout != 'dense':
+        raise ValueError(f'The output buffer is only supported by the dense layout, got layout={layout}.')
+    if layout == 'dense':
+        if out is not None and non_batched_input:
+            out = _unsqueeze(out, 0, backend)
+        result = _aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2, n1, n2, ne1, ne2,
+                                             out=out, backend=backend)
+    elif layout == 'sparse':
+        result = _sparse_aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2,
+                                                    n1, n2, ne1, ne2, backend=backend)
+    elif layout == 'factorized':
+        result = FactorizedAffinity(*_factorized_aff_mat_from_node_edge_aff(node_aff, edge_aff,
+                                                                            connectivity1, connectivity2,
+                                                                            n1, n2, ne1, ne2, backend=backend),
+                                    backend=backend)
+    else:
+        raise ValueError(f'Unknown layout: {layout}. Supported layouts: [\'dense\', \'sparse\', \'factorized\']')
     if non_batched_input:
         return _squeeze(result, 0, backend)
     else:
@@ -739,7 +841,9 @@ def compute_affinity_score(X, K, backend=None):
     here :math:`\texttt{vec}` means column-wise vectorization.
 
     :param X: :math:`(b\times n_1 \times n_2)` the permutation matrix that represents the matching result
-    :param K: :math:`(b\times n_1n_2 \times n_1n_2)` the affinity matrix
+    :param K: :math:`(b\times n_1n_2 \times n_1n_2)` the affinity matrix. For ``numpy`` and ``pytorch`` backends, the
+              sparse affinity matrix built with ``layout='sparse'`` and the
+              :class:`~pygmtools.utils.FactorizedAffinity` object built with ``layout='factorized'`` are also supported
     :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
     :return: :math:`(b)` the objective score
 
@@ -1008,6 +1112,219 @@ class MultiMatchingResult:
         self.backend = 'numpy'
 
 
+class FactorizedAffinity:
+    r"""
+    A memory-efficient, implicit representation of the affinity matrix :math:`\mathbf{K}` built from node and edge
+    affinities. Following `"Zhou and De la Torre. Factorized Graph Matching. CVPR 2012."
+    <https://www.f-zhou.com/gm/2012_CVPR_FGM.pdf>`_, :math:`\mathbf{K}` is factorized as
+
+    .. math::
+        \mathbf{K} = \mathrm{diag}(\mathrm{vec}(\mathbf{K}_p)) +
+        (\mathbf{G}_2 \otimes \mathbf{G}_1) \mathrm{diag}(\mathrm{vec}(\mathbf{K}_e)) (\mathbf{H}_2 \otimes \mathbf{H}_1)^\top
+
+    where :math:`\mathbf{K}_p, \mathbf{K}_e` are the node-wise and edge-wise affinities, and
+    :math:`\mathbf{G}_1, \mathbf{H}_1, \mathbf{G}_2, \mathbf{H}_2` are the node-edge incidence matrices encoded by the
+    connectivities. The affinity matrix is never built: each product :math:`\mathbf{K}\mathbf{v}` costs
+    :math:`O(ne_1 ne_2 + n_1 n_2)` time and memory, compared with :math:`O((n_1 n_2)^2)` of the dense matrix.
+
+    This object is created by :func:`~pygmtools.utils.build_aff_mat` with ``layout='factorized'``, and it could be
+    directly fed into :func:`~pygmtools.classic_solvers.rrwm`, :func:`~pygmtools.classic_solvers.sm`,
+    :func:`~pygmtools.classic_solvers.ipfp`, :func:`~pygmtools.neural_solvers.ngm` and
+    :func:`~pygmtools.utils.compute_affinity_score`.
+
+    :param node_aff: :math:`(b\times n_1 \times n_2)` the node affinity matrix, or ``None``
+    :param edge_aff: :math:`(b\times ne_1 \times ne_2)` the edge affinity matrix (padded edges are zero), or ``None``
+    :param connectivity1: :math:`(b\times ne_1 \times 2)` sparse connectivity information of graph 1
+    :param connectivity2: :math:`(b\times ne_2 \times 2)` sparse connectivity information of graph 2
+    :param n1max: the maximum number of nodes in graph 1
+    :param n2max: the maximum number of nodes in graph 2
+    :param batched: (default: ``True``) if ``False``, this object behaves as a non-batched :math:`(n_1n_2 \times n_1n_2)`
+                    matrix
+    :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
+
+    .. note::
+        Only ``numpy`` and ``pytorch`` backends are supported.
+
+    .. dropdown:: Pytorch Example
+
+        ::
+
+            >>> import torch
+            >>> import pygmtools as pygm
+            >>> pygm.set_backend('pytorch')
+            >>> _ = torch.manual_seed(1)
+
+            # Generate a batch of graphs with 1000 nodes
+            >>> A1 = (torch.rand(1, 1000, 1000) > 0.998).float()
+            >>> A2 = (torch.rand(1, 1000, 1000) > 0.998).float()
+            >>> n1 = n2 = torch.tensor([1000])
+            >>> conn1, edge1, ne1 = pygm.utils.dense_to_sparse(A1)
+            >>> conn2, edge2, ne2 = pygm.utils.dense_to_sparse(A2)
+            >>> K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, n1, ne1, n2, ne2, layout='factorized')
+            >>> K.shape
+            (1, 1000000, 1000000)
+
+            # The dense affinity matrix of this size requires 4TB memory, but the factorized one fits in a laptop
+            >>> X = pygm.rrwm(K, n1, n2)
+            >>> X.shape
+            torch.Size([1, 1000, 1000])
+    """
+    def __init__(self, node_aff, edge_aff, connectivity1, connectivity2, n1max, n2max, batched=True, backend=None):
+        assert node_aff is not None or edge_aff is not None, 'at least one of node_aff and edge_aff should be given'
+        self.node_aff = node_aff
+        self.edge_aff = edge_aff
+        self.connectivity1 = connectivity1
+        self.connectivity2 = connectivity2
+        self.n1max = int(n1max)
+        self.n2max = int(n2max)
+        self.batched = batched
+        if backend is None:
+            self.backend = pygmtools.BACKEND
+        else:
+            self.backend = backend
+
+    @property
+    def _data(self):
+        return self.node_aff if self.node_aff is not None else self.edge_aff
+
+    @property
+    def shape(self):
+        n1n2 = self.n1max * self.n2max
+        if self.batched:
+            return _get_shape(self._data, self.backend)[0], n1n2, n1n2
+        else:
+            return n1n2, n1n2
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def device(self):
+        return self._data.device
+
+    def matvec(self, v):
+        r"""
+        Compute the batched product :math:`\mathbf{K}\mathbf{v}` without building :math:`\mathbf{K}`.
+
+        :param v: :math:`(b\times n_1n_2 \times c)` the input tensor
+        :return: :math:`(b\times n_1n_2 \times c)` the product
+        """
+        args = (self.node_aff, self.edge_aff, self.connectivity1, self.connectivity2, self.n1max, self.n2max, v)
+        try:
+            mod = importlib.import_module(f'pygmtools.{self.backend}_backend')
+            fn = mod._factorized_aff_matvec
+        except (ModuleNotFoundError, AttributeError):
+            raise NotImplementedError(
+                NOT_IMPLEMENTED_MSG.format(self.backend)
+            )
+        return fn(*args)
+
+    def __str__(self):
+        return f'FactorizedAffinity(shape={self.shape}, backend={self.backend})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def squeeze_(self, dim):
+        """
+        In-place operation to remove the batch dimension. Only ``dim=0`` with batch size 1 is supported.
+        """
+        assert dim == 0 and self.batched and self.shape[0] == 1, 'only the batch dimension of size 1 can be squeezed'
+        self.batched = False
+        return self
+
+    def unsqueeze_(self, dim):
+        """
+        In-place operation to add the batch dimension. Only ``dim=0`` is supported.
+        """
+        assert dim == 0 and not self.batched, 'only the batch dimension can be unsqueezed'
+        self.batched = True
+        return self
+
+
+class PairwiseAffinity:
+    r"""
+    A memory-efficient container of the pairwise affinity matrices for multi-graph matching. The dense input of
+    :func:`~pygmtools.multi_graph_solvers.cao` and :func:`~pygmtools.multi_graph_solvers.mgm_floyd` is a
+    :math:`(m\times m \times n^2 \times n^2)` tensor, e.g. it takes about 320GB for :math:`m=100, n=30`. This container
+    only stores :math:`\mathbf{K}_{i,j}` for :math:`i<j`, because :math:`\mathbf{K}_{j,i}` is the same affinity
+    with the two graphs swapped, and the diagonal pairs are not required by the solvers. Besides, the affinity
+    matrices can be stored in the sparse or factorized layout (see :func:`~pygmtools.utils.build_aff_mat`).
+
+    :param K: :math:`(\frac{m(m-1)}{2}\times n^2 \times n^2)` the batched affinity matrices of the pairs
+              :math:`(i, j), i<j` in the row-major order, i.e. :math:`(0, 1), (0, 2), ..., (0, m-1), (1, 2), ...`.
+              It can be built by :func:`~pygmtools.utils.build_aff_mat` with any ``layout``
+    :param num_graph: the number of graphs :math:`m`
+    :param backend: (default: ``pygmtools.BACKEND`` variable) the backend for computation.
+
+    .. note::
+        Only ``numpy`` and ``pytorch`` backends are supported.
+
+    .. dropdown:: Numpy Example
+
+        ::
+
+            >>> import numpy as np
+            >>> import pygmtools as pygm
+            >>> pygm.set_backend('numpy')
+            >>> np.random.seed(1)
+
+            # Generate 10 isomorphic graphs
+            >>> graph_num = 10
+            >>> As, X_gt = pygm.utils.generate_isomorphic_graphs(node_num=4, graph_num=10)
+            >>> i, j = np.triu_indices(graph_num, 1)
+
+            # Build the sparse affinity matrices of the pairs i < j
+            >>> conn1, edge1, ne1 = pygm.utils.dense_to_sparse(As[i])
+            >>> conn2, edge2, ne2 = pygm.utils.dense_to_sparse(As[j])
+            >>> import functools
+            >>> gaussian_aff = functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.) # set affinity function
+            >>> K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, None, None, None, edge_aff_fn=gaussian_aff, layout='sparse')
+            >>> K = pygm.utils.PairwiseAffinity(K, graph_num)
+            >>> K.shape
+            (10, 10, 16, 16)
+
+            # Solve the multi-matching problem
+            >>> X = pygm.cao(K)
+            >>> (X * X_gt).sum() / X_gt.sum()
+            1.0
+    """
+    def __init__(self, K, num_graph, backend=None):
+        self.K = K
+        self.num_graph = int(num_graph)
+        if backend is None:
+            self.backend = pygmtools.BACKEND
+        else:
+            self.backend = backend
+        num_pair = len(K) if type(K) is list else self.K.shape[0]
+        assert num_pair == self.num_graph * (self.num_graph - 1) // 2, \
+            f'K should contain {self.num_graph * (self.num_graph - 1) // 2} pairs for {self.num_graph} graphs, ' \
+            f'got {num_pair}'
+
+    @property
+    def shape(self):
+        aff_shape = self.K[0].shape if type(self.K) is list else self.K.shape[1:]
+        return (self.num_graph, self.num_graph) + tuple(aff_shape)
+
+    @property
+    def dtype(self):
+        return self.K[0].dtype if type(self.K) is list else self.K.dtype
+
+    def pair_index(self, idx1, idx2):
+        r"""
+        The index of the pair :math:`(i, j), i<j` in the batch dimension of ``K``.
+        """
+        assert idx1 < idx2, 'only the pairs (i, j) with i < j are stored'
+        return idx1 * self.num_graph - idx1 * (idx1 + 1) // 2 + idx2 - idx1 - 1
+
+    def __str__(self):
+        return f'PairwiseAffinity(shape={self.shape}, backend={self.backend})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
 def get_network(nn_solver_func, **params):
     r"""
     Get the network object of a neural network solver.
@@ -1124,7 +1441,7 @@ def permutation_loss(pred_dsmat, gt_perm, n1=None, n2=None, backend=None):
 
 
 def _aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2,
-                                n1, n2, ne1, ne2,
+                                n1, n2, ne1, ne2, out=None,
                                 backend=None):
     r"""
     Build affinity matrix K from node and edge affinity matrices.
@@ -1141,6 +1458,7 @@ def _aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2
                ``node_feat2`` or the values in ``connectivity2``
     :param ne2: :math:`(b)` number of edges in graph2. If not given, it will be inferred based on the shape of
                ``edge_feat2``
+    :param out: (optional) :math:`(b\times n_1n_2 \times n_1n_2)` the preallocated output tensor
     :return: :math:`(b\times n_1n_2 \times n_1n_2)` the affinity matrix
     """
     if backend is None:
@@ -1153,6 +1471,57 @@ def _aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2
         raise NotImplementedError(
             NOT_IMPLEMENTED_MSG.format(backend)
         )
+    if out is None:
+        return fn(*args)
+    else:
+        return fn(*args, out=out)
+
+
+def _sparse_aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2,
+                                       n1, n2, ne1, ne2,
+                                       backend=None):
+    r"""
+    Build sparse affinity matrix K from node and edge affinity matrices. Only the :math:`ne_1 ne_2 + n_1 n_2` non-zero
+    elements are stored.
+
+    See :func:`~pygmtools.utils._aff_mat_from_node_edge_aff` for the meaning of the arguments.
+
+    :return: :math:`(b\times n_1n_2 \times n_1n_2)` the sparse affinity matrix
+    """
+    if backend is None:
+        backend = pygmtools.BACKEND
+    args = (node_aff, edge_aff, connectivity1, connectivity2, n1, n2, ne1, ne2)
+    try:
+        mod = importlib.import_module(f'pygmtools.{backend}_backend')
+        fn = mod._sparse_aff_mat_from_node_edge_aff
+    except (ModuleNotFoundError, AttributeError):
+        raise NotImplementedError(
+            NOT_IMPLEMENTED_MSG.format(backend)
+        )
+    return fn(*args)
+
+
+def _factorized_aff_mat_from_node_edge_aff(node_aff, edge_aff, connectivity1, connectivity2,
+                                           n1, n2, ne1, ne2,
+                                           backend=None):
+    r"""
+    Prepare the arguments of :class:`~pygmtools.utils.FactorizedAffinity` from node and edge affinity matrices. The
+    padded edges (and the self-loop edges overwritten by node-wise affinity) are masked as zero in the edge affinity.
+
+    See :func:`~pygmtools.utils._aff_mat_from_node_edge_aff` for the meaning of the arguments.
+
+    :return: ``(node_aff, edge_aff, connectivity1, connectivity2, n1max, n2max)``
+    """
+    if backend is None:
+        backend = pygmtools.BACKEND
+    args = (node_aff, edge_aff, connectivity1, connectivity2, n1, n2, ne1, ne2)
+    try:
+        mod = importlib.import_module(f'pygmtools.{backend}_backend')
+        fn = mod._factorized_aff_mat_from_node_edge_aff
+    except (ModuleNotFoundError, AttributeError):
+        raise NotImplementedError(
+            NOT_IMPLEMENTED_MSG.format(backend)
+        )
     return fn(*args)
 
 
@@ -1187,6 +1556,12 @@ def _check_data_type(input, *args):
 
     if backend is None:
         backend = pygmtools.BACKEND
+    if type(input) is FactorizedAffinity:
+        if raise_err and input.backend != backend:
+            raise ValueError(f'Expected FactorizedAffinity of {backend} backend'
+                             f'{f" for variable {var_name}" if var_name is not None else ""}, '
+                             f'but got {input.backend} backend.')
+        return input.backend == backend
     args = (input, var_name, raise_err)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
@@ -1208,6 +1583,8 @@ def _check_shape(input, num_dim, backend=None):
     """
     if backend is None:
         backend = pygmtools.BACKEND
+    if type(input) is FactorizedAffinity:
+        return len(input.shape) == num_dim
     args = (input, num_dim)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
@@ -1228,6 +1605,8 @@ def _get_shape(input, backend=None):
     """
     if backend is None:
         backend = pygmtools.BACKEND
+    if type(input) is FactorizedAffinity:
+        return input.shape
     args = (input,)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
@@ -1249,6 +1628,8 @@ def _squeeze(input, dim, backend=None):
     """
     if backend is None:
         backend = pygmtools.BACKEND
+    if type(input) is FactorizedAffinity:
+        return copy.copy(input).squeeze_(dim)
     args = (input, dim)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
@@ -1270,6 +1651,8 @@ def _unsqueeze(input, dim, backend=None):
     """
     if backend is None:
         backend = pygmtools.BACKEND
+    if type(input) is FactorizedAffinity:
+        return copy.copy(input).unsqueeze_(dim)
     args = (input, dim)
     try:
         mod = importlib.import_module(f'pygmtools.{backend}_backend')
@@ -15,6 +15,7 @@ sys.path.insert(0, '.')
 import numpy as np
 import torch
 import functools
+import importlib
 import itertools
 from tqdm import tqdm
 
@@ -213,6 +214,68 @@ def _test_classic_solver_on_linear_assignment(num_nodes1, num_nodes2, node_feat_
             last_X = pygm.utils.to_numpy(_X)
 
 
+# The testing function for sparse/factorized affinity matrix
+def _test_aff_mat_layout(graph_num_nodes, node_feat_dim, layout, solver_funcs, backends):
+    batch_size = len(graph_num_nodes)
+    max_num_node = max(graph_num_nodes)
+
+    # Generate isomorphic graphs with padding
+    pygm.BACKEND = 'pytorch'
+    X_gt, A1, A2, F1, F2 = [], [], [], [], []
+    for num_node in graph_num_nodes:
+        As_b, X_gt_b, Fs_b = pygm.utils.generate_isomorphic_graphs(num_node, node_feat_dim=node_feat_dim)
+        X_gt.append(X_gt_b)
+        A1.append(As_b[0])
+        A2.append(As_b[1])
+        F1.append(Fs_b[0])
+        F2.append(Fs_b[1])
+    n1 = n2 = torch.tensor(graph_num_nodes, dtype=torch.int)
+    A1, A2, F1, F2, X_gt = (pygm.utils.build_batch(_) for _ in (A1, A2, F1, F2, X_gt))
+    A1, A2, F1, F2, n1, n2, X_gt = data_to_numpy(A1, A2, F1, F2, n1, n2, X_gt)
+    v = np.random.rand(batch_size, max_num_node ** 2, 3).astype(np.float32)
+
+    for working_backend in backends:
+        pygm.BACKEND = working_backend
+        _A1, _A2, _F1, _F2, _n1, _n2 = data_from_numpy(A1, A2, F1, F2, n1, n2)
+        _conn1, _edge1, _ne1 = pygm.utils.dense_to_sparse(_A1)
+        _conn2, _edge2, _ne2 = pygm.utils.dense_to_sparse(_A2)
+        aff_args = (_F1, _edge1, _conn1, _F2, _edge2, _conn2, _n1, _ne1, _n2, _ne2)
+        aff_kwargs = {'node_aff_fn': functools.partial(pygm.utils.gaussian_aff_fn, sigma=.1),
+                      'edge_aff_fn': functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.)}
+        dense_K = pygm.utils.build_aff_mat(*aff_args, **aff_kwargs)
+        out_K = data_from_numpy(np.ones((batch_size, max_num_node ** 2, max_num_node ** 2), dtype=np.float32))
+        pygm.utils.build_aff_mat(*aff_args, **aff_kwargs, out=out_K)
+        assert np.abs(pygm.utils.to_numpy(dense_K) - pygm.utils.to_numpy(out_K)).max() < 1e-6, \
+            f"Incorrect affinity matrix written to the output buffer for {working_backend}"
+        new_K = pygm.utils.build_aff_mat(*aff_args, **aff_kwargs, layout=layout)
+        if layout == 'sparse':
+            if working_backend == 'numpy':
+                new_K_np = np.stack([k.toarray() for k in new_K])
+            else:
+                new_K_np = new_K.to_dense().numpy()
+            assert new_K_np.shape == (batch_size, max_num_node ** 2, max_num_node ** 2)
+            assert np.abs(pygm.utils.to_numpy(dense_K) - new_K_np).max() < 1e-6, \
+                f"Incorrect {layout} affinity matrix for {working_backend}"
+        else:
+            assert new_K.shape == (batch_size, max_num_node ** 2, max_num_node ** 2)
+            new_Kv = pygm.utils.to_numpy(new_K.matvec(data_from_numpy(v)))
+            assert np.allclose(np.matmul(pygm.utils.to_numpy(dense_K), v), new_Kv, rtol=1e-4, atol=1e-4), \
+                f"Incorrect {layout} affinity matrix for {working_backend}"
+
+        dense_score = pygm.utils.to_numpy(pygm.utils.compute_affinity_score(data_from_numpy(X_gt), dense_K))
+        new_score = pygm.utils.to_numpy(pygm.utils.compute_affinity_score(data_from_numpy(X_gt), new_K))
+        assert np.abs(dense_score - new_score).max() < 1e-4, \
+            f"Incorrect affinity score with {layout} affinity matrix for {working_backend}"
+
+        for solver_func in solver_funcs:
+            if solver_func is pygm.ngm: # the same (randomly initialized) network is used for both inputs
+                solver_func = functools.partial(pygm.ngm, network=pygm.utils.get_network(pygm.ngm, pretrain=False))
+            dense_X = pygm.utils.to_numpy(solver_func(dense_K, _n1, _n2))
+            new_X = pygm.utils.to_numpy(solver_func(new_K, _n1, _n2))
+            assert np.abs(dense_X - new_X).sum() < 1e-4, \
+                f"Inconsistent GM solution with {layout} affinity matrix for {working_backend}, {solver_func}"
+
+
 # The testing function for networkx
 def _test_networkx(graph_num_nodes, backends):
     """
@@ -301,6 +364,7 @@ def test_hungarian(get_backend):
     backends = get_backends(get_backend)
     _test_classic_solver_on_linear_assignment(list(range(10, 30, 2)), list(range(30, 10, -2)), 10, pygm.hungarian, {
         'nproc': [1, 2, 4],
+        'topk': [None, 5],
         'outlier_num': [0, 5, 10]
     }, backends)
 
@@ -311,6 +375,35 @@ def test_hungarian(get_backend):
     }, backends)
 
 
+def test_hungarian_topk():
+    pygm.BACKEND = 'numpy'
+    np.random.seed(0)
+    batch_size, n1, n2, topk = 4, 20, 25, 5
+
+    # the optimal matching lies inside the topk candidates: the sparse result should be the dense one
+    s = np.random.rand(batch_size, n1, n2) * 0.1
+    for b in range(batch_size):
+        s[b, np.arange(n1), np.random.permutation(n2)[:n1]] += 1
+    unmatch1 = np.full((batch_size, n1), -1.)
+    unmatch2 = np.full((batch_size, n2), -1.)
+    assert np.all(pygm.hungarian(s, topk=topk) == pygm.hungarian(s)), \
+        'the topk Hungarian should give the dense result if the optimum lies inside the candidates'
+    assert np.all(pygm.hungarian(s, unmatch1=unmatch1, unmatch2=unmatch2, topk=topk) ==
+                  pygm.hungarian(s, unmatch1=unmatch1, unmatch2=unmatch2)), \
+        'the topk Hungarian with unmatch scores should give the dense result if the optimum lies inside the candidates'
+
+    # all rows share the same topk candidates, so that most rows are forced to be unmatched
+    s = np.random.rand(batch_size, n1, n2)
+    s[:, :, :topk] += 1
+    unmatch1 = np.zeros((batch_size, n1))
+    unmatch2 = np.zeros((batch_size, n2))
+    X = pygm.hungarian(s, unmatch1=unmatch1, unmatch2=unmatch2, topk=topk)
+    assert np.all((X == 0) | (X == 1)) and np.all(X.sum(axis=2) <= 1) and np.all(X.sum(axis=1) <= 1), \
+        'the topk Hungarian should return a partial permutation'
+    assert np.all(X[:, :, topk:] == 0) and np.all(X.sum(axis=(1, 2)) == topk), \
+        'the topk Hungarian should only match the candidates'
+
+
 def test_sinkhorn(get_backend):
     backends = get_backends(get_backend)
     # test non-symmetric matching
@@ -363,6 +456,64 @@ def test_sinkhorn(get_backend):
     _test_classic_solver_on_linear_assignment(*args5)
 
 
+def test_sinkhorn_dual(get_backend):
+    backends = [_ for _ in get_backends(get_backend) if _ not in ('mindspore', 'tensorflow')]
+    np.random.seed(0)
+    s = np.random.rand(4, 10, 12) / 0.1
+    n1 = np.array([10, 8, 6, 10])
+    n2 = np.array([12, 10, 6, 9])
+    for working_backend in backends:
+        pygm.set_backend(working_backend)
+        _s, _n1, _n2 = data_from_numpy(s, n1, n2)
+
+        # warm-starting from the dual potentials equals to running more iterations
+        X, dual = pygm.sinkhorn(_s, _n1, _n2, max_iter=10, return_dual=True)
+        X_warm = pygm.sinkhorn(_s, _n1, _n2, max_iter=10, dual=dual)
+        X_cold = pygm.sinkhorn(_s, _n1, _n2, max_iter=20)
+        assert np.allclose(pygm.utils.to_numpy(X_warm), pygm.utils.to_numpy(X_cold), atol=1e-4), \
+            f"Incorrect warm-started Sinkhorn for {working_backend}"
+
+        # early stopped instances satisfy the tolerance
+        X = pygm.utils.to_numpy(pygm.sinkhorn(_s, _n1, _n2, dummy_row=True, max_iter=1000, tol=1e-4))
+        for b in range(s.shape[0]):
+            err = np.abs(X[b, :n1[b], :n2[b]].sum(axis=1) - 1).max() if n1[b] <= n2[b] else \
+                np.abs(X[b, :n1[b], :n2[b]].sum(axis=0) - 1).max()
+            assert err < 1e-4, f"Sinkhorn does not converge for {working_backend}, err={err}"
+
+        # epsilon-scaling converges to the same solution with fewer iterations
+        s_eps = np.stack([np.eye(30)[np.random.permutation(30)] + np.random.rand(30, 30) for _ in range(4)])
+        _s_eps = data_from_numpy(s_eps)
+        X, num_iter = pygm.sinkhorn(_s_eps, tau=0.01, max_iter=5000, tol=1e-3, return_iter=True)
+        X_eps, num_iter_eps = pygm.sinkhorn(_s_eps, tau=0.01, max_iter=5000, tol=1e-3, tau_init=1.,
+                                            return_iter=True)
+        assert num_iter_eps < num_iter, f"Epsilon-scaling Sinkhorn is slower for {working_backend}"
+        assert np.abs(pygm.utils.to_numpy(X) - pygm.utils.to_numpy(X_eps)).max() < 1e-2, \
+            f"Incorrect epsilon-scaling Sinkhorn for {working_backend}"
+
+
+def test_sinkhorn_workspace():
+    # the inplace Sinkhorn of RRWM should be the same as sinkhorn, on padded, transposed and unequal-size instances
+    backends = ['pytorch', 'numpy']
+    np.random.seed(0)
+    cases = [
+        (np.random.rand(4, 6, 8) / 0.1, np.array([6, 3, 5, 2]), np.array([8, 7, 5, 4])),
+        (np.random.rand(4, 8, 6) / 0.1, np.array([8, 7, 3, 5]), np.array([6, 6, 5, 5])),
+        (np.random.rand(3, 6, 6) / 0.1, np.array([3, 6, 4]), np.array([5, 2, 4])),
+    ]
+    for working_backend in backends:
+        pygm.set_backend(working_backend)
+        mod = importlib.import_module(f'pygmtools.{working_backend}_backend')
+        for s, n1, n2 in cases:
+            for max_iter in [1, 2, 5]:
+                _s, _n1, _n2 = data_from_numpy(s, n1, n2)
+                X = pygm.utils.to_numpy(mod.sinkhorn(_s, _n1, _n2, max_iter=max_iter, batched_operation=True))
+                workspace = mod._SinkhornWorkspace(_n1, _n2, s.shape[1], s.shape[2], _s.dtype)
+                _s_inplace = data_from_numpy(s.copy())
+                workspace.sinkhorn(_s_inplace, max_iter)
+                assert np.allclose(pygm.utils.to_numpy(_s_inplace), X, atol=1e-6), \
+                    f"Incorrect inplace Sinkhorn for {working_backend}, shape={s.shape}, max_iter={max_iter}"
+
+
 def test_rrwm(get_backend):
     backends = get_backends(get_backend)
     if "mindspore" in backends:
@@ -418,6 +569,45 @@ def test_sm(get_backend):
     }, backends)
 
 
+def test_sm_eigen_solver():
+    backends = ['pytorch', 'numpy']
+    np.random.seed(0)
+    batch_size, nmax = 3, 10
+    n1 = n2 = np.array([10, 7, 9])
+    A1 = np.zeros((batch_size, nmax, nmax))
+    A2 = np.zeros((batch_size, nmax, nmax))
+    for b in range(batch_size):
+        A = np.random.rand(n1[b], n1[b])
+        perm = np.eye(n1[b])[np.random.permutation(n1[b])]
+        A1[b, :n1[b], :n1[b]] = A + A.T
+        A2[b, :n2[b], :n2[b]] = perm.T @ (A + A.T) @ perm
+    for working_backend in backends:
+        pygm.set_backend(working_backend)
+        _A1, _A2, _n1, _n2 = data_from_numpy(A1, A2, n1, n2)
+        conn1, edge1, ne1 = pygm.utils.dense_to_sparse(_A1)
+        conn2, edge2, ne2 = pygm.utils.dense_to_sparse(_A2)
+        eigen_solvers = ['lanczos', 'lobpcg'] if working_backend == 'numpy' else ['lobpcg']
+        layouts = ['dense', 'sparse', 'factorized'] if working_backend == 'numpy' else ['dense', 'sparse']
+        for layout in layouts:
+            K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, _n1, ne1, _n2, ne2,
+                                         edge_aff_fn=functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.),
+                                         layout=layout)
+            X_ref = pygm.utils.to_numpy(pygm.sm(K, _n1, _n2, max_iter=1000))
+            for eigen_solver in eigen_solvers:
+                X, num_iter = pygm.sm(K, _n1, _n2, eigen_solver=eigen_solver, return_iter=True)
+                assert pygm.utils.to_numpy(num_iter).shape == (batch_size,)
+                # the number of matrix-vector products is returned (the first LOBPCG step takes three of them)
+                assert np.all(pygm.utils.to_numpy(num_iter) >= 3), \
+                    f"Incorrect number of products of eigen_solver={eigen_solver} for {working_backend}"
+                assert np.abs(pygm.utils.to_numpy(X) - X_ref).max() < 1e-4, \
+                    f"Incorrect result of eigen_solver={eigen_solver} for {working_backend} with {layout} K"
+    try:
+        pygm.sm(K, _n1, _n2, eigen_solver='unknown')
+        assert False, "ValueError is not raised for unknown eigen_solver"
+    except ValueError:
+        pass
+
+
 def test_ipfp(get_backend):
     backends = get_backends(get_backend)
     _test_classic_solver_on_isomorphic_graphs(list(range(10, 30, 2)), 10, pygm.ipfp, {
@@ -432,8 +622,38 @@ def test_ipfp(get_backend):
         'edge_aff_fn': [functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.)],
         'node_aff_fn': [functools.partial(pygm.utils.gaussian_aff_fn, sigma=.1)]
     }, backends)
-    
-    
+
+
+def test_per_instance_convergence(get_backend):
+    backends = [_ for _ in get_backends(get_backend) if _ not in ('mindspore', 'tensorflow')]
+    np.random.seed(0)
+    batch_size, nmax = 4, 10
+    n1 = np.array([5, 8, 10, 7])
+    n2 = np.array([6, 8, 9, 10])
+    A1 = np.random.rand(batch_size, nmax, nmax) * (np.random.rand(batch_size, nmax, nmax) > 0.5)
+    A2 = np.random.rand(batch_size, nmax, nmax) * (np.random.rand(batch_size, nmax, nmax) > 0.5)
+    for b in range(batch_size):
+        A1[b, n1[b]:] = A1[b, :, n1[b]:] = 0
+        A2[b, n2[b]:] = A2[b, :, n2[b]:] = 0
+    for working_backend in backends:
+        pygm.set_backend(working_backend)
+        _A1, _A2, _n1, _n2 = data_from_numpy(A1, A2, n1, n2)
+        conn1, edge1, ne1 = pygm.utils.dense_to_sparse(_A1)
+        conn2, edge2, ne2 = pygm.utils.dense_to_sparse(_A2)
+        K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, _n1, ne1, _n2, ne2)
+        for solver in (pygm.rrwm, pygm.sm, pygm.ipfp):
+            X, num_iter = solver(K, _n1, _n2, return_iter=True)
+            X, num_iter = pygm.utils.to_numpy(X), pygm.utils.to_numpy(num_iter)
+            assert num_iter.shape == (batch_size,)
+            # the result of each instance should not depend on the other instances in the batch
+            for b in range(batch_size):
+                X_b, num_iter_b = solver(K[b:b+1], _n1[b:b+1], _n2[b:b+1], nmax, nmax, return_iter=True)
+                assert np.abs(pygm.utils.to_numpy(X_b)[0] - X[b]).max() < 1e-6, \
+                    f"Batched {solver.__name__} depends on other instances for {working_backend}"
+                assert pygm.utils.to_numpy(num_iter_b)[0] == num_iter[b], \
+                    f"Incorrect number of iterations of {solver.__name__} for {working_backend}"
+
+
 def test_astar():
     backends = ['pytorch'] # only pytorch backend is implemented
     # heuristic prediction
@@ -450,6 +670,63 @@ def test_astar():
         'node_aff_fn': [functools.partial(pygm.utils.gaussian_aff_fn, sigma=.1)],
     }, backends)
 
+    # batch-parallel mode
+    pygm.BACKEND = 'pytorch'
+    torch.manual_seed(0)
+    As, X_gt = pygm.utils.generate_isomorphic_graphs(8, 8)
+    n1 = n2 = torch.tensor([8] * 4)
+    conn1, edge1, ne1 = pygm.utils.dense_to_sparse(As[:4])
+    conn2, edge2, ne2 = pygm.utils.dense_to_sparse(As[4:])
+    K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, n1, ne1, n2, ne2,
+                                 edge_aff_fn=functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.))
+    X = pygm.astar(K, n1, n2, beam_width=2)
+    X_parallel = pygm.astar(K, n1, n2, beam_width=2, nproc=2)
+    assert torch.all(X == X_parallel), 'the parallel A* should give the same result as the serial one'
+    pygm.hungarian(torch.rand(4, 8, 8), nproc=2)
+    pools = pygm.numpy_backend._thread_pools
+    assert pools['astar'][1] is not pools['hungarian'][1], 'A* should not run in the thread pool of hungarian'
+
+    # the native heuristic of c_astar should be the same as the Python one
+    from pygmtools.c_astar import c_astar
+    from pygmtools.pytorch_astar_modules import heuristic_prediction_hun
+    # (the bounds of child nodes are repaired from the LSAP of their parent, for both matched and deleted nodes)
+    for n1, n2 in [(4, 5), (3, 5), (5, 5)]:
+        k = torch.rand((n1 + 1) * (n2 + 1), (n1 + 1) * (n2 + 1))
+        k = k + k.t()
+        x_python, size_python, bound_python = c_astar(
+            None, k, n1, n2, None, functools.partial(heuristic_prediction_hun, cache_dict={}), net_pred=False)
+        x_native, size_native, bound_native = c_astar(None, k, n1, n2, None, None, net_pred=False)
+        assert torch.all(x_python == x_native), \
+            f'the native A* heuristic should give the same result as the Python one for n1={n1}, n2={n2}'
+        assert size_python == size_native and abs(float(bound_python) - float(bound_native)) < 1e-4, \
+            f'the native A* heuristic should expand the same search tree as the Python one for n1={n1}, n2={n2}'
+
+    # budgeted and weighted A* (the bound is valid for GED-like problems, i.e. the edge costs -K are non-negative)
+    n1 = n2 = torch.tensor([6] * 4)
+    K = -torch.rand(4, 36, 36)
+    K = K + K.transpose(1, 2)
+    torch.diagonal(K, dim1=1, dim2=2)[:] = 2 * torch.rand(4, 36)
+    score = lambda _X: torch.einsum('bi,bij,bj->b', _X.transpose(1, 2).reshape(4, -1), K,
+                                    _X.transpose(1, 2).reshape(4, -1))
+    X_opt, bound_opt = pygm.astar(K, n1, n2, return_bound=True)
+    assert torch.allclose(score(X_opt), bound_opt, atol=1e-4), 'the bound of exact A* should be the optimal score'
+    for kwargs in [{'max_expansions': 3}, {'time_budget': 1e-6}, {'epsilon': 0.5}]:
+        X, bound = pygm.astar(K, n1, n2, return_bound=True, **kwargs)
+        assert torch.all(X.sum(dim=-1) <= 1) and torch.all(X.sum(dim=-2) <= 1), \
+            f'A* with {kwargs} should return a valid matching'
+        assert torch.all(score(X) <= score(X_opt) + 1e-4), f'A* with {kwargs} should not beat the optimum'
+        assert torch.all(bound >= score(X_opt) - 1e-4), f'A* with {kwargs} should return a valid bound'
+
+
+def test_sparse_aff_mat():
+    backends = ['pytorch', 'numpy']
+    _test_aff_mat_layout(list(range(10, 30, 4)), 10, 'sparse', [pygm.rrwm, pygm.sm, pygm.ipfp], backends)
+
+
+def test_factorized_aff_mat():
+    backends = ['pytorch', 'numpy']
+    _test_aff_mat_layout(list(range(10, 30, 4)), 10, 'factorized', [pygm.rrwm, pygm.sm, pygm.ipfp, pygm.ngm], backends)
+
 
 def test_networkx():
     backends = ['pytorch', 'numpy']
@@ -468,11 +745,14 @@ def test_pyg():
 
 if __name__ == '__main__':
     test_hungarian('all')
+    test_hungarian_topk()
     test_sinkhorn('all')
     test_rrwm('all')
     test_sm('all')
     test_ipfp('all')
     test_astar()
+    test_sparse_aff_mat()
+    test_factorized_aff_mat()
     test_networkx()
     test_graphml()
     test_pyg()
@@ -32,6 +32,59 @@ def test_set_backend():
             pass
 
 
+def test_set_nproc():
+    pygm.BACKEND = 'numpy'
+    s = np.random.rand(8, 20, 20)
+    X = pygm.hungarian(s)
+    pygm.utils.set_nproc(2)
+    assert pygm.NPROC == 2
+    X_parallel = pygm.hungarian(s)
+    pool = pygm.numpy_backend._thread_pools['hungarian'][1]
+    X_parallel2 = pygm.hungarian(s)
+    assert pygm.numpy_backend._thread_pools['hungarian'][1] is pool, 'the thread pool should be reused across calls'
+    assert np.all(X == X_parallel) and np.all(X == X_parallel2)
+    pygm.utils.set_nproc(np.int64(3))
+    assert pygm.NPROC == 3 and type(pygm.NPROC) is int
+    assert np.all(X == pygm.hungarian(s))
+    pygm.utils.set_nproc(1)
+    for nproc in [0, 1.5, '2']:
+        try:
+            pygm.utils.set_nproc(nproc)
+            assert False, 'set_nproc should raise an error for illegal input'
+        except ValueError:
+            pass
+
+
+def test_set_compute_dtype():
+    pygm.BACKEND = 'numpy'
+    np.random.seed(0)
+    n1 = n2 = np.array([6, 8, 7])
+    A1 = np.random.rand(3, 8, 8)
+    A2 = np.random.rand(3, 8, 8)
+    conn1, edge1, ne1 = pygm.utils.dense_to_sparse(A1)
+    conn2, edge2, ne2 = pygm.utils.dense_to_sparse(A2)
+    K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, n1, ne1, n2, ne2)
+    assert K.dtype == np.float64
+    for solver in (pygm.rrwm, pygm.sm, pygm.ipfp):
+        X = solver(K, n1, n2)
+        # no silent promotion to float64 if the input is float32
+        assert solver(K.astype(np.float32), n1, n2).dtype == np.float32
+        pygm.utils.set_compute_dtype('float32')
+        try:
+            assert pygm.COMPUTE_DTYPE == 'float32'
+            X_32 = solver(K, n1, n2)
+        finally:
+            pygm.utils.set_compute_dtype(None)
+        assert X_32.dtype == np.float32
+        assert np.all(pygm.hungarian(X, n1, n2) == pygm.hungarian(X_32, n1, n2))
+    assert pygm.sinkhorn(np.random.rand(3, 8, 8).astype(np.float32), n1, np.array([8, 5, 7])).dtype == np.float32
+    try:
+        pygm.utils.set_compute_dtype('float8')
+        assert False, 'set_compute_dtype should raise an error for illegal input'
+    except ValueError:
+        pass
+
+
 def test_generate_isomorphic_graphs():
     for backend in backends:
         pygm.BACKEND = backend
@@ -106,6 +159,8 @@ def test_multi_matching_result():
 
 if __name__ == '__main__':
     test_env_report()
+    test_set_nproc()
+    test_set_compute_dtype()
     test_generate_isomorphic_graphs()
     test_permutation_loss()
     test_multi_matching_result()
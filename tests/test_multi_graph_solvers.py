@@ -17,6 +17,7 @@ sys.path.insert(0, '.')
 import numpy as np
 import torch
 import functools
+import importlib
 import itertools
 from tqdm import tqdm
 
@@ -182,6 +183,59 @@ def test_cao():
     }, backends)
 
 
+def test_cao_chunked():
+    num_nodes = 5
+    num_graphs = 10
+    # memory_budget=1e-6 (i.e. about 1KB) forces one intermediate graph per block
+    _test_mgm_solver_on_isomorphic_graphs(num_graphs, num_nodes, 10, pygm.cao, 'lawler-qap', {
+        'mode': ['chunked'],
+        'memory_budget': [1e-6, 1.],
+        'x0': [None, 0.2, 0.5],
+        'lambda_init': [0.1, 0.3],
+        'edge_aff_fn': [functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.)],
+        'node_aff_fn': [functools.partial(pygm.utils.gaussian_aff_fn, sigma=.1)]
+    }, ['pytorch', 'numpy'])
+
+    # the chunked mode should return the same result as the time mode
+    pygm.set_backend('numpy')
+    np.random.seed(1)
+    As, X_gt = pygm.utils.generate_isomorphic_graphs(num_nodes, num_graphs)
+    As_1 = np.repeat(np.expand_dims(As, 1), num_graphs, axis=1).reshape((-1, num_nodes, num_nodes))
+    As_2 = np.repeat(np.expand_dims(As, 0), num_graphs, axis=0).reshape((-1, num_nodes, num_nodes))
+    x0 = X_gt.copy()
+    x0[0, 1] = x0[1, 0] = np.eye(num_nodes)
+    for working_backend in ['pytorch', 'numpy']:
+        pygm.set_backend(working_backend)
+        _As_1, _As_2, _x0 = data_from_numpy(As_1, As_2, x0)
+        conn1, edge1, ne1 = pygm.utils.dense_to_sparse(_As_1)
+        conn2, edge2, ne2 = pygm.utils.dense_to_sparse(_As_2)
+        K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, ne1, None, ne2,
+                                     edge_aff_fn=functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.))
+        K = K.reshape((num_graphs, num_graphs, num_nodes ** 2, num_nodes ** 2))
+        X_time = pygm.cao(K, x0=_x0, mode='time')
+        X_chunked = pygm.cao(K, x0=_x0, mode='chunked', memory_budget=1e-6)
+        assert np.all(pygm.utils.to_numpy(X_time) == pygm.utils.to_numpy(X_chunked)), \
+            f"chunked mode mismatches time mode for {working_backend}"
+
+
+def test_pair_consistency_cache():
+    num_nodes = 6
+    num_graphs = 7
+    np.random.seed(2)
+    _, X_gt = pygm.utils.generate_isomorphic_graphs(num_nodes, num_graphs)
+    for working_backend in ['pytorch', 'numpy']:
+        mod = importlib.import_module(f'pygmtools.{working_backend}_backend')
+        X = X_gt.copy()
+        pc_cache = mod._PairConsistencyCache(pygm.utils.from_numpy(X, backend=working_backend))
+        for i, j in [(0, 1), (2, 5), (6, 6)]:
+            X[i, j] = X[i, j][np.random.permutation(num_nodes)]
+            X[j, i] = X[i, j].T
+            _X = pygm.utils.from_numpy(X, backend=working_backend)
+            assert np.allclose(pygm.utils.to_numpy(pc_cache.update(_X)),
+                               pygm.utils.to_numpy(mod._get_batch_pc_opt(_X))), \
+                f"cached consistency mismatches for {working_backend}"
+
+
 def test_mgm_floyd():
     num_nodes = 5
     num_graphs = 10
@@ -195,6 +249,87 @@ def test_mgm_floyd():
     }, backends)
 
 
+def test_pairwise_affinity():
+    num_nodes = 5
+    num_graphs = 6
+    np.random.seed(4)
+    As, X_gt = pygm.utils.generate_isomorphic_graphs(num_nodes, num_graphs)
+    As_1 = np.repeat(np.expand_dims(As, 1), num_graphs, axis=1).reshape((-1, num_nodes, num_nodes))
+    As_2 = np.repeat(np.expand_dims(As, 0), num_graphs, axis=0).reshape((-1, num_nodes, num_nodes))
+    i, j = np.triu_indices(num_graphs, 1)
+    x0 = X_gt.copy()
+    x0[0, 1] = x0[1, 0] = np.eye(num_nodes)
+    edge_aff_fn = functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.)
+    for working_backend in ['pytorch', 'numpy']:
+        pygm.set_backend(working_backend)
+        _As_1, _As_2, _As_i, _As_j, _x0 = data_from_numpy(As_1, As_2, As[i], As[j], x0)
+        conn1, edge1, ne1 = pygm.utils.dense_to_sparse(_As_1)
+        conn2, edge2, ne2 = pygm.utils.dense_to_sparse(_As_2)
+        K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, ne1, None, ne2,
+                                     edge_aff_fn=edge_aff_fn)
+        K = K.reshape((num_graphs, num_graphs, num_nodes ** 2, num_nodes ** 2))
+        conn1, edge1, ne1 = pygm.utils.dense_to_sparse(_As_i)
+        conn2, edge2, ne2 = pygm.utils.dense_to_sparse(_As_j)
+        for layout in ['dense', 'sparse', 'factorized']:
+            K_pair = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, ne1, None, ne2,
+                                              edge_aff_fn=edge_aff_fn, layout=layout)
+            K_pair = pygm.utils.PairwiseAffinity(K_pair, num_graphs)
+            assert K_pair.shape == (num_graphs, num_graphs, num_nodes ** 2, num_nodes ** 2)
+            for solver, modes in [(pygm.cao, ['time', 'memory', 'chunked']), (pygm.mgm_floyd, ['time', 'memory'])]:
+                for mode in modes:
+                    X = solver(K, x0=_x0, mode=mode)
+                    X_pair = solver(K_pair, x0=_x0, mode=mode)
+                    assert np.all(pygm.utils.to_numpy(X) == pygm.utils.to_numpy(X_pair)), \
+                        f"PairwiseAffinity mismatches dense K for {working_backend}, {layout}, {solver.__name__}, {mode}"
+            X_pair = pygm.utils.to_numpy(pygm.cao(K_pair))
+            assert np.all(X_pair == X_gt), f"PairwiseAffinity fails without x0 for {working_backend}, {layout}"
+
+
+def test_mgm_floyd_online():
+    num_nodes = 5
+    num_graphs = 8
+    np.random.seed(3)
+    As, X_gt = pygm.utils.generate_isomorphic_graphs(num_nodes, num_graphs)
+    As_1 = np.repeat(np.expand_dims(As, 1), num_graphs, axis=1).reshape((-1, num_nodes, num_nodes))
+    As_2 = np.repeat(np.expand_dims(As, 0), num_graphs, axis=0).reshape((-1, num_nodes, num_nodes))
+    x0_new = X_gt[:-1, -1].copy()
+    x0_new[:2] = np.eye(num_nodes)  # wrong initial matchings to the new graph
+    last_X = None
+    for working_backend in ['pytorch', 'numpy']:
+        pygm.set_backend(working_backend)
+        _As_1, _As_2, _x0_new = data_from_numpy(As_1, As_2, x0_new)
+        conn1, edge1, ne1 = pygm.utils.dense_to_sparse(_As_1)
+        conn2, edge2, ne2 = pygm.utils.dense_to_sparse(_As_2)
+        K = pygm.utils.build_aff_mat(None, edge1, conn1, None, edge2, conn2, None, ne1, None, ne2,
+                                     edge_aff_fn=functools.partial(pygm.utils.gaussian_aff_fn, sigma=1.))
+        K = K.reshape((num_graphs, num_graphs, num_nodes ** 2, num_nodes ** 2))
+        mmX = pygm.utils.MultiMatchingResult()
+        for i in range(num_graphs - 1):
+            for j in range(i + 1, num_graphs - 1):
+                mmX[i, j] = pygm.utils.from_numpy(X_gt[i, j])
+        for budget in [2, None]:
+            new_mmX = pygm.mgm_floyd_online(mmX, K[:-1, -1], x0_new=_x0_new, budget=budget)
+            X_new = np.stack([pygm.utils.to_numpy(new_mmX[i, num_graphs - 1]) for i in range(num_graphs - 1)])
+            assert np.all(X_new == X_gt[:-1, -1]), f"online update fails for {working_backend}, budget={budget}"
+            assert len(mmX.match_dict) == (num_graphs - 1) * (num_graphs - 2) / 2, "the input should not be modified"
+        new_mmX = pygm.mgm_floyd_online(mmX, K[:-1, -1], budget=3)
+        X_new = np.stack([pygm.utils.to_numpy(new_mmX[i, num_graphs - 1]) for i in range(num_graphs - 1)])
+        if last_X is not None:
+            assert np.all(X_new == last_X), f"result mismatch for {working_backend}"
+        last_X = X_new
+        for budget in [0, 1.5]:
+            try:
+                pygm.mgm_floyd_online(mmX, K[:-1, -1], budget=budget)
+                assert False, 'mgm_floyd_online should raise an error for illegal budget'
+            except ValueError:
+                pass
+        try:
+            pygm.mgm_floyd_online(mmX, K[:-2, -1], budget=3)
+            assert False, 'mgm_floyd_online should raise an error if the number of graphs mismatches'
+        except ValueError:
+            pass
+
+
 def test_gamgm():
     num_nodes = 5
     num_graphs = 10
@@ -285,5 +420,9 @@ def test_gamgm_backward():
 if __name__ == '__main__':
     test_gamgm_backward()
     test_gamgm()
+    test_pair_consistency_cache()
     test_mgm_floyd()
+    test_mgm_floyd_online()
+    test_pairwise_affinity()
+    test_cao_chunked()
     test_cao()